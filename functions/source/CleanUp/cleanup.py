@@ -0,0 +1,158 @@
+"""
+Created on Oct 19, 2026
+
+The Lambda functions of the stack cleanup.  After a change, rebuild the package with:
+  zip -j -X functions/packages/CleanUp/lambda.zip functions/source/CleanUp/cleanup.py
+
+  handler - the Cleanup custom resource.  On Delete it starts the cleanup state machine,
+            which sends the response to CloudFormation when the teardown is done.
+            Other requests are answered right away.
+  step    - the Send, Check and Respond steps of the cleanup state machine.  Each step
+            returns the state for the next step, so no invocation waits on the teardown.
+
+The response to CloudFormation is sent with urllib rather than cfnresponse, because
+Lambda only provides cfnresponse to functions with inline (ZipFile) code.  The clients
+are taken from boto3, so the functions can be exercised with moto stand-ins.  See
+functions/tests/test_cleanup.py.
+"""
+import os
+import json
+import traceback
+from urllib.request import Request, urlopen
+
+import boto3
+
+SUCCESS = "SUCCESS"
+FAILED = "FAILED"
+
+# Statuses of an SSM command invocation that has not reached a final status.  The state
+# machine checks the command again after a wait while its status is one of these.
+PendingStatuses = ("Pending", "InProgress", "Delayed", "Cancelling")
+
+
+def _client(serviceName):
+    """
+    Return a boto3 client for the given service in the region of the stack.
+    """
+    return boto3.client(serviceName, region_name=os.environ['Region'])
+#endDef
+
+
+def sendResponse(event, context, status, reason, physicalResourceId=None):
+    """
+    Send the response to the given CloudFormation custom resource event.
+    """
+    logStream = getattr(context, 'log_stream_name', None)
+    if (logStream):
+        reason = "%s  See the details in CloudWatch log stream: %s" % (reason, logStream)
+    #endIf
+    body = json.dumps({'Status': status,
+                       'Reason': reason,
+                       'PhysicalResourceId': physicalResourceId or event.get('PhysicalResourceId') or event['LogicalResourceId'],
+                       'StackId': event['StackId'],
+                       'RequestId': event['RequestId'],
+                       'LogicalResourceId': event['LogicalResourceId'],
+                       'NoEcho': False,
+                       'Data': {}
+                      }).encode('utf-8')
+    print("Response: %s" % body)
+    request = Request(event['ResponseURL'], data=body, method='PUT',
+                      headers={'Content-Type': '', 'Content-Length': str(len(body))})
+    response = urlopen(request)
+    print("Response status code: %s" % response.getcode())
+#endDef
+
+
+def handler(event, context):
+    """
+    The Cleanup custom resource.
+    """
+    print("event_obj:", json.dumps(event))
+    if (event['RequestType'] != 'Delete'):
+        sendResponse(event, context, SUCCESS, "Nothing to do for a %s request." % event['RequestType'])
+        return
+    #endIf
+    try:
+        response = _client('stepfunctions').start_execution(stateMachineArn=os.environ['StateMachine'],
+                                                            input=json.dumps({"Event": event}))
+        print("Started cleanup execution: %s" % response['executionArn'])
+    except Exception as e:
+        traceback.print_exc()
+        sendResponse(event, context, FAILED, "Unable to start the cleanup state machine: %s" % e)
+    #endTry
+#endDef
+
+
+def send(event):
+    """
+    Send destroy.sh to the boot node.
+    """
+    response = _client('ssm').send_command(InstanceIds=[os.environ['BootNode']],
+                                           DocumentName="AWS-RunShellScript",
+                                           Parameters={"commands": ["/ibm/destroy.sh %s %s" % (os.environ['Storage'], os.environ['StackName'])],
+                                                       "executionTimeout": [os.environ['CommandTimeout']],
+                                                       "workingDirectory": ["/ibm"]},
+                                           Comment="Execute script in uninstall openshift",
+                                           TimeoutSeconds=120)
+    return {"Event": event['Event'], "CommandId": response['Command']['CommandId'], "Status": "Pending"}
+#endDef
+
+
+def check(event):
+    """
+    Return the status of the command.  The invocation does not exist until the command
+    has been delivered to the boot node, so it is Pending until then.
+    """
+    ssm = _client('ssm')
+    try:
+        status = ssm.get_command_invocation(CommandId=event['CommandId'], InstanceId=os.environ['BootNode'])['Status']
+    except ssm.exceptions.InvocationDoesNotExist:
+        status = "Pending"
+    #endTry
+    print("Command: %s status: %s" % (event['CommandId'], status))
+    return {"Event": event['Event'], "CommandId": event['CommandId'], "Status": status}
+#endDef
+
+
+def respond(event, context):
+    """
+    Respond to CloudFormation with the outcome of the cleanup.  The response is SUCCESS
+    only when the command succeeded.  A command that failed, timed out or was cancelled,
+    or a step of the state machine that failed, is reported as FAILED with the reason,
+    so a cleanup that left resources behind shows in the stack events.
+    """
+    cfnEvent = event['Event']
+    result = event.get('Result') or {}
+    commandId = result.get('CommandId')
+    status = result.get('Status')
+    error = result.get('Error')
+    if (error):
+        responseStatus = FAILED
+        reason = "The cleanup failed: %s: %s" % (error.get('Error'), error.get('Cause'))
+    elif (status == "Success"):
+        responseStatus = SUCCESS
+        reason = "The cleanup command %s completed." % commandId
+    else:
+        responseStatus = FAILED
+        reason = "The cleanup command %s ended with status: %s" % (commandId, status)
+    #endIf
+    sendResponse(cfnEvent, context, responseStatus, reason, cfnEvent.get('PhysicalResourceId'))
+    return {"Event": cfnEvent, "CommandId": commandId, "Status": status, "ResponseStatus": responseStatus}
+#endDef
+
+
+def step(event, context):
+    """
+    Run the step of the cleanup state machine named by the Action of the given event.
+    """
+    print("event_obj:", json.dumps(event))
+    action = event['Action']
+    if (action == 'Send'):
+        return send(event)
+    elif (action == 'Check'):
+        return check(event)
+    elif (action == 'Respond'):
+        return respond(event, context)
+    #endIf
+    raise ValueError("Unknown action: %s" % action)
+#endDef
@@ -0,0 +1,384 @@
+"""
+Tests of the cleanup Lambda functions in functions/source/CleanUp/cleanup.py with moto
+stand-ins for SSM, EC2 and Step Functions.  The state machine tests run the definition
+of CleanUpStateMachine from the template against the step function.
+
+Run with Python 3 and moto 5 or later:
+  python -m pytest functions/tests
+"""
+import os
+import sys
+import json
+
+import boto3
+import pytest
+import yaml
+from moto import mock_aws
+
+Root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(Root, "functions", "source", "CleanUp"))
+import cleanup
+
+Template = os.path.join(Root, "templates", "ibm-cloudpak-data.template.yaml")
+Region = "us-east-1"
+
+
+class TemplateLoader(yaml.SafeLoader):
+    """
+    A YAML loader that reads the CloudFormation intrinsic function tags as plain values.
+    """
+    pass
+#endClass
+
+def _constructTag(loader, tagSuffix, node):
+    if (isinstance(node, yaml.ScalarNode)):
+        return loader.construct_scalar(node)
+    elif (isinstance(node, yaml.SequenceNode)):
+        return loader.construct_sequence(node, deep=True)
+    #endIf
+    return loader.construct_mapping(node, deep=True)
+#endDef
+
+TemplateLoader.add_multi_constructor("!", _constructTag)
+
+
+def stateMachineDefinition():
+    """
+    Return the definition of CleanUpStateMachine from the template.
+    """
+    with open(Template) as templateFile:
+        template = yaml.load(templateFile, Loader=TemplateLoader)
+    #endWith
+    definition = template['Resources']['CleanUpStateMachine']['Properties']['DefinitionString'][0]
+    return json.loads(definition.replace("${StepLambda}", "CleanUpStepLambda"))
+#endDef
+
+
+def _parameters(parameters, state):
+    """
+    Return the input of a task from its Parameters.  Only the paths $ and $.<name> are used.
+    """
+    result = {}
+    for name, value in parameters.items():
+        if (name.endswith(".$")):
+            value = state if value == "$" else state[value[2:]]
+            name = name[:-2]
+        #endIf
+        result[name] = value
+    #endFor
+    return result
+#endDef
+
+
+def runStateMachine(state, context=None):
+    """
+    Run the cleanup state machine on the given input and return the list of the names of
+    the states it went through and its output.  Wait states do not wait and the Retry of a
+    task is not used, a failed task goes to its Catch.  A Fail state ends the run with the
+    error and cause of the state as its output.
+    """
+    definition = stateMachineDefinition()
+    name = definition['StartAt']
+    visited = []
+    while (True):
+        visited.append(name)
+        stateDefinition = definition['States'][name]
+        if (stateDefinition['Type'] == 'Task'):
+            try:
+                state = cleanup.step(_parameters(stateDefinition['Parameters'], state), context)
+            except Exception as e:
+                catch = stateDefinition['Catch'][0]
+                assert catch['ResultPath'] == "$.Error"
+                state = dict(state, Error={'Error': e.__class__.__name__, 'Cause': str(e)})
+                name = catch['Next']
+                continue
+            #endTry
+        elif (stateDefinition['Type'] == 'Choice'):
+            name = stateDefinition['Default']
+            for choice in stateDefinition['Choices']:
+                if (state[choice['Variable'][2:]] == choice['StringEquals']):
+                    name = choice['Next']
+                    break
+                #endIf
+            #endFor
+            continue
+        elif (stateDefinition['Type'] == 'Fail'):
+            return visited, {'Error': stateDefinition['Error'], 'Cause': stateDefinition['Cause']}
+        #endIf
+        if (stateDefinition.get('End')):
+            return visited, state
+        #endIf
+        name = stateDefinition['Next']
+    #endWhile
+#endDef
+
+
+class StatusSSM(object):
+    """
+    An SSM client that returns the given statuses, in turn, from get_command_invocation.
+    A status of None raises InvocationDoesNotExist.
+    """
+
+    def __init__(self, client, statuses):
+        self.client = client
+        self.exceptions = client.exceptions
+        self.statuses = list(statuses)
+    #endDef
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+    #endDef
+
+    def get_command_invocation(self, **kwargs):
+        status = self.statuses.pop(0)
+        if (status == None):
+            raise self.client.exceptions.InvocationDoesNotExist({'Error': {'Code': 'InvocationDoesNotExist', 'Message': ''}}, 'GetCommandInvocation')
+        #endIf
+        return {'CommandId': kwargs['CommandId'], 'InstanceId': kwargs['InstanceId'], 'Status': status}
+    #endDef
+#endClass
+
+
+def cfnEvent(requestType="Delete"):
+    return {'RequestType': requestType,
+            'ResponseURL': "https://cloudformation-custom-resource-response.example.com/response",
+            'StackId': "arn:aws:cloudformation:us-east-1:123456789012:stack/cpd/1",
+            'RequestId': "request-1",
+            'LogicalResourceId': "Cleanup",
+            'PhysicalResourceId': "cleanup-1",
+            'ResourceType': "Custom::Cleanup"}
+#endDef
+
+
+@pytest.fixture
+def responses(monkeypatch):
+    """
+    The bodies of the responses sent to CloudFormation.
+    """
+    sent = []
+
+    class Response(object):
+        def getcode(self):
+            return 200
+        #endDef
+    #endClass
+
+    def urlopen(request):
+        assert request.get_method() == 'PUT'
+        sent.append(json.loads(request.data.decode('utf-8')))
+        return Response()
+    #endDef
+
+    monkeypatch.setattr(cleanup, "urlopen", urlopen)
+    return sent
+#endDef
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    """
+    The moto stand-ins, with the boot node instance and the environment of the functions.
+    """
+    for name, value in (('AWS_ACCESS_KEY_ID', "testing"), ('AWS_SECRET_ACCESS_KEY', "testing"),
+                        ('AWS_DEFAULT_REGION', Region), ('Region', Region), ('Storage', "OCS"),
+                        ('StackName', "cpd"), ('CommandTimeout', "3000")):
+        monkeypatch.setenv(name, value)
+    #endFor
+    with mock_aws():
+        ec2 = boto3.client('ec2', region_name=Region)
+        imageId = ec2.describe_images()['Images'][0]['ImageId']
+        instanceId = ec2.run_instances(ImageId=imageId, MinCount=1, MaxCount=1)['Instances'][0]['InstanceId']
+        monkeypatch.setenv('BootNode', instanceId)
+        yield instanceId
+    #endWith
+#endDef
+
+
+def test_send(aws):
+    state = cleanup.step({'Action': "Send", 'Event': cfnEvent()}, None)
+
+    assert state['Status'] == "Pending"
+    assert state['Event'] == cfnEvent()
+    command = boto3.client('ssm', region_name=Region).list_commands(CommandId=state['CommandId'])['Commands'][0]
+    assert command['InstanceIds'] == [aws]
+    assert command['Parameters']['commands'] == ["/ibm/destroy.sh OCS cpd"]
+    assert command['Parameters']['executionTimeout'] == ["3000"]
+#endDef
+
+
+def test_check(aws):
+    state = cleanup.step({'Action': "Send", 'Event': cfnEvent()}, None)
+    state = cleanup.step({'Action': "Check", 'Event': state['Event'], 'CommandId': state['CommandId']}, None)
+
+    assert state['Status'] == "Success"
+#endDef
+
+
+def test_check_invocation_does_not_exist_is_pending(aws, monkeypatch):
+    state = cleanup.step({'Action': "Send", 'Event': cfnEvent()}, None)
+    # The command was sent to the boot node, not to this instance.
+    monkeypatch.setenv('BootNode', "i-00000000000000000")
+    state = cleanup.step({'Action': "Check", 'Event': state['Event'], 'CommandId': state['CommandId']}, None)
+
+    assert state['Status'] == "Pending"
+#endDef
+
+
+def test_respond_success(responses):
+    state = cleanup.step({'Action': "Respond", 'Event': cfnEvent(),
+                          'Result': {'CommandId': "c1", 'Status': "Success"}}, None)
+
+    assert state['ResponseStatus'] == cleanup.SUCCESS
+    assert len(responses) == 1
+    assert responses[0]['Status'] == "SUCCESS"
+    assert responses[0]['PhysicalResourceId'] == "cleanup-1"
+    assert responses[0]['RequestId'] == "request-1"
+#endDef
+
+
+@pytest.mark.parametrize("status", ["Failed", "TimedOut", "Cancelled"])
+def test_respond_command_not_successful(responses, status):
+    cleanup.step({'Action': "Respond", 'Event': cfnEvent(),
+                  'Result': {'CommandId': "c1", 'Status': status}}, None)
+
+    assert responses[0]['Status'] == "FAILED"
+    assert "c1" in responses[0]['Reason']
+    assert status in responses[0]['Reason']
+#endDef
+
+
+def test_respond_step_error(responses):
+    cleanup.step({'Action': "Respond", 'Event': cfnEvent(),
+                  'Result': {'Event': cfnEvent(), 'Error': {'Error': "States.Timeout", 'Cause': "no response"}}}, None)
+
+    assert responses[0]['Status'] == "FAILED"
+    assert "States.Timeout" in responses[0]['Reason']
+#endDef
+
+
+def test_state_machine_waits_while_pending(aws, monkeypatch, responses):
+    ssm = StatusSSM(boto3.client('ssm', region_name=Region), [None, "Pending", "InProgress", "Delayed", "Success"])
+    monkeypatch.setattr(cleanup, "_client", lambda serviceName: ssm)
+
+    visited, state = runStateMachine({'Event': cfnEvent()})
+
+    assert visited == ["Send"] + ["Wait", "Check", "Done"] * 5 + ["Respond"]
+    assert state['Status'] == "Success"
+    assert [response['Status'] for response in responses] == ["SUCCESS"]
+#endDef
+
+
+@pytest.mark.parametrize("status", ["Failed", "TimedOut", "Cancelled"])
+def test_state_machine_reports_failed_command(aws, monkeypatch, responses, status):
+    ssm = StatusSSM(boto3.client('ssm', region_name=Region), ["InProgress", "Cancelling", status])
+    monkeypatch.setattr(cleanup, "_client", lambda serviceName: ssm)
+
+    visited, state = runStateMachine({'Event': cfnEvent()})
+
+    assert visited[-1] == "Respond"
+    assert visited.count("Check") == 3
+    assert [response['Status'] for response in responses] == ["FAILED"]
+    assert status in responses[0]['Reason']
+#endDef
+
+
+def test_state_machine_reports_failed_send(aws, monkeypatch, responses):
+    def failingSend(event):
+        raise RuntimeError("InvalidInstanceId")
+    #endDef
+    monkeypatch.setattr(cleanup, "send", failingSend)
+
+    visited, state = runStateMachine({'Event': cfnEvent()})
+
+    assert visited == ["Send", "Respond"]
+    assert [response['Status'] for response in responses] == ["FAILED"]
+    assert "InvalidInstanceId" in responses[0]['Reason']
+#endDef
+
+
+def test_state_machine_sends_failed_when_response_fails(aws, monkeypatch, responses):
+    sendResponse = cleanup.sendResponse
+    attempts = []
+
+    def failingOnce(event, context, status, reason, physicalResourceId=None):
+        attempts.append(status)
+        if (len(attempts) == 1):
+            raise IOError("503 Slow Down")
+        #endIf
+        sendResponse(event, context, status, reason, physicalResourceId)
+    #endDef
+    monkeypatch.setattr(cleanup, "sendResponse", failingOnce)
+
+    visited, state = runStateMachine({'Event': cfnEvent()})
+
+    assert visited[-2:] == ["Respond", "RespondFailed"]
+    assert attempts == ["SUCCESS", "FAILED"]
+    assert [response['Status'] for response in responses] == ["FAILED"]
+    assert "503 Slow Down" in responses[0]['Reason']
+#endDef
+
+
+def test_state_machine_fails_when_no_response_can_be_sent(aws, monkeypatch):
+    def urlopen(request):
+        raise IOError("connection refused")
+    #endDef
+    monkeypatch.setattr(cleanup, "urlopen", urlopen)
+
+    visited, state = runStateMachine({'Event': cfnEvent()})
+
+    assert visited[-3:] == ["Respond", "RespondFailed", "ResponseNotSent"]
+    assert state['Error'] == "CleanupResponseNotSent"
+#endDef
+
+
+def test_state_machine_retries_responses_with_backoff():
+    states = stateMachineDefinition()['States']
+
+    for name in ("Respond", "RespondFailed"):
+        retry = states[name]['Retry'][0]
+        assert retry['ErrorEquals'] == ["States.ALL"]
+        assert retry['BackoffRate'] > 1
+        assert states[name]['Catch'][0]['ErrorEquals'] == ["States.ALL"]
+    #endFor
+#endDef
+
+
+def test_state_machine_waits_on_pending_statuses():
+    choices = stateMachineDefinition()['States']['Done']['Choices']
+
+    assert sorted(choice['StringEquals'] for choice in choices if choice['Next'] == "Wait") == sorted(cleanup.PendingStatuses)
+#endDef
+
+
+def test_handler_delete_starts_state_machine(aws, monkeypatch, responses):
+    sfn = boto3.client('stepfunctions', region_name=Region)
+    stateMachineArn = sfn.create_state_machine(name="cleanup", definition=json.dumps(stateMachineDefinition()),
+                                               roleArn="arn:aws:iam::123456789012:role/cleanup")['stateMachineArn']
+    monkeypatch.setenv('StateMachine', stateMachineArn)
+
+    cleanup.handler(cfnEvent(), None)
+
+    executions = sfn.list_executions(stateMachineArn=stateMachineArn)['executions']
+    assert len(executions) == 1
+    executionInput = json.loads(sfn.describe_execution(executionArn=executions[0]['executionArn'])['input'])
+    assert executionInput == {'Event': cfnEvent()}
+    # The state machine responds when the teardown is done.
+    assert responses == []
+#endDef
+
+
+def test_handler_delete_without_state_machine_fails(aws, monkeypatch, responses):
+    monkeypatch.setenv('StateMachine', "arn:aws:states:us-east-1:123456789012:stateMachine:missing")
+
+    cleanup.handler(cfnEvent(), None)
+
+    assert [response['Status'] for response in responses] == ["FAILED"]
+#endDef
+
+
+@pytest.mark.parametrize("requestType", ["Create", "Update"])
+def test_handler_responds_to_create_and_update(responses, requestType):
+    cleanup.handler(cfnEvent(requestType), None)
+
+    assert [response['Status'] for response in responses] == ["SUCCESS"]
+#endDef
@@ -0,0 +1,195 @@
+#!/usr/bin/python
+"""
+Microbenchmark of the cost of yapl.Trace records.
+
+Each scenario emits records from a number of threads at the same time and reports
+the records per second over all threads:
+  info            - info() records at level info, written to the trace log file and stdout
+  finest          - finest() records at level finest (*=all), written to the trace log file
+  finest-disabled - finest() records at level info, i.e., the cost of trace that is off
+  finest-disabled-lazy - the same with the message arguments passed to finest() to be
+                    formatted only if the record is emitted.  The scenario is reported
+                    as unsupported when the Trace module does not take message arguments.
+  error           - error() records with an exception, written with a stack dump
+
+Stdout is redirected to /dev/null while the records are emitted.
+
+The --sink option selects the trace sink, e.g., --sink async benchmarks the trace
+string option @sink=async.  The time of each scenario includes writing the queued
+records at the end of the scenario.  The --format option selects the format of the
+trace log file, e.g., --format json benchmarks the trace string option @format=json.
+The --persist option selects the persisted trace level, e.g., --persist info benchmarks
+the trace string option @persist=info, which keeps the finest records in a ring buffer.
+
+To compare with another version of Trace.py, e.g., the previous commit:
+  git show HEAD~1:scripts/yapl/Trace.py > /tmp/Trace_before.py
+  python benchmarks/trace_benchmark.py --trace-module /tmp/Trace_before.py
+  python benchmarks/trace_benchmark.py
+
+Usage:
+  trace_benchmark.py [--records <count per thread>] [--threads 1,4,8]
+                     [--scenarios info,finest,finest-disabled,finest-disabled-lazy,error]
+                     [--sink sync|async] [--format text|json] [--persist <level>]
+                     [--trace-module <path to Trace.py>]
+                     [--logfile <trace log path>]
+"""
+import sys, os, imp, inspect, tempfile, threading, time
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import yapl.Utilities as Utilities
+
+ArgsSignature = {
+                '--records': 'int',
+                '--threads': 'string',
+                '--scenarios': 'string',
+                '--sink': 'string',
+                '--format': 'string',
+                '--persist': 'string',
+                '--trace-module': 'string',
+                '--logfile': 'string'
+               }
+
+# Each scenario is (name, trace level name, trace method name, with exception, lazy format)
+Scenarios = [
+    ("info", "info", "info", False, False),
+    ("finest", "finest", "finest", False, False),
+    ("finest-disabled", "info", "finest", False, False),
+    ("finest-disabled-lazy", "info", "finest", False, True),
+    ("error", "info", "error", True, False)
+]
+
+
+def loadTraceModule(tracePath):
+    """
+    Return the Trace module to benchmark, either the one at the given path or yapl.Trace.
+    """
+    if (tracePath):
+        return imp.load_source("TraceUnderTest",tracePath)
+    #endIf
+    import yapl.Trace as TraceModule
+    return TraceModule
+#endDef
+
+
+def supportsLazyFormat(TraceModule, methodName):
+    """
+    Return True if the given trace method of the given Trace module takes message
+    arguments to be formatted only if the record is emitted.  Versions of Trace.py
+    before the message arguments were added take only the method name and message.
+    """
+    return inspect.getargspec(getattr(TraceModule.Trace,methodName)).varargs != None
+#endDef
+
+
+def emitRecords(trace, methodName, count, withException, lazy):
+    """
+    Emit count records with the given trace method of the given Trace instance.
+    """
+    emit = getattr(trace,methodName)
+    if (withException):
+        try:
+            raise ValueError("benchmark exception")
+        except ValueError as e:
+            for i in range(count):
+                emit("emitRecords","Record %d of the benchmark with an exception" % i,e)
+            #endFor
+        #endTry
+    elif (lazy):
+        for i in range(count):
+            emit("emitRecords","Record %d of the benchmark emitted by %s",i,methodName)
+        #endFor
+    else:
+        for i in range(count):
+            emit("emitRecords","Record %d of the benchmark emitted by %s" % (i,methodName))
+        #endFor
+    #endIf
+#endDef
+
+
+def runScenario(TraceModule, scenario, threadCount, records):
+    """
+    Return the records per second for the given scenario with the given number of threads.
+    """
+    name,levelName,methodName,withException,lazy = scenario
+    trace = TraceModule.Trace("trace_benchmark.%s" % name)
+    trace.setTraceLevel(levelName)
+    threads = [threading.Thread(target=emitRecords,args=(trace,methodName,records,withException,lazy))
+               for i in range(threadCount)]
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull,"w")
+    try:
+        beginTime = time.time()
+        for worker in threads:
+            worker.start()
+        #endFor
+        for worker in threads:
+            worker.join()
+        #endFor
+        if (hasattr(TraceModule,"flushTraceLog")):
+            TraceModule.flushTraceLog()
+        #endIf
+        elapsed = time.time() - beginTime
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    #endTry
+    return (threadCount * records) / elapsed
+#endDef
+
+
+def main(argv):
+    cmdLineArgs = Utilities.getInputArgs(ArgsSignature,argv[1:])
+    records = cmdLineArgs.get('records') or 20000
+    threadCounts = [int(count) for count in (cmdLineArgs.get('threads') or "1,4,8").split(",")]
+    names = (cmdLineArgs.get('scenarios') or ",".join([scenario[0] for scenario in Scenarios])).split(",")
+    tracePath = cmdLineArgs.get('trace-module')
+    logPath = cmdLineArgs.get('logfile')
+    if (not logPath):
+        logFd,logPath = tempfile.mkstemp(prefix="trace_benchmark_",suffix=".log")
+        os.close(logFd)
+    #endIf
+
+    TraceModule = loadTraceModule(tracePath)
+    TraceModule.openTraceLog(logPath)
+    sink = cmdLineArgs.get('sink')
+    traceFormat = cmdLineArgs.get('format')
+    persist = cmdLineArgs.get('persist')
+    options = []
+    if (sink):
+        options.append("@sink=%s" % sink)
+    #endIf
+    if (traceFormat):
+        options.append("@format=%s" % traceFormat)
+    #endIf
+    if (persist):
+        options.append("@persist=%s" % persist)
+    #endIf
+    if (options):
+        TraceModule.configureTrace("trace_benchmark.*=info:%s" % ":".join(options))
+    #endIf
+    try:
+        print "Trace module: %s" % TraceModule.__file__
+        print "Trace sink: %s, format: %s, persist: %s" % (sink or "default",traceFormat or "default",persist or "all")
+        print "Records per thread: %d, trace log: %s" % (records,logPath)
+        print "%-20s %8s %14s" % ("scenario","threads","records/sec")
+        for scenario in Scenarios:
+            if (scenario[0] not in names): continue
+            if (scenario[4] and not supportsLazyFormat(TraceModule,scenario[2])):
+                print "%-20s %8s %14s" % (scenario[0],"-","unsupported")
+                continue
+            #endIf
+            for threadCount in threadCounts:
+                rate = runScenario(TraceModule,scenario,threadCount,records)
+                print "%-20s %8d %14.0f" % (scenario[0],threadCount,rate)
+            #endFor
+        #endFor
+    finally:
+        TraceModule.closeTraceLog()
+    #endTry
+    return 0
+#endDef
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
+#endIf
@@ -41,8 +41,11 @@ mkdir -p artifacts
 mkdir -p  templates
 chmod +x /ibm/cpd_install.py
 chmod +x /ibm/destroy.sh
+chmod +x /ibm/cpd_destroy.py
 echo $HOME
 export KUBECONFIG=/root/.kube/config
 echo $KUBECONFIG
 echo $PATH
-/ibm/cpd_install.py --region "${AWS_REGION}" --stackid "${AWS_STACKID}" --stack-name ${AWS_STACKNAME} --logfile $LOGFILE --loglevel "*=all"
\ No newline at end of file
+# Only the trace of cpd_install.py, which polls while it waits on the installation, is rate
+# limited.  Its trace entity is __main__ since it is run as a script.
+/ibm/cpd_install.py --region "${AWS_REGION}" --stackid "${AWS_STACKID}" --stack-name ${AWS_STACKNAME} --logfile $LOGFILE --loglevel "*=all:@sink=async:@rotate.size=64M:@stackDedupWindow=5m:@ratelimit.__main__=5m"
\ No newline at end of file
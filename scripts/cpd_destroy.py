@@ -0,0 +1,173 @@
+#!/usr/bin/python
+import sys, os.path, json
+import boto3
+import yapl.Utilities as Utilities
+from subprocess import Popen
+from yapl.Trace import Trace, Level
+from yapl.TaskRunner import TaskRunner
+import yapl.RateLimiter as RateLimiter
+from cpd_install import CPDInstall, PortworxIAMStateFile
+
+TR = Trace(__name__)
+
+class CPDDestroy(CPDInstall):
+    """
+    Tear down the OpenShift cluster and the resources created for it by cpd_install.py.
+
+    The teardown replaces the aws CLI calls of destroy.sh with boto3 clients:
+      1. For Portworx, set DeleteOnTermination on the EBS volumes of the worker
+         instances.  The modify_instance_attribute calls run concurrently.
+      2. Run openshift-install destroy cluster and, for Portworx, detach and delete
+         the Portworx IAM policy at the same time.
+    """
+    ArgsSignature = {
+                    '--region': 'string',
+                    '--storage': 'string',
+                    '--stack-name': 'string',
+                    '--logfile': 'string',
+                    '--loglevel': 'string',
+                    '--trace': 'string'
+                   }
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        CPDInstall.__init__(self)
+        self.installDir = os.path.join(self.home,"installDir")
+    #endDef
+
+    def readInstallMetadata(self):
+        """
+        Return the dictionary in the metadata.json that openshift-install writes to the
+        install directory.  The metadata holds the cluster infrastructure ID (the cluster
+        ID used in the worker instance names) and the region.
+        """
+        metadataPath = os.path.join(self.installDir,"metadata.json")
+        with open(metadataPath,'r') as metadataFile:
+            return json.load(metadataFile)
+        #endWith
+    #endDef
+
+    def setpxVolumePermission(self):
+        """
+        Set DeleteOnTermination on all block devices of the worker instances so the
+        volumes created by Portworx are deleted with the instances.
+        """
+        methodName = "setpxVolumePermission"
+        tag_value = self.clusterID+"-worker*"
+        TR.info(methodName,"Get worker instances with tag Name: %s" % tag_value)
+        paginator = self.ec2.get_paginator('describe_instances')
+        updates = TaskRunner(name="EBS DeleteOnTermination updates",maxWorkers=16)
+        for page in paginator.paginate(Filters=[{'Name': 'tag:Name','Values': [tag_value]}]):
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    for device in instance.get('BlockDeviceMappings',[]):
+                        updates.add("%s:%s" % (instance['InstanceId'],device['DeviceName']),
+                                    self.ec2.modify_instance_attribute,
+                                    InstanceId=instance['InstanceId'],
+                                    BlockDeviceMappings=[{'DeviceName': device['DeviceName'],'Ebs': {'DeleteOnTermination': True}}])
+                    #endFor
+                #endFor
+            #endFor
+        #endFor
+        updates.run(raiseOnError=False)
+        updates.traceTimings(methodName)
+        TR.info(methodName,"Modified %d of %d worker block devices" % (len(updates.results),len(updates.tasks)))
+    #endDef
+
+    def deletePortworxPolicy(self):
+        """
+        Detach the Portworx policy from the worker role and delete it.  The role name and
+        policy ARN are recorded by cpd_install.py when the policy is created.
+        """
+        methodName = "deletePortworxPolicy"
+        if (not os.path.exists(PortworxIAMStateFile)):
+            TR.info(methodName,"No Portworx IAM state file: %s, nothing to delete." % PortworxIAMStateFile)
+            return
+        #endIf
+        with open(PortworxIAMStateFile,'r') as stateFile:
+            state = json.load(stateFile)
+        #endWith
+        TR.info(methodName,"Detach policy %s from role %s" % (state['PolicyArn'],state['RoleName']))
+        self.iam.detach_role_policy(RoleName=state['RoleName'],PolicyArn=state['PolicyArn'])
+        self.iam.delete_policy(PolicyArn=state['PolicyArn'])
+        TR.info(methodName,"Deleted policy %s" % state['PolicyArn'])
+    #endDef
+
+    def destroyCluster(self, destroyLogFile):
+        """
+        Run openshift-install destroy cluster and return its return code.
+        """
+        methodName = "destroyCluster"
+        destroy_cmd = "sudo /ibm/openshift-install destroy cluster --dir="+self.installDir+" --log-level=info"
+        TR.info(methodName,"Run %s" % destroy_cmd)
+        process = Popen(destroy_cmd,shell=True,stdout=destroyLogFile,stderr=destroyLogFile,close_fds=True)
+        retcode = process.wait()
+        TR.info(methodName,"%s returned %s" % (destroy_cmd,retcode))
+        return retcode
+    #endDef
+
+    def main(self,argv):
+        methodName = "main"
+        self.rc = 0
+        cmdLineArgs = Utilities.getInputArgs(self.ArgsSignature,argv[1:])
+        trace, logFile = self._configureTraceAndLogging(cmdLineArgs)
+        if (trace):
+            TR.info(methodName,"Tracing with specification: '%s' to log file: '%s'" % (trace,logFile))
+        #endIf
+        storage = cmdLineArgs.get('storage')
+        stackName = cmdLineArgs.get('stack-name')
+        with TR.span(methodName,"Destroy cluster",level=Level.INFO):
+            try:
+                metadata = self.readInstallMetadata()
+                self.clusterID = metadata.get('infraID')
+                self.region = cmdLineArgs.get('region')
+                if (not self.region):
+                    self.region = metadata.get('aws',{}).get('region')
+                #endIf
+                TR.info(methodName,"Destroy cluster %s of stack %s in region %s with storage %s" % (self.clusterID,stackName,self.region,storage))
+
+                self.ec2 = RateLimiter.attach(boto3.client('ec2', region_name=self.region))
+                self.iam = RateLimiter.attach(boto3.client('iam',region_name=self.region))
+
+                destroyLogPath = os.path.join(self.logsHome,"cpd_destroy.log")
+                with open(destroyLogPath,"a+") as destroyLogFile:
+                    if (storage == "Portworx"):
+                        # A failure here must not keep the cluster from being destroyed.
+                        with TR.span(methodName,"Set Portworx volume permissions",level=Level.INFO):
+                            try:
+                                self.setpxVolumePermission()
+                            except Exception as e:
+                                TR.error(methodName,"Setting Portworx volume permissions failed: %s" % e, e)
+                                self.rc = 1
+                            #endTry
+                        #endWith
+                    #endIf
+
+                    teardown = TaskRunner(name="Teardown")
+                    teardown.add("destroyCluster", self.destroyCluster, destroyLogFile)
+                    if (storage == "Portworx"):
+                        teardown.add("deletePortworxPolicy", self.deletePortworxPolicy)
+                    #endIf
+                    teardown.run(raiseOnError=False)
+                    teardown.traceTimings(methodName)
+                    if (teardown.exceptions or teardown.results.get('destroyCluster') != 0):
+                        self.rc = 1
+                    #endIf
+                #endWith
+            except Exception as e:
+                TR.error(methodName,"Exception with message %s" % e, e)
+                self.rc = 1
+            #endTry
+        #endWith
+        RateLimiter.traceReport(methodName)
+        # The return code becomes the status of the SSM command that the cleanup
+        # state machine of the CloudFormation stack is checking.
+        return self.rc
+    #endDef
+#endClass
+if __name__ == '__main__':
+  mainInstance = CPDDestroy()
+  sys.exit(mainInstance.main(sys.argv))
+#endIf
@@ -0,0 +1,232 @@
+"""
+Failure-time diagnostics for a Cloud Pak for Data deployment.
+
+When the installation fails, the cluster side evidence (pod logs and events of
+the operator and CPD namespaces, the cpdservice status, the cluster operators and
+the node conditions) is collected before the stack is rolled back and the
+cluster is destroyed.  The oc commands run concurrently under a strict time
+budget so the collection can not hold up the failure of the stack.  The output
+of each command is written to a file and the files are archived in a tar.gz.
+"""
+import os, signal, tarfile, threading, time
+from subprocess import Popen, PIPE, STDOUT
+import yapl.Utilities as Utilities
+from yapl.Trace import Trace, Level
+from yapl.TaskRunner import TaskRunner
+
+TR = Trace(__name__)
+
+# Commands for the cluster as a whole.  Each entry is (file name, command).
+ClusterCommands = [
+    ("nodes.txt", "oc get nodes -o wide"),
+    ("nodes-describe.txt", "oc describe nodes"),
+    ("clusterversion.txt", "oc get clusterversion -o yaml"),
+    ("clusteroperators.txt", "oc get clusteroperators"),
+    ("cpdservices.yaml", "oc get cpdservice --all-namespaces -o yaml"),
+    ("pvc.txt", "oc get pvc --all-namespaces -o wide"),
+    ("csv.txt", "oc get csv --all-namespaces")
+]
+
+# Commands for each namespace.  The namespace is substituted for %(ns)s.
+NamespaceCommands = [
+    ("pods.txt", "oc get pods -n %(ns)s -o wide"),
+    ("events.txt", "oc get events -n %(ns)s --sort-by=.lastTimestamp"),
+    ("pods-describe.txt", "oc describe pods -n %(ns)s")
+]
+
+# Command for the logs of each pod of a namespace.
+PodLogsCommand = "oc logs -n %(ns)s %(pod)s --all-containers --tail=%(tail)d"
+PodLogsTail = 5000
+
+
+class DiagnosticsCollector(object):
+    """
+    Run the diagnostics commands concurrently with a time budget and archive their output.
+
+    Usage:
+      collector = DiagnosticsCollector(namespaces=["cpd-meta-ops","zen"],outputDir="/ibm/diagnostics")
+      archivePath = collector.run()
+    """
+
+    def __init__(self, namespaces=None, outputDir=None, budget=300, commandTimeout=120, maxWorkers=8):
+        """
+        namespaces - list of the namespaces to collect pods, events and pod logs from
+        outputDir - directory for the command output and the archive
+        budget - the number of seconds the whole collection may take
+        commandTimeout - the number of seconds any one command may take
+        maxWorkers - the maximum number of commands that run at the same time
+        """
+        object.__init__(self)
+        self.namespaces = [ns for ns in (namespaces or []) if ns]
+        self.outputDir = outputDir
+        self.budget = budget
+        self.commandTimeout = commandTimeout
+        self.maxWorkers = maxWorkers
+        self.deadline = None
+        # Each entry is a tuple (file name, return code, elapsed ms); the return code is None when the command was killed
+        self.report = []
+        self.reportLock = threading.Lock()
+    #endDef
+
+    def _remaining(self):
+        """
+        Return the number of seconds left in the time budget.
+        """
+        return self.deadline - time.time()
+    #endDef
+
+    def _startKillTimer(self, process, timeout, killed):
+        """
+        Return a started timer that kills the given process, and any processes it
+        started, after the given number of seconds.  True is appended to the given
+        killed list when the process is killed.
+        """
+        def _kill():
+            killed.append(True)
+            try:
+                os.killpg(process.pid,signal.SIGKILL)
+            except OSError:
+                pass
+            #endTry
+        #endDef
+
+        timer = threading.Timer(timeout,_kill)
+        timer.daemon = True
+        timer.start()
+        return timer
+    #endDef
+
+    def runCommand(self, fileName, command):
+        """
+        Run the given command with its stdout and stderr written to the given file in
+        the output directory.  The command is killed, along with any processes it
+        started, when it takes longer than the command timeout or runs past the
+        time budget.  Return the return code of the command, or None if it was killed.
+        """
+        methodName = "runCommand"
+        timeout = min(self.commandTimeout,self._remaining())
+        if (timeout <= 0):
+            TR.warning(methodName,"No time left to run: %s" % command)
+            return None
+        #endIf
+
+        beginTime = Utilities.currentTimeMillis()
+        killed = []
+        outputPath = os.path.join(self.outputDir,fileName)
+        with open(outputPath,"w") as outputFile:
+            outputFile.write("# %s\n" % command)
+            outputFile.flush()
+            # The command runs in its own process group so the shell and oc can be killed together.
+            process = Popen(command,shell=True,stdout=outputFile,stderr=STDOUT,close_fds=True,preexec_fn=os.setsid)
+            timer = self._startKillTimer(process,timeout,killed)
+            try:
+                retcode = process.wait()
+            finally:
+                timer.cancel()
+            #endTry
+        #endWith
+
+        if (killed):
+            TR.warning(methodName,"Killed: %s after %d seconds" % (command,timeout))
+            retcode = None
+        #endIf
+        with self.reportLock:
+            self.report.append((fileName,retcode,Utilities.currentTimeMillis() - beginTime))
+        #endWith
+        return retcode
+    #endDef
+
+    def getPodNames(self, namespace):
+        """
+        Return the list of the names of the pods in the given namespace.
+        """
+        methodName = "getPodNames"
+        timeout = min(self.commandTimeout,self._remaining())
+        if (timeout <= 0):
+            return []
+        #endIf
+
+        killed = []
+        process = Popen("oc get pods -n %s -o name" % namespace,shell=True,stdout=PIPE,stderr=PIPE,close_fds=True,preexec_fn=os.setsid)
+        timer = self._startKillTimer(process,timeout,killed)
+        try:
+            stdout,stderr = process.communicate()
+        finally:
+            timer.cancel()
+        #endTry
+        if (killed or process.returncode != 0):
+            TR.warning(methodName,"Unable to list the pods of namespace: %s: %s" % (namespace,stderr.strip()))
+            return []
+        #endIf
+        return [line.strip() for line in stdout.splitlines() if line.strip()]
+    #endDef
+
+    def collect(self):
+        """
+        Run the diagnostics commands.  The cluster and namespace commands and the listing
+        of the pods run first, then the pod logs are collected with the time that is left.
+        """
+        methodName = "collect"
+
+        commands = TaskRunner(name="Diagnostics commands",maxWorkers=self.maxWorkers)
+        for fileName,command in ClusterCommands:
+            commands.add(fileName,self.runCommand,fileName,command)
+        #endFor
+        for namespace in self.namespaces:
+            for fileName,command in NamespaceCommands:
+                fileName = "%s-%s" % (namespace,fileName)
+                commands.add(fileName,self.runCommand,fileName,command % {'ns': namespace})
+            #endFor
+            commands.add("%s-pod-names" % namespace,self.getPodNames,namespace)
+        #endFor
+        commands.run(raiseOnError=False)
+        commands.traceTimings(methodName)
+
+        podLogs = TaskRunner(name="Diagnostics pod logs",maxWorkers=self.maxWorkers)
+        for namespace in self.namespaces:
+            for pod in commands.results.get("%s-pod-names" % namespace) or []:
+                podName = pod.split("/")[-1]
+                fileName = "%s-logs-%s.txt" % (namespace,podName)
+                podLogs.add(fileName,self.runCommand,fileName,
+                            PodLogsCommand % {'ns': namespace, 'pod': podName, 'tail': PodLogsTail})
+            #endFor
+        #endFor
+        podLogs.run(raiseOnError=False)
+        if (TR.isLoggable(Level.FINE)):
+            podLogs.traceTimings(methodName)
+        #endIf
+    #endDef
+
+    def archive(self):
+        """
+        Return the path of a tar.gz archive of the files in the output directory.
+        """
+        archivePath = "%s-%s.tar.gz" % (os.path.normpath(self.outputDir),time.strftime("%Y%m%d-%H%M%S"))
+        with tarfile.open(archivePath,"w:gz") as archive:
+            archive.add(self.outputDir,arcname=os.path.basename(os.path.normpath(self.outputDir)))
+        #endWith
+        return archivePath
+    #endDef
+
+    def run(self):
+        """
+        Collect the diagnostics within the time budget, archive them and return the path
+        of the archive.  The collection is best effort: commands that fail or are killed
+        leave what output they produced and the other commands carry on.
+        """
+        methodName = "run"
+        beginTime = Utilities.currentTimeMillis()
+        self.deadline = time.time() + self.budget
+        if (not os.path.exists(self.outputDir)):
+            os.makedirs(self.outputDir)
+        #endIf
+
+        self.collect()
+        archivePath = self.archive()
+
+        failed = len([entry for entry in self.report if entry[1] != 0])
+        TR.info(methodName,"Collected diagnostics from %d commands, %d failed or killed, in %dms to %s (%d bytes)" %
+                (len(self.report),failed,Utilities.currentTimeMillis() - beginTime,archivePath,os.path.getsize(archivePath)))
+        return archivePath
+    #endDef
+#endClass
@@ -1,5 +1,5 @@
 #!/usr/bin/python
-import sys, os.path, time, stat, socket, base64,json
+import sys, os.path, stat, socket, base64,json
 import boto3
 import shutil
 import requests
@@ -8,10 +8,24 @@ from subprocess import call,check_output, check_call, CalledProcessError, Popen,
 from os import chmod, environ
 from botocore.exceptions import ClientError
 from yapl.Trace import Trace, Level
+import yapl.Trace as TraceModule
 from yapl.LogExporter import LogExporter
+from yapl.S3Helper import S3Helper
+from yapl.TaskRunner import TaskRunner
+import yapl.RateLimiter as RateLimiter
+import yapl.Metrics as Metrics
 from yapl.Exceptions import MissingArgumentException
+from cpd_preflight import PreflightChecker
+from cpd_diagnostics import DiagnosticsCollector
 
 TR = Trace(__name__)
+# The Portworx IAM role name and policy ARN are recorded in this file for use at teardown.
+PortworxIAMStateFile = "/ibm/installDir/portworx-iam.json"
+# Binary logs under /var/log that are of no use in diagnosing a deployment.
+LogExportExcludes = ["journal", "lastlog", "wtmp", "btmp", "*.journal"]
+LogExportMaxFileSize = 2 * 1024 * 1024 * 1024
+# Seconds the collection of diagnostics may take when the installation fails.
+DiagnosticsBudget = 300
 StackParameters = {}
 StackParameterNames = []
 class CPDInstall(object):
@@ -21,7 +35,8 @@ class CPDInstall(object):
                     '--stackid': 'string',
                     '--logfile': 'string',
                     '--loglevel': 'string',
-                    '--trace': 'string'
+                    '--trace': 'string',
+                    '--aws-rate-limits': 'string'
                    }
 
     def __init__(self):
@@ -105,8 +120,11 @@ class CPDInstall(object):
         """
         result = {}
         
-        stack = self.cfnResource.Stack(stackId)
-        stackParameters = stack.parameters
+        # The CloudFormation client is used rather than the resource API because
+        # clients are thread safe and this method runs concurrently with other
+        # startup tasks.
+        response = self.cf.describe_stacks(StackName=stackId)
+        stackParameters = response['Stacks'][0].get('Parameters',[])
         for parm in stackParameters:
             parmName = parm['ParameterKey']
             parmValue = parm['ParameterValue']
@@ -212,11 +230,9 @@ class CPDInstall(object):
         elif(self.StorageType=='EFS'):
             self.storageClass = "aws-efs"
             self.storageOverride = ""
-        litestart = Utilities.currentTimeMillis()
         TR.info(methodName,"Start installing Lite package")
-        self.installAssemblies("lite",icpdInstallLogFile)
-        liteend = Utilities.currentTimeMillis()
-        self.printTime(litestart, liteend, "Installing Lite")
+        with TR.span(methodName,"Installing Lite",level=Level.INFO,assembly="lite"):
+            self.installAssemblies("lite",icpdInstallLogFile)
 
         get_cpd_route_cmd = "oc get route -n "+self.Namespace+ " | grep '"+self.Namespace+"' | awk '{print $2}'"
         TR.info(methodName, "Get CPD URL")
@@ -233,62 +249,49 @@ class CPDInstall(object):
 
         if(self.installDV):
             TR.info(methodName,"Start installing DV package")
-            dvstart = Utilities.currentTimeMillis()
-            self.installAssemblies("dv",icpdInstallLogFile)
-            dvend = Utilities.currentTimeMillis()
+            with TR.span(methodName,"Installing DV",level=Level.INFO,assembly="dv"):
+                self.installAssemblies("dv",icpdInstallLogFile)
             TR.info(methodName,"DV package installation completed")
-            self.printTime(dvstart, dvend, "Installing DV")    
         
         if(self.installWSL):
 
             TR.info(methodName,"Start installing WSL package")
-            wslstart = Utilities.currentTimeMillis()
-            self.installAssemblies("wsl",icpdInstallLogFile)
-            wslend = Utilities.currentTimeMillis()
+            with TR.span(methodName,"Installing WSL",level=Level.INFO,assembly="wsl"):
+                self.installAssemblies("wsl",icpdInstallLogFile)
             TR.info(methodName,"WSL package installation completed")
-            self.printTime(wslstart, wslend, "Installing WSL")
         
         if(self.installWML):
             TR.info(methodName,"Start installing WML package")
-            wmlstart = Utilities.currentTimeMillis()
-            self.installAssemblies("wml",icpdInstallLogFile)
-            wmlend = Utilities.currentTimeMillis()
+            with TR.span(methodName,"Installing WML",level=Level.INFO,assembly="wml"):
+                self.installAssemblies("wml",icpdInstallLogFile)
             TR.info(methodName,"WML package installation completed")
-            self.printTime(wmlstart, wmlend, "Installing WML")
 
         if(self.installSpark):
             TR.info(methodName,"Start installing Spark AE package")
-            sparkstart = Utilities.currentTimeMillis()
-            self.installAssemblies("spark",icpdInstallLogFile)
-            sparkend = Utilities.currentTimeMillis()
+            with TR.span(methodName,"Installing Spark AE",level=Level.INFO,assembly="spark"):
+                self.installAssemblies("spark",icpdInstallLogFile)
             TR.info(methodName,"Spark AE  package installation completed")
-            self.printTime(sparkstart, sparkend, "Installing Spark AE")   
         if(self.installWKC):
             TR.info(methodName,"Start installing WKC package")
-            wkcstart = Utilities.currentTimeMillis()
-            self.installAssemblies("wkc",icpdInstallLogFile)
-            wkcend = Utilities.currentTimeMillis()
+            with TR.span(methodName,"Installing WKC",level=Level.INFO,assembly="wkc"):
+                self.installAssemblies("wkc",icpdInstallLogFile)
             TR.info(methodName,"WKC package installation completed")
-            self.printTime(wkcstart, wkcend, "Installing WKC")
 
         if(self.installOSWML):
             TR.info(methodName,"Start installing AI Openscale package")
-            aiostart = Utilities.currentTimeMillis()
-            self.installAssemblies("aiopenscale",icpdInstallLogFile)
-            aioend = Utilities.currentTimeMillis()
+            with TR.span(methodName,"Installing AI Openscale",level=Level.INFO,assembly="aiopenscale"):
+                self.installAssemblies("aiopenscale",icpdInstallLogFile)
             TR.info(methodName,"AI Openscale package installation completed")
-            self.printTime(aiostart, aioend, "Installing AI Openscale")    
 
         if(self.installCDE):
             TR.info(methodName,"Start installing Cognos Dashboard package")
-            cdestart = Utilities.currentTimeMillis()
-            self.installAssemblies("cde",icpdInstallLogFile)
-            cdeend = Utilities.currentTimeMillis()
+            with TR.span(methodName,"Installing Cognos Dashboard",level=Level.INFO,assembly="cde"):
+                self.installAssemblies("cde",icpdInstallLogFile)
             TR.info(methodName,"Cognos Dashboard package installation completed")
-            self.printTime(cdestart, cdeend, "Installing Cognos Dashboard")  
         TR.info(methodName,"Installed all packages.")
     #endDef    
 
+    @TR.span()
     def installOperator(self,icpdInstallLogFile):
         """
         method to install cpd operator
@@ -299,7 +302,7 @@ class CPDInstall(object):
             TR.info(methodName,"Execute install operator  %s"%cloudctl_cmd)
             retcode = check_output(['bash','-c',cloudctl_cmd])
             TR.info(methodName,"Install operator returned %s"%retcode)
-            time.sleep(300)
+            Metrics.sleep(300,methodName)
             cloudctl_status_cmd = "oc get pods -n cpd-meta-ops -l name=ibm-cp-data-operator --no-headers | awk '{print $3}'"
             retcode = check_output(['bash','-c',cloudctl_status_cmd])
             TR.info(methodName,"Execute install operator returned %s"%(retcode))   
@@ -311,18 +314,6 @@ class CPDInstall(object):
         
     #endDef
          
-    def printTime(self, beginTime, endTime, text):
-        """
-        method to capture time elapsed for each event during installation
-        """
-        methodName = "printTime"
-        elapsedTime = (endTime - beginTime)/1000
-        etm, ets = divmod(elapsedTime,60)
-        eth, etm = divmod(etm,60) 
-        TR.info(methodName,"Elapsed time (hh:mm:ss): %d:%02d:%02d for %s" % (eth,etm,ets,text))
-    #endDef
-
-   
     def updateTemplateFile(self, source, placeHolder, value):
         """
         method to update placeholder values in templates
@@ -339,6 +330,7 @@ class CPDInstall(object):
         file.close()
         return content.rstrip()
 
+    @TR.span()
     def installAssemblies(self, assembly, icpdInstallLogFile):
         """
         method to install assemlies
@@ -363,18 +355,24 @@ class CPDInstall(object):
         cr_status_cmd = "oc get cpdservice "+assembly+"-cpdservice  --output='jsonpath={.status.status}' | xargs"
         try:
             retcode = "Installing"
-            while(retcode.rstrip()!="Ready"):
-                time.sleep(60)
-                retcode = check_output(['bash','-c',cr_status_cmd]) 
-                TR.info(methodName,"Get install status for assembly %s is %s"%(assembly,retcode))
-                if(retcode.rstrip() == "Failed"):
-                    TR.error(methodName,"Installation of assembly %s Failed"%assembly) 
-                    raise Exception("Installation of assembly %s Failed"%assembly)
-            TR.info(methodName,"Get install status for assembly %s is %s"%(assembly,retcode))        
+            with TR.span(methodName,"Waiting for %s to be Ready" % assembly) as span:
+                polls = 0
+                while(retcode.rstrip()!="Ready"):
+                    Metrics.sleep(60,methodName)
+                    retcode = check_output(['bash','-c',cr_status_cmd]) 
+                    polls += 1
+                    span.set(polls=polls,status=retcode.rstrip())
+                    TR.info(methodName,"Get install status for assembly %s is %s",assembly,retcode)
+                    if(retcode.rstrip() == "Failed"):
+                        TR.error(methodName,"Installation of assembly %s Failed"%assembly) 
+                        raise Exception("Installation of assembly %s Failed"%assembly)
+            #endWith
+            TR.info(methodName,"Get install status for assembly %s is %s",assembly,retcode)
         except CalledProcessError as e:
             TR.error(methodName,"command '{}' return with error (code {}): {}".format(e.cmd, e.returncode, e.output))   
  
 
+    @TR.span()
     def getS3Object(self, bucket=None, s3Path=None, destPath=None):
         """
         Return destPath which is the local file path provided as the destination of the download.
@@ -421,12 +419,14 @@ class CPDInstall(object):
         with open(destPath, 'wb') as destFile:
             shutil.copyfileobj(r.raw, destFile)
         #endWith
+        Metrics.S3DownloadedBytes.inc(os.path.getsize(destPath))
 
         TR.info(methodName, "COMPLETED download from bucket: %s, object: %s, to: %s" % (bucket,s3Path,destPath))
         
         return destPath
     #endDef
     
+    @TR.span()
     def manageUser(self, icpdInstallLogFile):
         """
         method to update the default password of admin user of CPD with user defined password 
@@ -455,6 +455,7 @@ class CPDInstall(object):
             TR.error(methodName,"command '{}' return with error (code {}): {}".format(e.cmd, e.returncode, e.output))    
     #endDef    
     
+    @TR.span()
     def configureEFS(self):
         """
         Configure an EFS volume and configure all worker nodes to be able to use 
@@ -529,6 +530,7 @@ class CPDInstall(object):
       
     #endDef   
     
+    @TR.span()
     def configureOCS(self,icpdInstallLogFile):
         """
         This method reads user preferences from stack parameters and configures OCS as storage classs accordingly.
@@ -560,7 +562,7 @@ class CPDInstall(object):
         TR.info(methodName,"Create OCS nodes")
         try:
             retcode = check_output(['bash','-c', create_ocs_nodes_cmd])
-            time.sleep(600)
+            Metrics.sleep(600,methodName)
             TR.info(methodName,"Created OCS nodes %s" %retcode)
         except CalledProcessError as e:
             TR.error(methodName,"command '{}' return with error (code {}): {}".format(e.cmd, e.returncode, e.output))    
@@ -589,7 +591,7 @@ class CPDInstall(object):
         TR.info(methodName,"Deploy OLM")
         try:
             retcode = check_output(['bash','-c', deploy_olm_cmd]) 
-            time.sleep(300)
+            Metrics.sleep(300,methodName)
             TR.info(methodName,"Deployed OLM %s" %retcode)
         except CalledProcessError as e:
             TR.error(methodName,"command '{}' return with error (code {}): {}".format(e.cmd, e.returncode, e.output))    
@@ -597,7 +599,7 @@ class CPDInstall(object):
         TR.info(methodName,"Create Storage Cluster")
         try:
             retcode = check_output(['bash','-c', create_storage_cluster_cmd]) 
-            time.sleep(600)
+            Metrics.sleep(600,methodName)
             TR.info(methodName,"Created Storage Cluster %s" %retcode)
         except CalledProcessError as e:
             TR.error(methodName,"command '{}' return with error (code {}): {}".format(e.cmd, e.returncode, e.output))    
@@ -626,16 +628,15 @@ class CPDInstall(object):
         tag_value = self.clusterID+"-worker*"
         TR.info(methodName,"Tag value of worker to look for %s"%tag_value)
         response = self.ec2.describe_instances(Filters=[{'Name': 'tag:Name','Values': [tag_value]}])
-        TR.info(methodName,"response %s"%response)
+        TR.finest(methodName,"describe_instances response %s",response)
         reservation = response['Reservations']
-        TR.info(methodName,"reservation %s"%reservation)
         for item in reservation:
             instances = item['Instances']
-            TR.info(methodName,"instances %s"%instances)
+            TR.finest(methodName,"instances %s",instances)
             for instance in instances:
                 if 'IamInstanceProfile' in instance:
                     instanceProfile = instance['IamInstanceProfile']['Arn'].split("/")[1]
-                    TR.info(methodName,"instanceProfile %s"%instanceProfile)
+                    TR.info(methodName,"instanceProfile %s",instanceProfile)
 
         TR.info(methodName,"Instance profile retrieved %s"%instanceProfile)
         #ROLE_NAME=`aws iam get-instance-profile --instance-profile-name $INST_PROFILE_NAME --query 'InstanceProfile.Roles[*].[RoleName]' --output text`        
@@ -650,14 +651,15 @@ class CPDInstall(object):
         policyName = "portworx-policy-"+self.ClusterName
         policy = self.iam.create_policy(PolicyName=policyName,PolicyDocument=json.dumps(policycontent))
         policy_arn = policy['Policy']['Arn']
-        destroy_sh = "/ibm/destroy.sh"
-        self.updateTemplateFile(destroy_sh,'$ROLE_NAME',rolename)
-        self.updateTemplateFile(destroy_sh,'$POLICY_ARN',policy_arn)
+        # Record the role and policy so the teardown (cpd_destroy.py) can clean them up.
+        with open(PortworxIAMStateFile,'w') as stateFile:
+            json.dump({'RoleName': rolename, 'PolicyArn': policy_arn},stateFile)
+        #endWith
         TR.info(methodName,"Policy_arn retrieved %s"%policy_arn)
         # aws iam attach-role-policy --role-name $ROLE_NAME --policy-arn $POLICY_ARN
         TR.info(methodName,"Attach IAM policy")
         response = self.iam.attach_role_policy(RoleName=rolename,PolicyArn=policy_arn)
-        TR.info(methodName,"Attached role policy returned %s"%response)
+        TR.fine(methodName,"Attached role policy returned %s",response)
         """
         WORKER_TAG=`aws ec2 describe-security-groups --query 'SecurityGroups[*].Tags[*][Value]' --output text | grep worker`
         MASTER_TAG=`aws ec2 describe-security-groups --query 'SecurityGroups[*].Tags[*][Value]' --output text | grep master`
@@ -813,13 +815,14 @@ class CPDInstall(object):
                 deviceMappings = instance['BlockDeviceMappings']
                 for device in deviceMappings:
                     resp = self.ec2.modify_instance_attribute(InstanceId=instance['InstanceId'],BlockDeviceMappings=[{'DeviceName': device['DeviceName'],'Ebs': {'DeleteOnTermination': True}}])
-                    TR.info(methodName,"Modified instance attribute for instance %s device name %s returned %s"%(instance['InstanceId'],device['DeviceName'],resp))
+                    TR.fine(methodName,"Modified instance attribute for instance %s device name %s returned %s",instance['InstanceId'],device['DeviceName'],resp)
                 #endFor
             #endFor
         #endFor
         TR.info(methodName,"Completed setpxVolumePermission")    
     #endDef    
 
+    @TR.span()
     def configurePx(self, icpdInstallLogFile):
         methodName = "configurePx"
         TR.info(methodName,"  Start configuration of Portworx for CPD")
@@ -840,11 +843,11 @@ class CPDInstall(object):
             TR.error(methodName,"command '{}' return with error (code {}): {}".format(e.cmd, e.returncode, e.output))    
 
         self.preparePXInstall(icpdInstallLogFile)
-        time.sleep(30)
+        Metrics.sleep(30,methodName)
         self.updateScc(icpdInstallLogFile)
-        time.sleep(30)
+        Metrics.sleep(30,methodName)
         self.labelNodes(icpdInstallLogFile)
-        time.sleep(30)
+        Metrics.sleep(30,methodName)
         label_cmd = "oc get nodes --show-labels  | grep 'node-role.kubernetes.io/compute=true'"
         TR.info(methodName,"Run label_cmd command %s"%label_cmd)
         try:
@@ -852,7 +855,7 @@ class CPDInstall(object):
             TR.info(methodName,"Completed %s command with return value %s" %(label_cmd,retcode))
         except CalledProcessError as e:
             TR.error(methodName,"command '{}' return with error (code {}): {}".format(e.cmd, e.returncode, e.output))    
-        time.sleep(30)
+        Metrics.sleep(30,methodName)
         px_install_cmd = "oc apply -f /ibm/templates/px/px-install.yaml"
         TR.info(methodName,"Run px-install command %s"%px_install_cmd)
         try:
@@ -860,7 +863,7 @@ class CPDInstall(object):
             TR.info(methodName,"Completed %s command with return value %s" %(px_install_cmd,retcode))
         except CalledProcessError as e:
             TR.error(methodName,"command '{}' return with error (code {}): {}".format(e.cmd, e.returncode, e.output))    
-        time.sleep(180)
+        Metrics.sleep(180,methodName)
         
         px_spec_cmd = "oc create -f /ibm/templates/px/px-spec.yaml"
         TR.info(methodName,"Run px-spec command %s"%px_spec_cmd)
@@ -869,7 +872,7 @@ class CPDInstall(object):
             TR.info(methodName,"Completed %s command with return value %s" %(px_spec_cmd,retcode))
         except CalledProcessError as e:
             TR.error(methodName,"command '{}' return with error (code {}): {}".format(e.cmd, e.returncode, e.output))    
-        time.sleep(300)
+        Metrics.sleep(300,methodName)
 
         create_px_sc = "sudo sh /ibm/templates/px/px-storageclasses.sh"
         TR.info(methodName,"Run px sc command %s"%create_px_sc)
@@ -961,8 +964,8 @@ class CPDInstall(object):
         except CalledProcessError as e:
             TR.error(methodName, "ERROR return code: %s, Exception: %s" % (e.returncode, e), e)
             raise e    
-        TR.info(methodName,"Installation of Openshift Container Platform %s %s" %(stdoutdata,stderrdata))
-        time.sleep(30)
+        TR.info(methodName,"Installation of Openshift Container Platform %s %s",stdoutdata,stderrdata)
+        Metrics.sleep(30,methodName)
         destDir = "/root/.kube"
         if (not os.path.exists(destDir)):
             os.makedirs(destDir)
@@ -1026,25 +1029,25 @@ class CPDInstall(object):
         try:
             retcode = check_output(['bash','-c', route_cmd]) 
             TR.info(methodName,"Created route with command %s returned %s"%(route_cmd,retcode))
-            time.sleep(30)
+            Metrics.sleep(30,methodName)
         except CalledProcessError as e:
             TR.error(methodName,"command '{}' return with error (code {}): {}".format(e.cmd, e.returncode, e.output))    
         try:
             retcode = call(annotate_cmd,shell=True, stdout=icpdInstallLogFile)
             TR.info(methodName,"annotate_cmd %s retcode=%s" %(annotate_cmd,retcode))
-            time.sleep(30)
+            Metrics.sleep(30,methodName)
 
             retcode = call(sessionAffinity_cmd,shell=True, stdout=icpdInstallLogFile)
             TR.info(methodName,"sessionAffinity_cmd %s retcode=%s" %(sessionAffinity_cmd,retcode))
-            time.sleep(30)
+            Metrics.sleep(30,methodName)
 
             retcode = call(update_mgmt_state_cmd,shell=True, stdout=icpdInstallLogFile)
             TR.info(methodName,"update_mgmt_state_cmd %s retcode=%s" %(update_mgmt_state_cmd,retcode))
-            time.sleep(30)
+            Metrics.sleep(30,methodName)
 
             retcode = call(set_s3_storage_limit,shell=True, stdout=icpdInstallLogFile)
             TR.info(methodName,"set_s3_storage_limit %s retcode=%s" %(set_s3_storage_limit,retcode))
-            time.sleep(30)
+            Metrics.sleep(30,methodName)
 
         except CalledProcessError as e:
             TR.error(methodName,"command '{}' return with error (code {}): {}".format(e.cmd, e.returncode, e.output))      
@@ -1067,11 +1070,11 @@ class CPDInstall(object):
         create_oc_policy_cmd = "oc adm policy add-cluster-role-to-user cluster-admin admin"
         TR.info(methodName,"Creating htpasswd for openshift with command")
         try:
-            time.sleep(30)
+            Metrics.sleep(30,methodName)
             htpasswd_retcode = check_output(['bash','-c', htpasswd_cmd]) 
 
             TR.info(methodName,"Creating OC secret generic with  command %s"%htpass_secret_cmd)
-            time.sleep(30)
+            Metrics.sleep(30,methodName)
             secret_retcode = check_output(['bash','-c', htpass_secret_cmd])
             TR.info(methodName,"Creating OAuth with  command %s"%create_OAuth_cmd)
             oauth_retcode = check_output(['bash','-c', create_OAuth_cmd]) 
@@ -1127,7 +1130,7 @@ class CPDInstall(object):
             TR.info(methodName,"Created  Security Limits Machine config %s" %retcode)  
         except CalledProcessError as e:
             TR.error(methodName,"command '{}' return with error (code {}): {}".format(e.cmd, e.returncode, e.output))  
-        time.sleep(600)
+        Metrics.sleep(600,methodName)
 
         oc_route_cmd = "oc get route console -n openshift-console | grep 'console' | awk '{print $2}'"
         TR.info(methodName, "Get OC URL")
@@ -1141,26 +1144,111 @@ class CPDInstall(object):
     #endDef   
 
     def __init(self, stackId, stackName, icpdInstallLogFile):
+        """
+        Create the AWS clients and fetch the startup inputs of the installation.
+
+        The startup inputs are fetched concurrently in two rounds.  The first round
+        gets the stack parameters and creates the log exporter, gets the CPD secrets
+        and creates the ssh keys.  The second round depends on the stack parameters and
+        downloads the Red Hat pull secret and, for Portworx, the Portworx spec.
+
+        The tasks of a round all run to completion, so the log exporter is created
+        when getting the secrets or creating the ssh keys fails and the logs of the
+        failure are exported.
+        """
         methodName = "_init"
-        global StackParameters, StackParameterNames
         boto3.setup_default_session(region_name=self.region)
-        self.cfnResource = boto3.resource('cloudformation', region_name=self.region)
-        self.cf = boto3.client('cloudformation', region_name=self.region)
-        self.ec2 = boto3.client('ec2', region_name=self.region)
-        self.s3 = boto3.client('s3', region_name=self.region)
-        self.iam = boto3.client('iam',region_name=self.region)
-        self.secretsmanager = boto3.client('secretsmanager', region_name=self.region)
-        self.ssm = boto3.client('ssm', region_name=self.region)
-
-        StackParameters = self.getStackParameters(stackId)
-        StackParameterNames = StackParameters.keys()
-        TR.info(methodName,"self.stackParameters %s" % StackParameters)
-        TR.info(methodName,"self.stackParameterNames %s" % StackParameterNames)
-        self.logExporter = LogExporter(region=self.region,
-                            bucket=self.ICPDDeploymentLogsBucketName,
-                            keyPrefix=stackName,
-                            fqdn=socket.getfqdn()
-                            )                    
+        self.cf = Metrics.attach(RateLimiter.attach(boto3.client('cloudformation', region_name=self.region)))
+        self.ec2 = Metrics.attach(RateLimiter.attach(boto3.client('ec2', region_name=self.region)))
+        self.s3 = Metrics.attach(RateLimiter.attach(boto3.client('s3', region_name=self.region)))
+        self.iam = Metrics.attach(RateLimiter.attach(boto3.client('iam',region_name=self.region)))
+        self.secretsmanager = Metrics.attach(RateLimiter.attach(boto3.client('secretsmanager', region_name=self.region)))
+        self.ssm = Metrics.attach(RateLimiter.attach(boto3.client('ssm', region_name=self.region)))
+        self.servicequotas = Metrics.attach(RateLimiter.attach(boto3.client('service-quotas', region_name=self.region)))
+        self.s3Helper = S3Helper(region=self.region)
+
+        startup = TaskRunner(name="Startup inputs round 1")
+        startup.add("initStackParameters", self.initStackParameters, stackId, stackName)
+        startup.add("getSecret", self.getSecret, icpdInstallLogFile)
+        startup.add("createSSHKeys", self.createSSHKeys, icpdInstallLogFile)
+        try:
+            startup.run()
+        finally:
+            startup.traceTimings(methodName)
+        #endTry
+
+        TR.fine(methodName,"self.stackParameters %s",StackParameters)
+        TR.fine(methodName,"self.stackParameterNames %s",StackParameterNames)
+
+        self.pullSecret = "/ibm/pull-secret"
+        self.spec = "/ibm/templates/px/px-spec.yaml"
+        TR.info(methodName,"RedhatPullSecret %s" %self.RedhatPullSecret)
+
+        startup = TaskRunner(name="Startup inputs round 2")
+        startup.add("getPullSecret", self.getS3URIObject, self.RedhatPullSecret, self.pullSecret)
+        if(self.StorageType=='Portworx'):
+            TR.info(methodName,"PortworxSpec %s" %self.PortworxSpec)
+            startup.add("getPortworxSpec", self.getS3URIObject, self.PortworxSpec, self.spec)
+        #endIf
+        try:
+            startup.run()
+        finally:
+            startup.traceTimings(methodName)
+        #endTry
+    #endDef
+
+    def initStackParameters(self, stackId, stackName):
+        """
+        Get the stack parameters, then create the log exporter, which needs the name
+        of the deployment logs bucket from the stack parameters.
+        """
+        global StackParameters, StackParameterNames
+        parameters = self.getStackParameters(stackId)
+        StackParameters = parameters
+        StackParameterNames = parameters.keys()
+        self.logExporter = self.createLogExporter(stackName)
+    #endDef
+
+    def createLogExporter(self, stackName):
+        """
+        Return a LogExporter for the deployment logs bucket.  The LogExporter constructor
+        checks that the bucket exists and creates it if it does not.  The logs are gzip
+        compressed as they are uploaded; the trace logs compress roughly 10:1.
+        """
+        return LogExporter(region=self.region,
+                           bucket=self.ICPDDeploymentLogsBucketName,
+                           keyPrefix=stackName,
+                           fqdn=socket.getfqdn(),
+                           s3Helper=self.s3Helper,
+                           compress=True,
+                           manifestPath=os.path.join(self.home,"log-export-manifest.json"),
+                           exclude=LogExportExcludes,
+                           maxFileSize=LogExportMaxFileSize
+                           )
+    #endDef
+
+    def collectDiagnostics(self):
+        """
+        Collect the cluster diagnostics of a failed installation and export them to the
+        S3 bucket for logs.  The collection is best effort: a failure to collect the
+        diagnostics is traced and does not replace the failure of the installation.
+        """
+        methodName = "collectDiagnostics"
+        try:
+            with TR.span(methodName,"Collecting diagnostics",level=Level.INFO):
+                collector = DiagnosticsCollector(namespaces=["cpd-meta-ops", getattr(self,'Namespace',None)],
+                                                 outputDir=os.path.join(self.home,"diagnostics"),
+                                                 budget=DiagnosticsBudget)
+                archivePath = collector.run()
+                self.logExporter.exportFile(archivePath)
+            #endWith
+        except Exception as e:
+            TR.error(methodName,"Collecting diagnostics failed: %s" % e, e)
+        #endTry
+    #endDef
+
+    def createSSHKeys(self, icpdInstallLogFile):
+        methodName = "createSSHKeys"
         TR.info(methodName,"Create ssh keys")
         command = "ssh-keygen -P {}  -f /root/.ssh/id_rsa".format("''")
         try:
@@ -1168,6 +1256,19 @@ class CPDInstall(object):
             TR.info(methodName,"Created ssh keys")
         except CalledProcessError as e:
             TR.error(methodName,"command '{}' return with error (code {}): {}".format(e.cmd, e.returncode, e.output))    
+    #endDef
+
+    def getS3URIObject(self, s3URI, destPath):
+        """
+        Download the object with the given S3 URI (s3://<bucket>/<key>) to the given
+        local file destPath in-process with boto3.
+        """
+        methodName = "getS3URIObject"
+        bucket,key = self.s3Helper.parseS3URI(s3URI)
+        TR.info(methodName,"Download %s to %s" % (s3URI,destPath))
+        self.s3Helper.download_file(Bucket=bucket,Key=key,Filename=destPath)
+        return destPath
+    #endDef
     
     def getSecret(self, icpdInstallLogFile):
         methodName = "getSecret"
@@ -1189,7 +1290,8 @@ class CPDInstall(object):
         TR.info(methodName,"Start updateSecret %s"%self.ocpSecret)
         secret_update = '{"ocpPassword":'+self.ocpassword+'}'
         response = self.secretsmanager.update_secret(SecretId=self.ocpSecret,SecretString=secret_update)
-        TR.info(methodName,"Updated secret for %s with response %s"%(self.ocpSecret, response))
+        TR.info(methodName,"Updated secret for %s",self.ocpSecret)
+        TR.fine(methodName,"update_secret response %s",response)
         TR.info(methodName,"End updateSecret")
     #endDef
     #     
@@ -1205,16 +1307,29 @@ class CPDInstall(object):
     def main(self,argv):
         methodName = "main"
         self.rc = 0
+        # The log exporter is created with the stack parameters.  It is None when the
+        # installation fails before the stack parameters are read.
+        self.logExporter = None
         try:
             beginTime = Utilities.currentTimeMillis()
             cmdLineArgs = Utilities.getInputArgs(self.ArgsSignature,argv[1:])
             trace, logFile = self._configureTraceAndLogging(cmdLineArgs)
             self.region = cmdLineArgs.get('region')
+            rateLimits = cmdLineArgs.get('aws-rate-limits')
+            if (rateLimits):
+                RateLimiter.configureRateLimits(rateLimits)
+                TR.info(methodName,"AWS API rate limits: '%s'" % rateLimits)
+            #endIf
             if (logFile):
                 TR.appendTraceLog(logFile)   
             if (trace):
                 TR.info(methodName,"Tracing with specification: '%s' to log file: '%s'" % (trace,logFile))
 
+            # The metrics of the installation are written to the logs directory, so they
+            # are exported with the logs, and can be read by the node_exporter textfile collector.
+            Metrics.instrumentSubprocess()
+            Metrics.observeSpans()
+            Metrics.startWriter(os.path.join(self.logsHome,"cpd_install.prom"))
             logFilePath = os.path.join(self.logsHome,"icpd_install.log")
     
             with open(logFilePath,"a+") as icpdInstallLogFile:  
@@ -1231,22 +1346,21 @@ class CPDInstall(object):
                 TR.info(methodName, "cpdSecret %s "% self.cpdSecret)
                 TR.info(methodName, "ocpSecret %s "% self.ocpSecret)
                 self.__init(self.stackId,self.stackName, icpdInstallLogFile)
+                self.logExporter.startShipper([logFilePath, logFile, os.path.join(self.home,"installDir",".openshift_install.log")])
                 self.zones = Utilities.splitString(self.AvailabilityZones)
                 TR.info(methodName," AZ values %s" % self.zones)
-                TR.info(methodName,"RedhatPullSecret %s" %self.RedhatPullSecret)
-               
-                secret = self.RedhatPullSecret.split('/',1)
-                TR.info(methodName,"Pull secret  %s" %secret)  
-                self.pullSecret = "/ibm/pull-secret"
-                s3_cp_cmd = "aws s3 cp "+self.RedhatPullSecret+" "+self.pullSecret
-                TR.info(methodName,"s3 cp cmd %s"%s3_cp_cmd)
-                call(s3_cp_cmd, shell=True,stdout=icpdInstallLogFile)
-                self.getSecret(icpdInstallLogFile)
+
+                with TR.span(methodName,"Pre-flight checks",level=Level.INFO):
+                    preflight = PreflightChecker(ec2=self.ec2,
+                                                 servicequotas=self.servicequotas,
+                                                 parameters=StackParameters,
+                                                 zones=self.zones)
+                    preflight.run()
+                #endWith
                 
-                ocpstart = Utilities.currentTimeMillis()
-                self.installOCP(icpdInstallLogFile)
-                ocpend = Utilities.currentTimeMillis()
-                self.printTime(ocpstart, ocpend, "Installing OCP")
+                with TR.span(methodName,"Installing OCP",level=Level.INFO):
+                    self.installOCP(icpdInstallLogFile)
+                #endWith
 
                 self.installWKC = Utilities.toBoolean(self.WKC)
                 self.installWSL = Utilities.toBoolean(self.WSL)
@@ -1260,27 +1374,20 @@ class CPDInstall(object):
                     self.installWML=True
 
                 
-                storagestart = Utilities.currentTimeMillis()
-                if(self.StorageType=='OCS'):
-                    self.configureOCS(icpdInstallLogFile)
-                elif(self.StorageType=='Portworx'):
-                    TR.info(methodName,"PortworxSpec %s" %self.PortworxSpec)
-                    spec = self.PortworxSpec.split('/',1)
-                    TR.info(methodName,"spec  %s" %spec)
-                    self.spec = "/ibm/templates/px/px-spec.yaml"
-                    s3_cp_cmd = "aws s3 cp "+self.PortworxSpec+" "+self.spec
-                    TR.info(methodName,"s3 cp cmd %s"%s3_cp_cmd)
-                    call(s3_cp_cmd, shell=True,stdout=icpdInstallLogFile)
-                    self.configurePx(icpdInstallLogFile)
-                elif(self.StorageType=='EFS'):
-                    self.EFSDNSName = environ.get('EFSDNSName')
-                    self.EFSID = environ.get('EFSID')   
-                    self.configureEFS()
-
-                storageend = Utilities.currentTimeMillis()
-                self.printTime(storagestart, storageend, "Installing storage")    
-
-                self.installCPD(icpdInstallLogFile)
+                with TR.span(methodName,"Installing storage",level=Level.INFO,storageType=self.StorageType):
+                    if(self.StorageType=='OCS'):
+                        self.configureOCS(icpdInstallLogFile)
+                    elif(self.StorageType=='Portworx'):
+                        self.configurePx(icpdInstallLogFile)
+                    elif(self.StorageType=='EFS'):
+                        self.EFSDNSName = environ.get('EFSDNSName')
+                        self.EFSID = environ.get('EFSID')   
+                        self.configureEFS()
+                #endWith
+
+                with TR.span(methodName,"Installing CPD",level=Level.INFO):
+                    self.installCPD(icpdInstallLogFile)
+                #endWith
                 self.updateSecret(icpdInstallLogFile)
                 self.exportResults(self.stackName+"-OpenshiftURL", "https://"+self.openshiftURL, icpdInstallLogFile)
                 self.exportResults(self.stackName+"-CPDURL", "https://"+self.cpdURL, icpdInstallLogFile)
@@ -1289,16 +1396,40 @@ class CPDInstall(object):
         except Exception as e:
             TR.error(methodName,"Exception with message %s" %e)
             self.rc = 1
+            self.collectDiagnostics()
         finally:
             try:
             # Copy icpHome/logs to the S3 bucket for logs.
-                self.logExporter.exportLogs("/var/log/")
-                self.logExporter.exportLogs("/ibm/cpd-cli-workspace/Logs")
-                self.logExporter.exportLogs("%s" % self.logsHome)
+                if (self.logExporter != None):
+                    # The last shipment compacts the shipped logs into one object each.
+                    self.logExporter.stopShipper(compact=True)
+                    # The final exports compact the logs that were exported in parts, so each
+                    # log ends up in one object at its key.  Logs without parts are not uploaded again.
+                    self.logExporter.exportLogs("/var/log/",compact=True)
+                    self.logExporter.exportLogs("/ibm/cpd-cli-workspace/Logs",compact=True)
+                #endIf
+                # The timeline of the spans of the installation is exported with the logs.
+                # It is best effort, a failure to write it does not fail the installation.
+                try:
+                    TraceModule.writeSpanTimeline(os.path.join(self.logsHome,"cpd_install_timeline.json"))
+                except Exception as e:
+                    TR.warning(methodName,"Unable to write the timeline of the installation: %s" % e)
+                #endTry
+                try:
+                    Metrics.stopWriter()
+                except Exception as e:
+                    TR.warning(methodName,"Unable to write the metrics of the installation: %s" % e)
+                #endTry
+                # Write the trace records queued by an async trace sink before the trace log is exported.
+                TR.flushTraceLog()
+                if (self.logExporter != None):
+                    self.logExporter.exportLogs("%s" % self.logsHome,compact=True)
+                #endIf
             except Exception as  e:
                 TR.error(methodName,"ERROR: %s" % e, e)
                 self.rc = 1
             #endTry          
+        RateLimiter.traceReport(methodName)
         endTime = Utilities.currentTimeMillis()
         elapsedTime = (endTime - beginTime)/1000
         etm, ets = divmod(elapsedTime,60)
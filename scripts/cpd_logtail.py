@@ -0,0 +1,83 @@
+#!/usr/bin/python
+import sys
+import yapl.Utilities as Utilities
+from yapl.Trace import Trace, Level
+from yapl.S3Helper import S3Helper
+from yapl.LogIndex import RemoteLog
+from yapl.Exceptions import MissingArgumentException
+
+TR = Trace(__name__)
+
+class CPDLogTail(object):
+    """
+    Print the tail of a log exported to the deployment logs bucket, or the lines of
+    the log in a time window, without downloading the whole log.
+
+    The log is read with ranged GETs guided by the offset index that LogExporter
+    exports next to each log (<key>.index.json).
+
+    Usage:
+      cpd_logtail.py --bucket <bucket> --key <stackname>/<fqdn>/icpd_install.log --tail 200
+      cpd_logtail.py --bucket <bucket> --key <key> --start 2020-09-10T12:00:00 --end 2020-09-10T12:15:00
+    """
+    ArgsSignature = {
+                    '--region': 'string',
+                    '--bucket': 'string',
+                    '--key': 'string',
+                    '--tail': 'int',
+                    '--start': 'string',
+                    '--end': 'string',
+                    '--logfile': 'string',
+                    '--loglevel': 'string',
+                    '--trace': 'string'
+                   }
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        object.__init__(self)
+    #endDef
+
+    def main(self,argv):
+        methodName = "main"
+        beginTime = Utilities.currentTimeMillis()
+        cmdLineArgs = Utilities.getInputArgs(self.ArgsSignature,argv[1:])
+        logFile = cmdLineArgs.get('logfile')
+        if (logFile):
+            TR.appendTraceLog(logFile)
+        #endIf
+        trace = cmdLineArgs.get('trace') or cmdLineArgs.get('loglevel')
+        if (trace):
+            TR.configureTrace(trace)
+        #endIf
+
+        bucket = cmdLineArgs.get('bucket')
+        key = cmdLineArgs.get('key')
+        if (not bucket or not key):
+            raise MissingArgumentException("The --bucket and --key of the exported log must be provided.")
+        #endIf
+
+        log = RemoteLog(S3Helper(region=cmdLineArgs.get('region')),bucket,key)
+        startTime = cmdLineArgs.get('start')
+        endTime = cmdLineArgs.get('end')
+        if (startTime or endTime):
+            lines = log.window(startTime,endTime)
+        else:
+            lines = log.tail(cmdLineArgs.get('tail') or 100)
+        #endIf
+
+        for line in lines:
+            sys.stdout.write(line.encode('utf-8') + "\n")
+        #endFor
+        if (TR.isLoggable(Level.FINE)):
+            TR.fine(methodName,"Fetched %d bytes of S3: %s:%s for %d lines in %dms" %
+                    (log.bytesFetched,bucket,key,len(lines),Utilities.currentTimeMillis() - beginTime))
+        #endIf
+        return 0
+    #endDef
+#endClass
+if __name__ == '__main__':
+  mainInstance = CPDLogTail()
+  sys.exit(mainInstance.main(sys.argv))
+#endIf
@@ -0,0 +1,315 @@
+"""
+Pre-flight checks that run before installOCP.
+
+The checks compare what the installation is going to request, as defined by the
+install-config, OCS and autoscaler templates, against what the account and region
+can provide.  All checks run concurrently so a deployment that can not succeed
+fails in seconds instead of after a 40+ minute openshift-install run.
+"""
+import math
+from botocore.exceptions import ClientError
+from yapl.Trace import Trace, Level
+from yapl.TaskRunner import TaskRunner
+from yapl.Exceptions import InvalidConfigurationException
+
+TR = Trace(__name__)
+
+# Root volumes from installDir/install-config-*.yaml
+MasterRootVolume = {'type': 'io1', 'size': 300, 'iops': 2400}
+WorkerRootVolume = {'type': 'io1', 'size': 300, 'iops': 1200}
+# Root volume of the OCS machine sets in templates/ocs/workerocs*.yaml
+OCSRootVolume = {'type': 'gp2', 'size': 120, 'iops': 0}
+# Device set of templates/ocs/ocs-storagecluster.yaml: count 1, replica 3, 2Ti of gp2
+OCSDeviceSetVolume = {'type': 'gp2', 'size': 2048, 'iops': 0}
+OCSDeviceSetVolumes = 3
+# The temporary bootstrap node runs alongside the masters.
+BootstrapVCPUs = 2
+BootstrapRootVolume = {'type': 'gp2', 'size': 120, 'iops': 0}
+# resourceLimits.cores.max of templates/cpd/cluster-autoscaler.yaml
+AutoscalerMaxCores = 128
+
+# Service Quotas codes
+RunningOnDemandStandardVCPUs = ('ec2', 'L-1216C47A')
+ElasticIPs = ('ec2', 'L-0263D0A3')
+VolumeStorageTiB = {'io1': ('ebs', 'L-FD252861'), 'gp2': ('ebs', 'L-D18FCD1D')}
+IO1IOPS = ('ebs', 'L-B3A130E6')
+
+# Instance families that count against the standard on-demand vCPU quota
+StandardFamilies = "acdhimrtz"
+
+OK = "OK"
+WARN = "WARN"
+FAIL = "FAIL"
+
+
+class PreflightChecker(object):
+    """
+    Check instance type offerings per availability zone, vCPU, EBS volume and Elastic IP
+    quotas, and the existing VPC and subnet parameters of the stack.
+    """
+
+    def __init__(self, ec2=None, servicequotas=None, parameters=None, zones=None):
+        """
+        ec2 - boto3 EC2 client
+        servicequotas - boto3 Service Quotas client
+        parameters - dictionary of the stack parameters
+        zones - list of the availability zones of the deployment
+        """
+        object.__init__(self)
+        self.ec2 = ec2
+        self.servicequotas = servicequotas
+        self.parameters = parameters
+        self.zones = zones
+        # Each entry is a tuple (check, status, detail)
+        self.report = []
+    #endDef
+
+    def _addResult(self, check, status, detail):
+        self.report.append((check,status,detail))
+    #endDef
+
+    def _getQuota(self, serviceCode, quotaCode):
+        """
+        Return the value of the given service quota.  The default value is used
+        when the quota has not been changed for the account.
+        """
+        try:
+            response = self.servicequotas.get_service_quota(ServiceCode=serviceCode,QuotaCode=quotaCode)
+        except ClientError as e:
+            if (e.response['Error']['Code'] != 'NoSuchResourceException'):
+                raise e
+            #endIf
+            response = self.servicequotas.get_aws_default_service_quota(ServiceCode=serviceCode,QuotaCode=quotaCode)
+        #endTry
+        return response['Quota']['Value']
+    #endDef
+
+    def getNodeCounts(self):
+        """
+        Return a list of tuples (role, instanceType, count, rootVolume) for the nodes the
+        installation creates.
+        """
+        nodes = [('master', self.parameters['MasterInstanceType'], int(self.parameters['NumberOfMaster']), MasterRootVolume),
+                 ('worker', self.parameters['ComputeInstanceType'], int(self.parameters['NumberOfCompute']), WorkerRootVolume)]
+        if (self.parameters.get('StorageType') == 'OCS'):
+            # The 3 AZ template has one OCS machine set with 1 replica per zone.
+            if (len(self.zones) == 1):
+                ocsCount = int(self.parameters['NumberOfOCS'])
+            else:
+                ocsCount = len(self.zones)
+            #endIf
+            nodes.append(('ocs', self.parameters['OCSInstanceType'], ocsCount, OCSRootVolume))
+        #endIf
+        return nodes
+    #endDef
+
+    def checkInstanceTypeOfferings(self):
+        """
+        Check that each instance type is offered in each availability zone.
+        """
+        instanceTypes = sorted(set([node[1] for node in self.getNodeCounts()]))
+        offered = set()
+        paginator = self.ec2.get_paginator('describe_instance_type_offerings')
+        for page in paginator.paginate(LocationType='availability-zone',
+                                       Filters=[{'Name': 'instance-type', 'Values': instanceTypes},
+                                                {'Name': 'location', 'Values': self.zones}]):
+            for offering in page['InstanceTypeOfferings']:
+                offered.add((offering['InstanceType'],offering['Location']))
+            #endFor
+        #endFor
+        missing = ["%s in %s" % (instanceType,zone) for instanceType in instanceTypes for zone in self.zones
+                   if (instanceType,zone) not in offered]
+        if (missing):
+            self._addResult("Instance type offerings",FAIL,"Not offered: %s" % ", ".join(missing))
+        else:
+            self._addResult("Instance type offerings",OK,"%s offered in %s" % (", ".join(instanceTypes),", ".join(self.zones)))
+        #endIf
+    #endDef
+
+    def checkVCPUQuota(self):
+        """
+        Check the running on-demand standard instance vCPU quota against the vCPUs in use
+        plus the vCPUs of the nodes the installation creates.
+        """
+        nodes = self.getNodeCounts()
+        instanceTypes = sorted(set([node[1] for node in nodes]))
+        response = self.ec2.describe_instance_types(InstanceTypes=instanceTypes)
+        vcpus = dict([(it['InstanceType'],it['VCpuInfo']['DefaultVCpus']) for it in response['InstanceTypes']])
+        required = BootstrapVCPUs + sum([vcpus.get(node[1],0) * node[2] for node in nodes])
+
+        inUse = 0
+        paginator = self.ec2.get_paginator('describe_instances')
+        for page in paginator.paginate(Filters=[{'Name': 'instance-state-name', 'Values': ['pending','running']}]):
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    if (instance['InstanceType'][0] in StandardFamilies and instance.get('InstanceLifecycle') != 'spot'):
+                        cpuOptions = instance.get('CpuOptions',{})
+                        inUse += cpuOptions.get('CoreCount',0) * cpuOptions.get('ThreadsPerCore',1)
+                    #endIf
+                #endFor
+            #endFor
+        #endFor
+
+        quota = self._getQuota(*RunningOnDemandStandardVCPUs)
+        detail = "quota %d, in use %d, install requires %d" % (quota,inUse,required)
+        if (inUse + required > quota):
+            self._addResult("On-demand standard vCPUs",FAIL,detail)
+        elif (inUse + max(required,AutoscalerMaxCores) > quota):
+            self._addResult("On-demand standard vCPUs",WARN,"%s; the cluster autoscaler may grow to %d cores" % (detail,AutoscalerMaxCores))
+        else:
+            self._addResult("On-demand standard vCPUs",OK,detail)
+        #endIf
+    #endDef
+
+    def checkVolumeQuotas(self):
+        """
+        Check the EBS storage quotas per volume type and the io1 IOPS quota against the
+        volumes in use plus the volumes the installation creates.
+        """
+        requiredGiB = {}
+        requiredIOPS = 0
+        volumes = [(BootstrapRootVolume,1)] + [(node[3],node[2]) for node in self.getNodeCounts()]
+        if (self.parameters.get('StorageType') == 'OCS'):
+            volumes.append((OCSDeviceSetVolume,OCSDeviceSetVolumes))
+        #endIf
+        for volume,count in volumes:
+            requiredGiB[volume['type']] = requiredGiB.get(volume['type'],0) + volume['size'] * count
+            if (volume['type'] == 'io1'):
+                requiredIOPS += volume['iops'] * count
+            #endIf
+        #endFor
+
+        inUseGiB = {}
+        inUseIOPS = 0
+        paginator = self.ec2.get_paginator('describe_volumes')
+        for page in paginator.paginate():
+            for volume in page['Volumes']:
+                inUseGiB[volume['VolumeType']] = inUseGiB.get(volume['VolumeType'],0) + volume['Size']
+                if (volume['VolumeType'] == 'io1'):
+                    inUseIOPS += volume.get('Iops',0)
+                #endIf
+            #endFor
+        #endFor
+
+        for volumeType in sorted(requiredGiB.keys()):
+            quotaGiB = self._getQuota(*VolumeStorageTiB[volumeType]) * 1024
+            detail = "quota %d GiB, in use %d GiB, install requires %d GiB" % (quotaGiB,inUseGiB.get(volumeType,0),requiredGiB[volumeType])
+            if (inUseGiB.get(volumeType,0) + requiredGiB[volumeType] > quotaGiB):
+                self._addResult("EBS %s storage" % volumeType,FAIL,detail)
+            else:
+                self._addResult("EBS %s storage" % volumeType,OK,detail)
+            #endIf
+        #endFor
+
+        if (requiredIOPS):
+            quotaIOPS = self._getQuota(*IO1IOPS)
+            detail = "quota %d, in use %d, install requires %d" % (quotaIOPS,inUseIOPS,requiredIOPS)
+            if (inUseIOPS + requiredIOPS > quotaIOPS):
+                self._addResult("EBS io1 IOPS",FAIL,detail)
+            else:
+                self._addResult("EBS io1 IOPS",OK,detail)
+            #endIf
+        #endIf
+    #endDef
+
+    def checkElasticIPQuota(self):
+        """
+        Check that the Elastic IP quota is not exhausted.  The installation uses the
+        existing subnets and their NAT gateways, so openshift-install allocates no
+        Elastic IPs itself, but an exhausted quota fails load balancer and NAT changes.
+        """
+        inUse = len(self.ec2.describe_addresses(Filters=[{'Name': 'domain', 'Values': ['vpc']}])['Addresses'])
+        quota = self._getQuota(*ElasticIPs)
+        detail = "quota %d, in use %d" % (quota,inUse)
+        if (inUse >= quota):
+            self._addResult("Elastic IPs",WARN,detail)
+        else:
+            self._addResult("Elastic IPs",OK,detail)
+        #endIf
+    #endDef
+
+    def checkNetwork(self):
+        """
+        Check that the VPC exists, that each subnet is in the VPC and in the availability
+        zone it is used for, and that the private subnets have enough free addresses for
+        the nodes in their zone.
+        """
+        vpcId = self.parameters['VPCID']
+        self.ec2.describe_vpcs(VpcIds=[vpcId])
+
+        subnetZones = {}
+        for i in range(len(self.zones)):
+            subnetZones[self.parameters['PrivateSubnet%dID' % (i+1)]] = (self.zones[i],'private')
+            subnetZones[self.parameters['PublicSubnet%dID' % (i+1)]] = (self.zones[i],'public')
+        #endFor
+
+        nodesPerZone = int(math.ceil(float(sum([node[2] for node in self.getNodeCounts()])) / len(self.zones)))
+        problems = []
+        response = self.ec2.describe_subnets(SubnetIds=list(subnetZones.keys()))
+        for subnet in response['Subnets']:
+            zone,access = subnetZones[subnet['SubnetId']]
+            if (subnet['VpcId'] != vpcId):
+                problems.append("%s is in %s, not in %s" % (subnet['SubnetId'],subnet['VpcId'],vpcId))
+            #endIf
+            if (subnet['AvailabilityZone'] != zone):
+                problems.append("%s is in %s, expected %s" % (subnet['SubnetId'],subnet['AvailabilityZone'],zone))
+            #endIf
+            if (access == 'private' and subnet['AvailableIpAddressCount'] < nodesPerZone):
+                problems.append("%s has %d free addresses, %d nodes are placed in it" % (subnet['SubnetId'],subnet['AvailableIpAddressCount'],nodesPerZone))
+            #endIf
+        #endFor
+
+        if (problems):
+            self._addResult("VPC and subnets",FAIL,"; ".join(problems))
+        else:
+            self._addResult("VPC and subnets",OK,"%s with %d subnets" % (vpcId,len(subnetZones)))
+        #endIf
+    #endDef
+
+    def _runCheck(self, check, function):
+        """
+        Run the given check function.  Access denied on a check is reported as a warning
+        since the checks are advisory when the installer credentials can not read quotas.
+        """
+        try:
+            function()
+        except ClientError as e:
+            errorCode = e.response['Error']['Code']
+            if (errorCode in ['AccessDenied','AccessDeniedException','UnauthorizedOperation']):
+                self._addResult(check,WARN,"Not checked: %s" % e)
+            else:
+                self._addResult(check,FAIL,"%s" % e)
+            #endIf
+        #endTry
+    #endDef
+
+    def run(self):
+        """
+        Run all checks concurrently and trace the report.  Raise an
+        InvalidConfigurationException listing the failed checks if any check failed.
+        """
+        methodName = "run"
+        checks = TaskRunner(name="Pre-flight checks")
+        checks.add("instanceTypeOfferings", self._runCheck, "Instance type offerings", self.checkInstanceTypeOfferings)
+        checks.add("vcpuQuota", self._runCheck, "On-demand standard vCPUs", self.checkVCPUQuota)
+        checks.add("volumeQuotas", self._runCheck, "EBS volumes", self.checkVolumeQuotas)
+        checks.add("elasticIPQuota", self._runCheck, "Elastic IPs", self.checkElasticIPQuota)
+        checks.add("network", self._runCheck, "VPC and subnets", self.checkNetwork)
+        checks.run(raiseOnError=False)
+        checks.traceTimings(methodName)
+
+        for taskName,exc in checks.exceptions.items():
+            self._addResult(taskName,FAIL,"%s" % exc)
+        #endFor
+
+        for check,status,detail in self.report:
+            TR.info(methodName,"%-4s %s: %s" % (status,check,detail))
+        #endFor
+
+        failures = ["%s: %s" % (check,detail) for check,status,detail in self.report if status == FAIL]
+        if (failures):
+            raise InvalidConfigurationException("Pre-flight checks failed: %s" % " | ".join(failures))
+        #endIf
+        return self.report
+    #endDef
+#endClass
@@ -0,0 +1,82 @@
+"""
+Fixtures shared by the tests of the scripts.
+
+The scripts run on Python 2.7 and the last moto release for Python 2.7 lacks much of the
+EC2 and S3 behavior the tests need.  The AWS mocks are those of a current moto, run as a
+moto server with Python 3 and used through the endpoint URL of the clients.  Run from the
+scripts directory with:
+  pip3 install "moto[server]"
+  python2.7 -m pytest tests
+The MOTO_SERVER_PYTHON environment variable selects the Python 3 interpreter of the
+moto server, python3 by default.  The tests are skipped when the server can not start.
+"""
+import os
+import time
+import socket
+import urllib2
+import subprocess
+
+import pytest
+
+
+def _freePort():
+    listener = socket.socket()
+    listener.bind(("127.0.0.1",0))
+    port = listener.getsockname()[1]
+    listener.close()
+    return port
+#endDef
+
+
+@pytest.fixture(scope="session")
+def motoServer():
+    """
+    The endpoint URL of a moto server running for the session.
+    """
+    port = _freePort()
+    endpoint = "http://127.0.0.1:%d" % port
+    python = os.environ.get('MOTO_SERVER_PYTHON',"python3")
+    try:
+        server = subprocess.Popen([python,"-m","moto.server","-p",str(port)],stdout=open(os.devnull,"w"),stderr=subprocess.STDOUT)
+    except OSError as e:
+        pytest.skip("Unable to start the moto server with %s: %s" % (python,e))
+    #endTry
+    try:
+        for attempt in range(100):
+            if (server.poll() != None):
+                pytest.skip("The moto server exited, moto[server] is required for %s." % python)
+            #endIf
+            try:
+                urllib2.urlopen("%s/moto-api/" % endpoint)
+                break
+            except Exception:
+                time.sleep(0.1)
+            #endTry
+        #endFor
+        yield endpoint
+    finally:
+        if (server.poll() == None):
+            server.terminate()
+            server.wait()
+        #endIf
+    #endTry
+#endDef
+
+
+@pytest.fixture
+def awsCredentials(monkeypatch):
+    """
+    Test credentials for the clients of the moto server.
+    """
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID',"testing")
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY',"testing")
+#endDef
+
+
+@pytest.fixture
+def resetMotoServer(motoServer):
+    """
+    Remove the resources that previous tests created on the moto server.
+    """
+    urllib2.urlopen(urllib2.Request("%s/moto-api/reset" % motoServer,data=""))
+#endDef
@@ -0,0 +1,284 @@
+"""
+Tests of the pre-flight checks in cpd_preflight.py against moto's EC2 mock and a stubbed
+Service Quotas client.
+
+The scripts run on Python 2.7 and the last moto release for Python 2.7 does not implement
+the instance type offerings, EBS volume types or IOPS.  The EC2 mock is the one of the
+moto server of conftest.py, used through the endpoint URL of the EC2 client.
+"""
+import os
+import sys
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cpd_preflight
+from cpd_preflight import PreflightChecker, OK, WARN, FAIL
+from yapl.Exceptions import InvalidConfigurationException
+
+Region = "us-east-1"
+Zone = "us-east-1a"
+
+# Quotas that the installation of the default parameters fits in.  Storage quotas are in TiB.
+Quotas = {
+    cpd_preflight.RunningOnDemandStandardVCPUs: 256,
+    cpd_preflight.ElasticIPs: 5,
+    cpd_preflight.VolumeStorageTiB['io1']: 50,
+    cpd_preflight.VolumeStorageTiB['gp2']: 50,
+    cpd_preflight.IO1IOPS: 300000
+}
+
+
+class ServiceQuotasStub(object):
+    """
+    A Service Quotas client with the given quota values.  Quotas that are in defaults
+    are only returned by get_aws_default_service_quota, like a quota the account has not
+    changed.  With accessDenied every call raises AccessDeniedException.
+    """
+
+    def __init__(self, quotas=None, defaults=None, accessDenied=False):
+        self.quotas = dict(Quotas)
+        self.quotas.update(quotas or {})
+        self.defaults = defaults or {}
+        self.accessDenied = accessDenied
+    #endDef
+
+    def _error(self, code, operationName):
+        return ClientError({'Error': {'Code': code, 'Message': code}},operationName)
+    #endDef
+
+    def get_service_quota(self, ServiceCode, QuotaCode):
+        if (self.accessDenied):
+            raise self._error('AccessDeniedException','GetServiceQuota')
+        #endIf
+        if ((ServiceCode,QuotaCode) in self.defaults):
+            raise self._error('NoSuchResourceException','GetServiceQuota')
+        #endIf
+        return {'Quota': {'ServiceCode': ServiceCode, 'QuotaCode': QuotaCode, 'Value': float(self.quotas[(ServiceCode,QuotaCode)])}}
+    #endDef
+
+    def get_aws_default_service_quota(self, ServiceCode, QuotaCode):
+        return {'Quota': {'ServiceCode': ServiceCode, 'QuotaCode': QuotaCode, 'Value': float(self.defaults[(ServiceCode,QuotaCode)])}}
+    #endDef
+#endClass
+
+
+@pytest.fixture
+def ec2(motoServer, awsCredentials, resetMotoServer):
+    """
+    An EC2 client of an empty moto server.
+    """
+    return boto3.client('ec2',region_name=Region,endpoint_url=motoServer)
+#endDef
+
+
+@pytest.fixture
+def network(ec2):
+    """
+    The VPC and the private and public subnet of the zone of the deployment.
+    """
+    vpcId = ec2.create_vpc(CidrBlock="10.0.0.0/16")['Vpc']['VpcId']
+    privateSubnetId = ec2.create_subnet(VpcId=vpcId,CidrBlock="10.0.1.0/24",AvailabilityZone=Zone)['Subnet']['SubnetId']
+    publicSubnetId = ec2.create_subnet(VpcId=vpcId,CidrBlock="10.0.2.0/24",AvailabilityZone=Zone)['Subnet']['SubnetId']
+    return {'VPCID': vpcId, 'PrivateSubnet1ID': privateSubnetId, 'PublicSubnet1ID': publicSubnetId}
+#endDef
+
+
+def stackParameters(network, **parameters):
+    """
+    Return the stack parameters of a single zone OCS deployment with 3 masters, 3 workers
+    and 3 OCS nodes, updated with the given parameters.
+    """
+    result = {'MasterInstanceType': "m5.xlarge", 'NumberOfMaster': "3",
+              'ComputeInstanceType': "m5.4xlarge", 'NumberOfCompute': "3",
+              'StorageType': "OCS", 'OCSInstanceType': "m5.4xlarge", 'NumberOfOCS': "3"}
+    result.update(network)
+    result.update(parameters)
+    return result
+#endDef
+
+
+def checker(ec2, network, servicequotas=None, **parameters):
+    return PreflightChecker(ec2=ec2,servicequotas=servicequotas or ServiceQuotasStub(),
+                            parameters=stackParameters(network,**parameters),zones=[Zone])
+#endDef
+
+
+def results(preflight):
+    """
+    Return a dictionary of the status of each check in the report of the given checker.
+    """
+    return dict([(check,status) for check,status,detail in preflight.report])
+#endDef
+
+
+def test_instance_type_offerings_pass(ec2, network):
+    preflight = checker(ec2,network)
+    preflight.checkInstanceTypeOfferings()
+
+    assert results(preflight) == {"Instance type offerings": OK}
+#endDef
+
+
+def test_instance_type_offerings_fail(ec2, network):
+    preflight = checker(ec2,network,ComputeInstanceType="m5.nosuchsize")
+    preflight.checkInstanceTypeOfferings()
+
+    assert results(preflight) == {"Instance type offerings": FAIL}
+    assert "m5.nosuchsize in %s" % Zone in preflight.report[0][2]
+#endDef
+
+
+def test_vcpu_quota_pass(ec2, network):
+    preflight = checker(ec2,network)
+    preflight.checkVCPUQuota()
+
+    assert results(preflight) == {"On-demand standard vCPUs": OK}
+    # 2 bootstrap + 3 x 4 master + 3 x 16 worker + 3 x 16 OCS vCPUs
+    assert "install requires 110" in preflight.report[0][2]
+#endDef
+
+
+def test_vcpu_quota_fail(ec2, network):
+    quotas = ServiceQuotasStub({cpd_preflight.RunningOnDemandStandardVCPUs: 100})
+    preflight = checker(ec2,network,quotas)
+    preflight.checkVCPUQuota()
+
+    assert results(preflight) == {"On-demand standard vCPUs": FAIL}
+#endDef
+
+
+def test_vcpu_quota_warns_below_autoscaler_maximum(ec2, network):
+    quotas = ServiceQuotasStub(defaults={cpd_preflight.RunningOnDemandStandardVCPUs: 120})
+    preflight = checker(ec2,network,quotas)
+    preflight.checkVCPUQuota()
+
+    assert results(preflight) == {"On-demand standard vCPUs": WARN}
+    assert "quota 120" in preflight.report[0][2]
+#endDef
+
+
+def test_volume_quotas_pass(ec2, network):
+    preflight = checker(ec2,network)
+    preflight.checkVolumeQuotas()
+
+    assert results(preflight) == {"EBS gp2 storage": OK, "EBS io1 storage": OK, "EBS io1 IOPS": OK}
+    details = dict([(check,detail) for check,status,detail in preflight.report])
+    # 120 bootstrap + 3 x 120 OCS root + 3 x 2048 OCS device set GiB
+    assert "install requires 6624 GiB" in details["EBS gp2 storage"]
+    # 3 x 300 master + 3 x 300 worker GiB, 3 x 2400 + 3 x 1200 IOPS
+    assert "install requires 1800 GiB" in details["EBS io1 storage"]
+    assert "install requires 10800" in details["EBS io1 IOPS"]
+#endDef
+
+
+def test_gp2_storage_quota_fail(ec2, network):
+    quotas = ServiceQuotasStub({cpd_preflight.VolumeStorageTiB['gp2']: 6})
+    preflight = checker(ec2,network,quotas)
+    preflight.checkVolumeQuotas()
+
+    assert results(preflight) == {"EBS gp2 storage": FAIL, "EBS io1 storage": OK, "EBS io1 IOPS": OK}
+#endDef
+
+
+def test_io1_storage_and_iops_in_use_fail(ec2, network):
+    ec2.create_volume(AvailabilityZone=Zone,Size=500,VolumeType="io1",Iops=5000)
+    quotas = ServiceQuotasStub({cpd_preflight.VolumeStorageTiB['io1']: 2, cpd_preflight.IO1IOPS: 15000})
+    preflight = checker(ec2,network,quotas)
+    preflight.checkVolumeQuotas()
+
+    assert results(preflight) == {"EBS gp2 storage": OK, "EBS io1 storage": FAIL, "EBS io1 IOPS": FAIL}
+    details = dict([(check,detail) for check,status,detail in preflight.report])
+    assert "in use 500 GiB" in details["EBS io1 storage"]
+    assert "in use 5000" in details["EBS io1 IOPS"]
+#endDef
+
+
+def test_elastic_ip_quota_pass(ec2, network):
+    ec2.allocate_address(Domain="vpc")
+    preflight = checker(ec2,network)
+    preflight.checkElasticIPQuota()
+
+    assert results(preflight) == {"Elastic IPs": OK}
+    assert "in use 1" in preflight.report[0][2]
+#endDef
+
+
+def test_elastic_ip_quota_exhausted_warns(ec2, network):
+    for i in range(2):
+        ec2.allocate_address(Domain="vpc")
+    #endFor
+    preflight = checker(ec2,network,ServiceQuotasStub({cpd_preflight.ElasticIPs: 2}))
+    preflight.checkElasticIPQuota()
+
+    assert results(preflight) == {"Elastic IPs": WARN}
+#endDef
+
+
+def test_network_pass(ec2, network):
+    preflight = checker(ec2,network)
+    preflight.checkNetwork()
+
+    assert results(preflight) == {"VPC and subnets": OK}
+#endDef
+
+
+def test_network_fail(ec2, network):
+    otherVpcId = ec2.create_vpc(CidrBlock="10.1.0.0/16")['Vpc']['VpcId']
+    otherSubnetId = ec2.create_subnet(VpcId=otherVpcId,CidrBlock="10.1.1.0/24",AvailabilityZone="us-east-1b")['Subnet']['SubnetId']
+    smallSubnetId = ec2.create_subnet(VpcId=network['VPCID'],CidrBlock="10.0.3.0/28",AvailabilityZone=Zone)['Subnet']['SubnetId']
+    # 3 masters, 12 workers and 3 OCS nodes in a /28 subnet with 11 free addresses
+    preflight = checker(ec2,network,PublicSubnet1ID=otherSubnetId,PrivateSubnet1ID=smallSubnetId,NumberOfCompute="12")
+    preflight.checkNetwork()
+
+    assert results(preflight) == {"VPC and subnets": FAIL}
+    detail = preflight.report[0][2]
+    assert "%s is in %s, not in %s" % (otherSubnetId,otherVpcId,network['VPCID']) in detail
+    assert "%s is in us-east-1b, expected %s" % (otherSubnetId,Zone) in detail
+    assert "%s has 11 free addresses, 18 nodes are placed in it" % smallSubnetId in detail
+#endDef
+
+
+def test_network_missing_vpc_fails(ec2, network):
+    preflight = checker(ec2,network,VPCID="vpc-0123456789abcdef0")
+    preflight._runCheck("VPC and subnets",preflight.checkNetwork)
+
+    assert results(preflight) == {"VPC and subnets": FAIL}
+#endDef
+
+
+def test_run_passes(ec2, network):
+    report = checker(ec2,network).run()
+
+    assert sorted(set([status for check,status,detail in report])) == [OK]
+    assert len(report) == 7
+#endDef
+
+
+def test_run_raises_on_failure(ec2, network):
+    preflight = checker(ec2,network,ServiceQuotasStub({cpd_preflight.RunningOnDemandStandardVCPUs: 64}),
+                        ComputeInstanceType="m5.nosuchsize")
+
+    with pytest.raises(InvalidConfigurationException) as excinfo:
+        preflight.run()
+    #endWith
+
+    message = str(excinfo.value)
+    assert "Instance type offerings" in message
+    assert "On-demand standard vCPUs" in message
+#endDef
+
+
+def test_run_warns_when_quotas_access_denied(ec2, network):
+    report = checker(ec2,network,ServiceQuotasStub(accessDenied=True)).run()
+
+    statuses = dict([(check,(status,detail)) for check,status,detail in report])
+    for check in ("On-demand standard vCPUs","EBS volumes","Elastic IPs"):
+        assert statuses[check][0] == WARN
+        assert statuses[check][1].startswith("Not checked:")
+    #endFor
+    assert statuses["Instance type offerings"][0] == OK
+    assert statuses["VPC and subnets"][0] == OK
+#endDef
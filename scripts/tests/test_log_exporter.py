@@ -0,0 +1,140 @@
+"""
+Tests of the incremental export of logs in yapl.LogExporter against the S3 mock of the
+moto server of conftest.py.
+"""
+import os
+import sys
+import gzip
+import StringIO
+
+import boto3
+import pytest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from yapl.S3Helper import S3Helper
+from yapl.LogExporter import LogExporter
+
+Region = "us-west-2"
+Bucket = "cpd-deployment-logs"
+KeyPrefix = "cpd"
+Fqdn = "bootnode.example.com"
+
+
+@pytest.fixture
+def s3Helper(motoServer, awsCredentials, resetMotoServer):
+    """
+    An S3Helper with the clients of an empty moto server.
+    """
+    helper = S3Helper(region=Region)
+    helper.s3Client = boto3.client('s3',region_name=Region,endpoint_url=motoServer)
+    helper.s3Resource = boto3.resource('s3',region_name=Region,endpoint_url=motoServer)
+    return helper
+#endDef
+
+
+@pytest.fixture
+def logsDirectory(tmpdir):
+    return tmpdir.mkdir("logs")
+#endDef
+
+
+def logExporter(s3Helper, tmpdir, compress=True):
+    return LogExporter(region=Region,bucket=Bucket,keyPrefix=KeyPrefix,fqdn=Fqdn,s3Helper=s3Helper,
+                       compress=compress,manifestPath=str(tmpdir.join("manifest.json")),bundleSize=0)
+#endDef
+
+
+def logKeys(s3Helper, name):
+    """
+    Return the keys of the objects of the log with the given name, other than its index.
+    """
+    prefix = "%s/%s/%s" % (KeyPrefix,Fqdn,name)
+    response = s3Helper.s3Client.list_objects_v2(Bucket=Bucket,Prefix=prefix)
+    return sorted([entry['Key'] for entry in response.get('Contents',[]) if not entry['Key'].endswith(".index.json")])
+#endDef
+
+
+def logContent(s3Helper, key):
+    body = s3Helper.s3Client.get_object(Bucket=Bucket,Key=key)['Body'].read()
+    return gzip.GzipFile(fileobj=StringIO.StringIO(body)).read()
+#endDef
+
+
+def test_appended_log_is_exported_as_a_part(s3Helper, tmpdir, logsDirectory):
+    log = logsDirectory.join("install.log")
+    log.write("first line\n")
+    exporter = logExporter(s3Helper,tmpdir)
+    exporter.exportLogs(str(logsDirectory))
+    log.write("second line\n",mode="a")
+
+    exporter.exportLogs(str(logsDirectory))
+
+    key = "%s/%s/install.log" % (KeyPrefix,Fqdn)
+    assert logKeys(s3Helper,"install.log") == [key,key + ".part0001"]
+    assert logContent(s3Helper,key + ".part0001") == "second line\n"
+#endDef
+
+
+def test_appended_log_is_compacted_into_one_object(s3Helper, tmpdir, logsDirectory):
+    log = logsDirectory.join("install.log")
+    log.write("first line\n")
+    exporter = logExporter(s3Helper,tmpdir)
+    exporter.exportLogs(str(logsDirectory))
+    log.write("second line\n",mode="a")
+    exporter.exportLogs(str(logsDirectory))
+    log.write("third line\n",mode="a")
+
+    exporter.exportLogs(str(logsDirectory),compact=True)
+
+    key = "%s/%s/install.log" % (KeyPrefix,Fqdn)
+    assert logKeys(s3Helper,"install.log") == [key]
+    assert logContent(s3Helper,key) == "first line\nsecond line\nthird line\n"
+#endDef
+
+
+def test_compacted_log_stays_one_object_when_appended(s3Helper, tmpdir, logsDirectory):
+    log = logsDirectory.join("install.log")
+    log.write("first line\n")
+    exporter = logExporter(s3Helper,tmpdir)
+    exporter.exportLogs(str(logsDirectory))
+    log.write("second line\n",mode="a")
+    exporter.exportLogs(str(logsDirectory),compact=True)
+    log.write("third line\n",mode="a")
+
+    exporter.exportLogs(str(logsDirectory),compact=True)
+
+    key = "%s/%s/install.log" % (KeyPrefix,Fqdn)
+    assert logKeys(s3Helper,"install.log") == [key]
+    assert logContent(s3Helper,key) == "first line\nsecond line\nthird line\n"
+#endDef
+
+
+def test_compaction_skips_logs_without_parts(s3Helper, tmpdir, logsDirectory):
+    logsDirectory.join("install.log").write("first line\n")
+    exporter = logExporter(s3Helper,tmpdir)
+    exporter.exportLogs(str(logsDirectory))
+
+    key = "%s/%s/install.log" % (KeyPrefix,Fqdn)
+    # An unchanged log is skipped rather than uploaded again.
+    assert exporter._exportFile(str(logsDirectory.join("install.log")),key,compact=True) == None
+    assert logKeys(s3Helper,"install.log") == [key]
+#endDef
+
+
+def test_stop_shipper_compacts_shipped_logs(s3Helper, tmpdir, logsDirectory):
+    log = logsDirectory.join("icpd_install.log")
+    log.write("first line\n")
+    exporter = logExporter(s3Helper,tmpdir)
+    # The shipper thread does not ship on its own, the logs are shipped by the test.
+    exporter.startShipper([str(log)],interval=3600,sizeThreshold=1 << 40,pollInterval=0.1)
+    exporter.shipLogs()
+    log.write("second line\n",mode="a")
+    exporter.shipLogs()
+    log.write("third line\n",mode="a")
+
+    exporter.stopShipper(compact=True)
+
+    key = "%s/%s/icpd_install.log" % (KeyPrefix,Fqdn)
+    assert logKeys(s3Helper,"icpd_install.log") == [key]
+    assert logContent(s3Helper,key) == "first line\nsecond line\nthird line\n"
+#endDef
@@ -0,0 +1,125 @@
+"""
+Tests of the time window and tail queries of yapl.LogIndex.RemoteLog on logs exported
+with yapl.LogExporter to the S3 mock of the moto server of conftest.py.
+"""
+import os
+import sys
+
+import boto3
+import pytest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from yapl.S3Helper import S3Helper
+from yapl.LogExporter import LogExporter
+from yapl.LogIndex import RemoteLog
+
+Region = "us-west-2"
+Bucket = "cpd-deployment-logs"
+KeyPrefix = "cpd"
+Fqdn = "bootnode.example.com"
+Key = "%s/%s/install.log" % (KeyPrefix,Fqdn)
+
+
+class RecordingS3Helper(S3Helper):
+    """
+    An S3Helper that records the keys of the objects it gets.
+    """
+
+    def get_object_range(self, Bucket, Key, start=None, end=None):
+        self.fetchedKeys.append(Key)
+        return S3Helper.get_object_range(self,Bucket=Bucket,Key=Key,start=start,end=end)
+    #endDef
+#endClass
+
+
+@pytest.fixture
+def s3Helper(motoServer, awsCredentials, resetMotoServer):
+    """
+    An S3Helper with the clients of an empty moto server.
+    """
+    helper = RecordingS3Helper(region=Region)
+    helper.s3Client = boto3.client('s3',region_name=Region,endpoint_url=motoServer)
+    helper.s3Resource = boto3.resource('s3',region_name=Region,endpoint_url=motoServer)
+    helper.fetchedKeys = []
+    return helper
+#endDef
+
+
+def traceLines(hour, count=200):
+    """
+    Return count trace records in the given hour of the day, one every 10 seconds.
+    """
+    return "".join(["[20/09/10 %02d:%02d:%02d.000000 UTC] 000000000001 I install(1) main : Record %d of hour %d\n" %
+                    (hour,(i * 10) // 60,(i * 10) % 60,i,hour) for i in range(count)])
+#endDef
+
+
+@pytest.fixture
+def exportedLog(s3Helper, tmpdir):
+    """
+    A log of 4 hours exported in a log object with the first hour and 3 part objects.
+    """
+    logsDirectory = tmpdir.mkdir("logs")
+    log = logsDirectory.join("install.log")
+    exporter = LogExporter(region=Region,bucket=Bucket,keyPrefix=KeyPrefix,fqdn=Fqdn,s3Helper=s3Helper,
+                           compress=True,manifestPath=str(tmpdir.join("manifest.json")),bundleSize=0,
+                           indexInterval=4096)
+    for hour in (10,11,12,13):
+        log.write(traceLines(hour),mode="a")
+        exporter.exportLogs(str(logsDirectory))
+    #endFor
+    s3Helper.fetchedKeys = []
+    return exporter
+#endDef
+
+
+def test_parts_have_an_index(s3Helper, exportedLog):
+    keys = [entry['Key'] for entry in s3Helper.s3Client.list_objects_v2(Bucket=Bucket)['Contents']]
+
+    for part in (1,2,3):
+        assert "%s.part%04d.index.json" % (Key,part) in keys
+    #endFor
+#endDef
+
+
+def test_window_fetches_only_overlapping_parts(s3Helper, exportedLog):
+    log = RemoteLog(s3Helper,Bucket,Key)
+
+    lines = log.window("2020-09-10T12:10:00","2020-09-10T12:20:00")
+
+    assert len(lines) == 61
+    assert lines[0].startswith("[20/09/10 12:10:00")
+    assert lines[-1].startswith("[20/09/10 12:20:00")
+    # The index of the part of hour 13 tells that it begins after the window.
+    fetchedObjects = [key for key in s3Helper.fetchedKeys if not key.endswith(".index.json")]
+    assert fetchedObjects == [Key + ".part0002"]
+#endDef
+
+
+def test_window_spanning_the_log_object_and_parts(s3Helper, exportedLog):
+    log = RemoteLog(s3Helper,Bucket,Key)
+
+    lines = log.window("2020-09-10T10:30:00","2020-09-10T11:05:00")
+
+    assert lines[0].startswith("[20/09/10 10:30:00")
+    assert lines[-1].startswith("[20/09/10 11:05:00")
+    fetchedObjects = [key for key in s3Helper.fetchedKeys if not key.endswith(".index.json")]
+    assert fetchedObjects == [Key,Key + ".part0001"]
+#endDef
+
+
+def test_tail_reads_the_last_part(s3Helper, exportedLog):
+    log = RemoteLog(s3Helper,Bucket,Key)
+
+    lines = log.tail(5)
+
+    assert [line.split(" : ")[1] for line in lines] == ["Record %d of hour 13" % i for i in range(195,200)]
+#endDef
+
+
+def test_compaction_deletes_the_part_indexes(s3Helper, exportedLog, tmpdir):
+    exportedLog.exportLogs(str(tmpdir.join("logs")),compact=True)
+
+    keys = [entry['Key'] for entry in s3Helper.s3Client.list_objects_v2(Bucket=Bucket)['Contents']]
+    assert sorted(keys) == [Key,Key + ".index.json"]
+#endDef
@@ -0,0 +1,151 @@
+"""
+Created on Oct 18, 2026
+
+A local manifest of the log files that have been exported to S3.
+
+The manifest records, for each exported file, what the exporter knew about the
+file the last time it was exported:
+  size       - size of the file in bytes
+  mtime      - modification time of the file
+  offset     - number of bytes of the file that have been exported
+  parts      - number of part objects holding the bytes appended since the
+               last full export of the file
+  head       - md5 hex digest of the first headLength bytes of the file
+  headLength - number of bytes included in the head digest
+
+The head digest is used to tell a file that has only been appended to from a file
+that has been rewritten or replaced, e.g., by log rotation.
+
+The manifest is kept in a JSON file so it survives across processes.
+"""
+
+import os
+import json
+import hashlib
+import threading
+
+from yapl.Trace import Trace,Level
+from yapl.Exceptions import MissingArgumentException
+
+TR = Trace(__name__)
+
+# Number of bytes at the beginning of a file included in its head digest.
+HeadLength = 4096
+
+
+class ExportManifest(object):
+  """
+    A thread safe dictionary of export state keyed by the path of a log file
+    that is loaded from and saved to a JSON file.
+  """
+
+  def __init__(self, manifestPath):
+    """
+      manifestPath - path of the JSON manifest file.  The file gets created the
+      first time the manifest is saved.
+    """
+    object.__init__(self)
+
+    if (not manifestPath):
+      raise MissingArgumentException("The path of the export manifest file must be provided.")
+    #endIf
+
+    self.manifestPath = manifestPath
+    self.entries = {}
+    self.lock = threading.Lock()
+    self.load()
+  #endDef
+
+
+  def load(self):
+    """
+      Load the manifest entries from the manifest file if it exists.
+      An unreadable manifest is discarded, which results in a full export of every file.
+    """
+    methodName = "load"
+
+    if (os.path.exists(self.manifestPath)):
+      try:
+        with open(self.manifestPath,'r') as manifestFile:
+          entries = json.load(manifestFile)
+        #endWith
+      except Exception as e:
+        TR.warning(methodName,"Discarding unreadable export manifest: %s: %s" % (self.manifestPath,e))
+        entries = {}
+      #endTry
+      with self.lock:
+        self.entries = entries
+      #endWith
+    #endIf
+  #endDef
+
+
+  def save(self):
+    """
+      Write the manifest entries to the manifest file.  The entries are written to a
+      temporary file that is renamed over the manifest file so a reader never sees
+      a partially written manifest.
+    """
+    with self.lock:
+      content = json.dumps(self.entries,indent=2,sort_keys=True)
+    #endWith
+
+    dirName = os.path.dirname(self.manifestPath)
+    if (dirName and not os.path.exists(dirName)):
+      os.makedirs(dirName)
+    #endIf
+
+    tmpPath = "%s.tmp" % self.manifestPath
+    with open(tmpPath,'w') as tmpFile:
+      tmpFile.write(content)
+    #endWith
+    os.rename(tmpPath,self.manifestPath)
+  #endDef
+
+
+  def getEntry(self, filePath):
+    """
+      Return a copy of the manifest entry for the given file or None if the file
+      has not been exported.
+    """
+    with self.lock:
+      entry = self.entries.get(filePath)
+      if (entry != None):
+        entry = dict(entry)
+      #endIf
+    #endWith
+    return entry
+  #endDef
+
+
+  def setEntry(self, filePath, **values):
+    """
+      Set the given values in the manifest entry for the given file, creating the
+      entry if needed.
+    """
+    with self.lock:
+      self.entries.setdefault(filePath,{}).update(values)
+    #endWith
+  #endDef
+
+
+  def items(self):
+    """
+      Return a list of (filePath,entry) tuples with a copy of each entry.
+    """
+    with self.lock:
+      return [(filePath,dict(entry)) for filePath,entry in self.entries.items()]
+    #endWith
+  #endDef
+
+#endClass
+
+
+def headDigest(filePath, length=HeadLength):
+  """
+    Return the md5 hex digest of the first length bytes of the given file.
+  """
+  with open(filePath,'rb') as headFile:
+    return hashlib.md5(headFile.read(length)).hexdigest()
+  #endWith
+#endDef
@@ -1,18 +1,202 @@
 
 import os
+import stat
+import time
+import zlib
+import fnmatch
+import tarfile
+import json
+import threading
+from boto3.s3.transfer import TransferConfig
+from yapl.TaskRunner import TaskRunner
 from yapl.S3Helper import S3Helper
+from yapl.ExportManifest import ExportManifest, headDigest, HeadLength
+from yapl.LogIndex import LogIndexer, buildIndex, indexKey
 from yapl.Trace import Trace,Level
+import yapl.Metrics as Metrics
 from yapl.Exceptions import MissingArgumentException
+from yapl.Exceptions import InvalidConfigurationException
 
 TR = Trace(__name__)
 
+# Size of the chunks read from a log file and fed to the compressor.
+CompressChunkSize = 1024 * 1024
+
+
+class GzipStreamReader(object):
+  """
+    A read only file-like object that returns the gzip compressed content of another
+    file-like object.  The content is compressed as it is read, so a file can be
+    uploaded compressed without writing a temporary compressed copy of it.
+  """
+
+  def __init__(self, fileobj, compressLevel=6, indexer=None):
+    """
+      fileobj - the file-like object with the content to compress, opened in binary mode.
+      compressLevel - the zlib compression level, 1 (fastest) to 9 (smallest).
+      indexer - (optional) a yapl.LogIndex.LogIndexer.  The content is fed to the
+             indexer and the compressor is fully flushed at each new index entry so
+             the compressed content can be decompressed starting at that entry.
+    """
+    object.__init__(self)
+
+    self.fileobj = fileobj
+    # A wbits value of 16 + MAX_WBITS gets zlib to write a gzip header and trailer.
+    self.compressor = zlib.compressobj(compressLevel,zlib.DEFLATED,16 + zlib.MAX_WBITS)
+    self.buffer = []
+    self.buffered = 0
+    self.eof = False
+    self.bytesIn = 0
+    self.bytesOut = 0
+    self.indexer = indexer
+    # Number of compressed bytes produced, including bytes not read yet.
+    self.produced = 0
+  #endDef
+
+
+  def _compress(self, chunk):
+    """
+      Return the compressed content for the given chunk.  When there is an indexer,
+      the compressor is flushed at each index entry in the chunk and the offset of
+      the entry in the compressed content is recorded in the index.
+    """
+    if (not self.indexer):
+      return self.compressor.compress(chunk)
+    #endIf
+
+    output = []
+    produced = self.produced
+    previous = 0
+    firstEntry = len(self.indexer.entries)
+    for i,position in enumerate(self.indexer.feed(chunk)):
+      data = self.compressor.compress(chunk[previous:position]) + self.compressor.flush(zlib.Z_FULL_FLUSH)
+      output.append(data)
+      produced += len(data)
+      self.indexer.setObjectOffset(firstEntry + i,produced)
+      previous = position
+    #endFor
+    output.append(self.compressor.compress(chunk[previous:]))
+    return b"".join(output)
+  #endDef
+
+
+  def _fill(self, size):
+    """
+      Compress content from the underlying file until at least size compressed
+      bytes are buffered or the end of the file is reached.  A negative size reads
+      to the end of the file.
+    """
+    while (not self.eof and (size < 0 or self.buffered < size)):
+      chunk = self.fileobj.read(CompressChunkSize)
+      if (chunk):
+        self.bytesIn += len(chunk)
+        data = self._compress(chunk)
+      else:
+        data = self.compressor.flush()
+        self.eof = True
+      #endIf
+      self.produced += len(data)
+      if (data):
+        self.buffer.append(data)
+        self.buffered += len(data)
+      #endIf
+    #endWhile
+  #endDef
+
+
+  def read(self, size=-1):
+    """
+      Return up to size bytes of compressed content.  Return all of the remaining
+      compressed content if size is negative or omitted.  Return an empty string at
+      the end of the content.
+    """
+    if (size is None):
+      size = -1
+    #endIf
+    self._fill(size)
+    data = b"".join(self.buffer)
+    if (size < 0 or size >= len(data)):
+      self.buffer = []
+    else:
+      self.buffer = [data[size:]]
+      data = data[:size]
+    #endIf
+    self.buffered -= len(data)
+    self.bytesOut += len(data)
+    return data
+  #endDef
+
+#endClass
+
+
+class FileRangeReader(object):
+  """
+    A read only file-like object that returns at most length bytes of another
+    file-like object from its current position.  Used to upload the bytes that
+    have been appended to a log file since it was last exported.
+  """
+
+  def __init__(self, fileobj, length):
+    """
+      fileobj - the file-like object positioned at the first byte to return.
+      length - the number of bytes to return.
+    """
+    object.__init__(self)
+
+    self.fileobj = fileobj
+    self.remaining = length
+  #endDef
+
+
+  def read(self, size=-1):
+    """
+      Return up to size bytes, or all of the remaining bytes if size is negative or omitted.
+    """
+    if (size is None or size < 0 or size > self.remaining):
+      size = self.remaining
+    #endIf
+    if (size <= 0):
+      return b""
+    #endIf
+    data = self.fileobj.read(size)
+    self.remaining -= len(data)
+    return data
+  #endDef
+
+#endClass
+
+
+class CountingReader(object):
+  """
+    A read only file-like object that counts the bytes read from another file-like object.
+  """
+
+  def __init__(self, fileobj):
+    object.__init__(self)
+
+    self.fileobj = fileobj
+    self.bytesRead = 0
+  #endDef
+
+
+  def read(self, size=-1):
+    data = self.fileobj.read(size)
+    self.bytesRead += len(data)
+    return data
+  #endDef
+
+#endClass
+
 
 class LogExporter(object):
   """
     Helper for exporting log files to S3.
   """
 
-  def __init__(self,region=None, bucket=None, keyPrefix='logs',  fqdn=None):
+  def __init__(self,region=None, bucket=None, keyPrefix='logs',  fqdn=None, s3Helper=None, maxWorkers=8, retries=3, compress=False, compressLevel=6, manifestPath=None,
+               include=None, exclude=None, maxFileSize=None, bundleSize=64*1024,
+               multipartThreshold=64*1024*1024, partSize=32*1024*1024, partConcurrency=4,
+               indexInterval=1024*1024):
     """
       Constructor
       
@@ -27,6 +211,41 @@ class LogExporter(object):
       fqdn - fully qualified domain name of the node exporting the logs
              The FQDN provides uniqueness as there may be more than one node 
              with a given role.
+      s3Helper - (optional) an S3Helper instance to use.  Provide one when the
+             LogExporter is created on a thread other than the one that created
+             the boto3 session, since creating clients is not thread safe.
+      maxWorkers - the maximum number of log files uploaded at the same time.
+      retries - the number of times the upload of a log file is retried after a failure.
+      compress - when True each log file is gzip compressed as it is uploaded.  The
+             S3 object keeps the name of the log file and gets a Content-Encoding of
+             gzip, so it is decompressed by clients that honor the content encoding.
+      compressLevel - the zlib compression level, 1 (fastest) to 9 (smallest).
+      manifestPath - (optional) path of a local export manifest file.  When a manifest
+             is used the exports are incremental: files that have not changed since
+             they were last exported are skipped and only the bytes appended to a log
+             file are uploaded, as numbered part objects named <key>.partNNNN next to
+             the object of the log file.  See exportLogs() for the compaction of the
+             part objects into the object of the log file.
+      include - (optional) a list of glob patterns.  When given only the files with
+             a name or a path relative to the exported directory that matches one of
+             the patterns are exported.
+      exclude - (optional) a list of glob patterns.  Files and directories with a name
+             or a relative path that matches one of the patterns are not exported.
+      maxFileSize - (optional) files larger than maxFileSize bytes are not exported.
+      bundleSize - files smaller than bundleSize bytes are exported together in one
+             tar.gz archive per directory rather than one object per file.  A
+             bundleSize of 0 exports every file as its own object.
+      multipartThreshold - logs of multipartThreshold bytes or more are uploaded with
+             an S3 multipart upload, so a large log is uploaded in parts, concurrently,
+             and a failure only requires the failed part to be sent again.  The size
+             of a log before it is compressed is compared to the threshold and a
+             compressed log is compressed as its parts are read.
+      partSize - the size in bytes of the parts of a multipart upload.
+      partConcurrency - the maximum number of parts of a log uploaded at the same time.
+      indexInterval - the number of bytes between the entries of the sparse offset index
+             that is exported next to each log, and each part object of a log, with a
+             key of <key>.index.json.  The index lets yapl.LogIndex.RemoteLog fetch the tail of a log, or a time
+             window of it, with ranged GETs.  An indexInterval of 0 turns off indexing.
     """
     object.__init__(self)
     
@@ -47,7 +266,38 @@ class LogExporter(object):
     #endIf
     self.fqdn = fqdn
     
-    self.s3Helper = S3Helper(region=region)
+    self.maxWorkers = maxWorkers
+    self.retries = retries
+    self.compress = compress
+    self.compressLevel = compressLevel
+    self.include = include or []
+    self.exclude = exclude or []
+    self.maxFileSize = maxFileSize
+    self.bundleSize = bundleSize
+    self.multipartThreshold = multipartThreshold
+    self.partSize = partSize
+    self.partConcurrency = partConcurrency
+    self.indexInterval = indexInterval
+    # Compressed logs are streamed, so the managed transfer splits them into parts.
+    self.transferConfig = TransferConfig(multipart_threshold=multipartThreshold,
+                                         multipart_chunksize=partSize,
+                                         max_concurrency=partConcurrency)
+    
+    if (manifestPath):
+      self.manifest = ExportManifest(manifestPath)
+    else:
+      self.manifest = None
+    #endIf
+    
+    self.shipperThread = None
+    self.shipperStop = threading.Event()
+    self.shipperFiles = []
+    
+    if (s3Helper):
+      self.s3Helper = s3Helper
+    else:
+      self.s3Helper = S3Helper(region=region)
+    #endIf
     
     if (not self.s3Helper.bucketExists(bucket)):
       self.s3Helper.createBucket(bucket,region=region)
@@ -56,14 +306,434 @@ class LogExporter(object):
   #endDef
   
   
-  def exportLogs(self, logsDirectoryPath):
+  def _retry(self, description, function, *args, **kwargs):
+    """
+      Return the result of invoking the given function with the given arguments.
+      A failed invocation is retried up to self.retries times with an exponential
+      backoff.  The description of the operation is used in the trace of a retry.
+    """
+    methodName = "_retry"
+
+    attempt = 0
+    while (True):
+      try:
+        return function(*args,**kwargs)
+      except Exception as e:
+        if (attempt >= self.retries):
+          raise
+        #endIf
+        attempt += 1
+        delay = 2 ** attempt
+        TR.warning(methodName,"%s failed: %s  Retry %d of %d in %d seconds." % (description,e,attempt,self.retries,delay))
+        Metrics.sleep(delay,methodName)
+      #endTry
+    #endWhile
+  #endDef
+
+
+  def _putFile(self, bodyPath, s3Key, start=0, end=None, compress=None, index=False):
+    """
+      Upload the given file to the given S3 key of the bucket of this LogExporter.
+      When end is given only the bytes of the file from start up to end are uploaded.
+      When compress is True, or compress is None and self.compress is True, the content
+      is gzip compressed while it is uploaded.
+      When index is True and this LogExporter has an indexInterval, the offset index
+      of the log is built while the log is uploaded and exported after it.
+      A failed upload is retried up to self.retries times with an exponential backoff.
+      The file is opened again for each attempt so each attempt sends all of the content.
+
+      Return a tuple with the number of bytes of the file and the number of bytes uploaded.
+    """
+    return self._retry("Export of log: %s to S3: %s:%s" % (bodyPath,self.bucket,s3Key),
+                       self._putFileOnce,bodyPath,s3Key,start,end,compress,index)
+  #endDef
+
+
+  def _putFileOnce(self, bodyPath, s3Key, start, end, compress, index):
+    """
+      Make one attempt at the upload described in _putFile().
+    """
+    methodName = "_putFileOnce"
+
+    with open(bodyPath, 'rb') as bodyFile:
+      if (end == None):
+        size = os.path.getsize(bodyPath)
+        source = bodyFile
+      else:
+        size = end - start
+        bodyFile.seek(start)
+        source = FileRangeReader(bodyFile,size)
+      #endIf
+      if (compress == None):
+        compress = self.compress
+      #endIf
+      indexer = None
+      index = index and self.indexInterval
+      if (index and compress):
+        indexer = LogIndexer(self.indexInterval)
+      #endIf
+      if (compress):
+        reader = GzipStreamReader(source,compressLevel=self.compressLevel,indexer=indexer)
+        extraArgs = {'ContentEncoding': 'gzip', 'ContentType': 'text/plain'}
+        if (size >= self.multipartThreshold):
+          # The compressed size is not known in advance, so the log is compressed as the
+          # parts are read.  The size of the log bounds the size of the compressed log.
+          self.s3Helper.multipart_upload_fileobj(reader,self.bucket,s3Key,
+                                                 partSize=self.partSize,maxConcurrency=self.partConcurrency,
+                                                 sizeHint=size,ExtraArgs=extraArgs,retries=self.retries)
+        else:
+          self.s3Helper.upload_fileobj(reader,self.bucket,s3Key,ExtraArgs=extraArgs,Config=self.transferConfig)
+        #endIf
+        size,uploaded = reader.bytesIn,reader.bytesOut
+        if (TR.isLoggable(Level.FINE)):
+          TR.fine(methodName,"Exported log: %s compressed from %d to %d bytes, ratio %.1f:1" % (bodyPath,size,uploaded,float(size)/max(1,uploaded)))
+        #endIf
+      elif (size >= self.multipartThreshold):
+        uploaded = self.s3Helper.multipart_upload(self.bucket,s3Key,bodyPath,
+                                                  partSize=self.partSize,maxConcurrency=self.partConcurrency,
+                                                  start=start,end=start + size,
+                                                  ExtraArgs={'ContentType': 'text/plain'},retries=self.retries)
+      elif (end == None):
+        self.s3Helper.put_object(Bucket=self.bucket,Key=s3Key,Body=bodyFile)
+        uploaded = size
+      else:
+        self.s3Helper.upload_fileobj(source,self.bucket,s3Key,ExtraArgs={'ContentType': 'text/plain'})
+        uploaded = size
+      #endIf
+    #endWith
+
+    if (index):
+      if (not indexer):
+        indexer = buildIndex(bodyPath,start=start,end=start + size,interval=self.indexInterval)
+      #endIf
+      self.s3Helper.put_object(Bucket=self.bucket,Key=indexKey(s3Key),
+                               Body=json.dumps(indexer.toDict(compress,uploaded)),
+                               ContentType='application/json')
+      if (TR.isLoggable(Level.FINER)):
+        TR.finer(methodName,"Exported an index of %d entries for log: %s to S3: %s:%s" % (len(indexer.entries),bodyPath,self.bucket,indexKey(s3Key)))
+      #endIf
+    #endIf
+    return (size,uploaded)
+  #endDef
+
+
+  def _writeBundle(self, pipeOut, members, errors):
+    """
+      Write a tar.gz archive of the given members to the write end of a pipe.
+      members is a list of (archiveName,filePath) tuples.  Any exception is appended
+      to the given errors list for the thread reading the pipe.  The pipe is always
+      closed so the reader sees the end of the archive.
+    """
+    try:
+      with os.fdopen(pipeOut,'wb') as pipeFile:
+        archive = tarfile.open(fileobj=pipeFile,mode='w|gz')
+        try:
+          for archiveName,filePath in members:
+            archive.add(filePath,arcname=archiveName,recursive=False)
+          #endFor
+        finally:
+          archive.close()
+        #endTry
+      #endWith
+    except Exception as e:
+      errors.append(e)
+    #endTry
+  #endDef
+
+
+  def _putBundleOnce(self, s3Key, members):
+    """
+      Make one attempt at streaming a tar.gz archive of the given members to the given
+      S3 key.  The archive is written to a pipe by a separate thread and read from the
+      pipe by the upload, so the archive is never written to disk or held in memory.
+
+      Return the number of bytes uploaded.
+    """
+    pipeIn,pipeOut = os.pipe()
+    errors = []
+    writer = threading.Thread(target=self._writeBundle,name="LogBundleWriter",args=(pipeOut,members,errors))
+    writer.daemon = True
+    writer.start()
+    try:
+      with os.fdopen(pipeIn,'rb') as pipeFile:
+        reader = CountingReader(pipeFile)
+        self.s3Helper.upload_fileobj(reader,self.bucket,s3Key,ExtraArgs={'ContentType': 'application/gzip'})
+        # Drain the pipe in case the upload stopped reading before the end of the archive.
+        while (pipeFile.read(65536)):
+          pass
+        #endWhile
+      #endWith
+    finally:
+      # Closing the read end of the pipe unblocks the writer if the upload failed.
+      writer.join()
+    #endTry
+    if (errors):
+      raise errors[0]
+    #endIf
+    return reader.bytesRead
+  #endDef
+
+
+  def _exportBundle(self, s3Key, files):
+    """
+      Export the given small files in one tar.gz archive with the given S3 key.
+      files is a list of (relativePath,filePath,size,mtime) tuples.  The archive member
+      names are the paths of the files relative to the exported directory.
+
+      When this LogExporter has a manifest the archive is skipped if none of the files
+      have changed since the archive was last exported.
+
+      Return a tuple with the number of bytes of the files and the number of bytes
+      uploaded, or None when the archive was skipped.
+    """
+    methodName = "_exportBundle"
+
+    if (self.manifest):
+      changed = False
+      for relativePath,filePath,size,mtime in files:
+        entry = self.manifest.getEntry(filePath)
+        if (not entry or entry.get('bundle') != s3Key or entry['size'] != size or entry['mtime'] != mtime):
+          changed = True
+          break
+        #endIf
+      #endFor
+      if (not changed):
+        return None
+      #endIf
+    #endIf
+
+    members = [(relativePath,filePath) for relativePath,filePath,size,mtime in files]
+    uploaded = self._retry("Export of %d logs to S3: %s:%s" % (len(members),self.bucket,s3Key),
+                           self._putBundleOnce,s3Key,members)
+    totalBytes = sum([size for relativePath,filePath,size,mtime in files])
+    if (TR.isLoggable(Level.FINE)):
+      TR.fine(methodName,"Exported %d logs (%d bytes) in %d bytes to S3: %s:%s" % (len(members),totalBytes,uploaded,self.bucket,s3Key))
+    #endIf
+
+    if (self.manifest):
+      for relativePath,filePath,size,mtime in files:
+        self.manifest.setEntry(filePath,size=size,mtime=mtime,offset=size,parts=0,bundle=s3Key,head=None,headLength=0)
+      #endFor
+    #endIf
+    return (totalBytes,uploaded)
+  #endDef
+
+
+  def _isExcluded(self, relativePath):
+    """
+      Return True if the given path relative to the exported directory, or its last
+      element, matches one of the exclude patterns.
+    """
+    name = os.path.basename(relativePath)
+    for pattern in self.exclude:
+      if (fnmatch.fnmatch(relativePath,pattern) or fnmatch.fnmatch(name,pattern)):
+        return True
+      #endIf
+    #endFor
+    return False
+  #endDef
+
+
+  def _isIncluded(self, relativePath):
+    """
+      Return True if there are no include patterns or the given path relative to the
+      exported directory, or its last element, matches one of them.
+    """
+    if (not self.include):
+      return True
+    #endIf
+    name = os.path.basename(relativePath)
+    for pattern in self.include:
+      if (fnmatch.fnmatch(relativePath,pattern) or fnmatch.fnmatch(name,pattern)):
+        return True
+      #endIf
+    #endFor
+    return False
+  #endDef
+
+
+  def _scanDirectory(self, directoryPath):
+    """
+      Return a list of (name,path,isDirectory,size,mtime) tuples for the regular files
+      and directories in the given directory.  Symbolic links are not followed.
+
+      os.scandir() is used when it is available since the directory entries it returns
+      carry the file type, which saves a stat call for every directory.  With Python 2
+      os.listdir() and os.lstat() are used.
+    """
+    result = []
+    if (hasattr(os,'scandir')):
+      for entry in os.scandir(directoryPath):
+        if (entry.is_dir(follow_symlinks=False)):
+          result.append((entry.name,entry.path,True,0,0))
+        elif (entry.is_file(follow_symlinks=False)):
+          entryStat = entry.stat(follow_symlinks=False)
+          result.append((entry.name,entry.path,False,entryStat.st_size,entryStat.st_mtime))
+        #endIf
+      #endFor
+    else:
+      for name in os.listdir(directoryPath):
+        path = os.path.join(directoryPath,name)
+        entryStat = os.lstat(path)
+        if (stat.S_ISDIR(entryStat.st_mode)):
+          result.append((name,path,True,0,0))
+        elif (stat.S_ISREG(entryStat.st_mode)):
+          result.append((name,path,False,entryStat.st_size,entryStat.st_mtime))
+        #endIf
+      #endFor
+    #endIf
+    return result
+  #endDef
+
+
+  def _collectFiles(self, logsDirectoryPath, recursive):
+    """
+      Return a dictionary keyed by directory path, relative to the given logs directory,
+      with a list of (relativePath,filePath,size,mtime) tuples for the files to export
+      from each directory.  The include and exclude patterns and the maximum file size
+      of this LogExporter are applied.  A directory that can not be read is traced
+      and skipped.
+    """
+    methodName = "_collectFiles"
+
+    result = {}
+    pending = [""]
+    while (pending):
+      relativeDirectory = pending.pop()
+      directoryPath = os.path.join(logsDirectoryPath,relativeDirectory)
+      try:
+        entries = self._scanDirectory(directoryPath)
+      except OSError as e:
+        TR.warning(methodName,"Skipping directory: %s: %s" % (directoryPath,e))
+        continue
+      #endTry
+
+      for name,path,isDirectory,size,mtime in entries:
+        relativePath = os.path.join(relativeDirectory,name)
+        if (self._isExcluded(relativePath)):
+          if (TR.isLoggable(Level.FINER)):
+            TR.finer(methodName,"Excluded: %s" % path)
+          #endIf
+        elif (isDirectory):
+          if (recursive):
+            pending.append(relativePath)
+          #endIf
+        elif (not self._isIncluded(relativePath)):
+          if (TR.isLoggable(Level.FINER)):
+            TR.finer(methodName,"Not included: %s" % path)
+          #endIf
+        elif (self.maxFileSize and size > self.maxFileSize):
+          TR.warning(methodName,"Skipping log: %s with size %d bytes larger than the maximum of %d bytes." % (path,size,self.maxFileSize))
+        else:
+          result.setdefault(relativeDirectory,[]).append((relativePath,os.path.abspath(path),size,mtime))
+        #endIf
+      #endFor
+    #endWhile
+    return result
+  #endDef
+
+
+  def _partKeys(self, s3Key, parts):
+    """
+      Return the list of keys of the given number of part objects of the given key.
+    """
+    return ["%s.part%04d" % (s3Key,part) for part in range(1,parts+1)]
+  #endDef
+
+
+  def _exportFile(self, bodyPath, s3Key, compact=False):
+    """
+      Export the given file incrementally using the manifest of this LogExporter.
+
+        - A file that is not in the manifest, or that has been rewritten since it was
+          last exported, is uploaded in full to s3Key.
+        - A file that has not changed is skipped.
+        - A file that has only been appended to gets the new bytes uploaded to the
+          next part object of s3Key.
+
+      When compact is True and the file has part objects, or has been appended to,
+      the whole file is uploaded to s3Key and its part objects are deleted, which
+      leaves one object with the complete log.  An unchanged file without part
+      objects is skipped, compaction would only upload it again.
+
+      Return a tuple with the number of bytes of the file and the number of bytes
+      uploaded, or None when the file was skipped.
+    """
+    methodName = "_exportFile"
+
+    stat = os.stat(bodyPath)
+    size = stat.st_size
+    mtime = stat.st_mtime
+    entry = self.manifest.getEntry(bodyPath)
+
+    if (entry and entry['offset'] == size and entry['size'] == size and entry['mtime'] == mtime):
+      if (not compact or not entry['parts']):
+        return None
+      #endIf
+    #endIf
+
+    appended = (entry != None and size > entry['offset'] and
+                headDigest(bodyPath,entry['headLength']) == entry['head'])
+    # Only a log with part objects, or that would get one, is compacted.
+    compact = compact and entry != None and (entry['parts'] > 0 or appended)
+
+    if (appended and not compact):
+      part = entry['parts'] + 1
+      partKey = self._partKeys(s3Key,part)[-1]
+      if (TR.isLoggable(Level.FINE)):
+        TR.fine(methodName,"Exporting bytes %d to %d of log: %s to S3: %s:%s" % (entry['offset'],size,bodyPath,self.bucket,partKey))
+      #endIf
+      # The part has an index of its own, so a time window query fetches only the
+      # parts that overlap the window.
+      result = self._putFile(bodyPath,partKey,start=entry['offset'],end=size,index=True)
+      self.manifest.setEntry(bodyPath,size=size,mtime=mtime,offset=entry['offset']+result[0],parts=part)
+    else:
+      # Only the size of the file when it was examined is exported.  Bytes appended
+      # while the upload is in progress are picked up by the next export.
+      result = self._putFile(bodyPath,s3Key,start=0,end=size,index=True)
+      headLength = min(size,HeadLength)
+      self.manifest.setEntry(bodyPath,size=size,mtime=mtime,offset=result[0],parts=0,bundle=None,
+                             head=headDigest(bodyPath,headLength),headLength=headLength)
+      if (entry and entry['parts']):
+        partKeys = self._partKeys(s3Key,entry['parts'])
+        self.s3Helper.delete_objects(Bucket=self.bucket,Keys=partKeys + [indexKey(partKey) for partKey in partKeys])
+        if (TR.isLoggable(Level.FINE)):
+          TR.fine(methodName,"Compacted %d parts of log: %s into S3: %s:%s" % (entry['parts'],bodyPath,self.bucket,s3Key))
+        #endIf
+      #endIf
+    #endIf
+
+    return result
+  #endDef
+
+
+  def exportLogs(self, logsDirectoryPath, compact=False, recursive=True):
     """
       Export the deployment logs to the S3 bucket of this LogExporter.
       
       Each log will be exported using a path with the keyPrefix at the root 
-      followed by the role and FQDN and ending with the log file name as the 
-      last element of the S3 object key.
+      followed by the role and FQDN and ending with the path of the log file
+      relative to logsDirectoryPath as the last elements of the S3 object key.
+
+      When recursive is True the logs in the subdirectories of logsDirectoryPath are
+      exported as well.  The include, exclude and maxFileSize settings of this
+      LogExporter select the logs that are exported.
+
+      Files smaller than self.bundleSize in a directory are exported together in one
+      tar.gz archive named <directory>.small-logs.tar.gz, where <directory> is the
+      name of the directory, so hundreds of small files cost one upload.
       
+      The logs are uploaded concurrently by at most self.maxWorkers threads.
+      All uploads are attempted.  If one or more of them fail, the exception of the
+      first failed upload is raised once the others have completed.
+
+      When this LogExporter has a manifest the export is incremental, see _exportFile().
+      With compact set to True the logs that have part objects are uploaded in full
+      and their part objects are deleted, so each log ends up in one S3 object.  That
+      costs a full upload of each of those logs, so compaction is opt-in and meant for
+      the last export of the logs, when readers that fetch the object at the key of a
+      log expect the complete log.  RemoteLog reads the part objects of a log, so a log
+      does not need to be compacted for cpd_logtail.
     """
     methodName = "exportLogs"
     
@@ -72,27 +742,237 @@ class LogExporter(object):
         TR.fine(methodName, "Logs directory: %s does not exist." % logsDirectoryPath)
       #endIf
     else:
-      logFileNames = os.listdir(logsDirectoryPath)
-      if (not logFileNames):
+      logFiles = self._collectFiles(logsDirectoryPath,recursive)
+      if (not logFiles):
         if (TR.isLoggable(Level.FINE)):
           TR.fine(methodName,"No log files in %s" % logsDirectoryPath)
         #endIf
       else:
-        for fileName in logFileNames:
-          bodyPath = os.path.join(logsDirectoryPath,fileName)
-          if (os.path.isfile(bodyPath)):
-            s3Key = "%s/%s/%s" % (self.keyPrefix,self.fqdn,fileName)
-            
+        uploads = TaskRunner(name="Export of %s" % logsDirectoryPath,maxWorkers=self.maxWorkers)
+        fileCounts = {}
+        for relativeDirectory,files in sorted(logFiles.items()):
+          bundle = []
+          for relativePath,bodyPath,size,mtime in files:
+            entry = None
+            if (self.manifest):
+              entry = self.manifest.getEntry(bodyPath)
+            #endIf
+            # A log that has been exported as its own object, e.g., by the log shipper,
+            # continues to be exported as its own object.
+            if (size < self.bundleSize and (not entry or entry.get('bundle'))):
+              bundle.append((relativePath,bodyPath,size,mtime))
+              continue
+            #endIf
+
+            s3Key = "%s/%s/%s" % (self.keyPrefix,self.fqdn,relativePath)
             if (TR.isLoggable(Level.FINE)):
               TR.fine(methodName,"Exporting log: %s to S3: %s:%s" % (bodyPath,self.bucket,s3Key))
             #endIf
-            with open(bodyPath, 'r') as bodyFile:
-              self.s3Helper.put_object(Bucket=self.bucket,Key=s3Key,Body=bodyFile)
-            #endWith
+            if (self.manifest):
+              uploads.add(relativePath,self._exportFile,bodyPath,s3Key,compact)
+            else:
+              uploads.add(relativePath,self._putFile,bodyPath,s3Key,index=True)
+            #endIf
+            fileCounts[relativePath] = 1
+          #endFor
+
+          if (len(bundle) == 1):
+            # An archive with one member saves nothing.
+            relativePath,bodyPath,size,mtime = bundle[0]
+            s3Key = "%s/%s/%s" % (self.keyPrefix,self.fqdn,relativePath)
+            if (self.manifest):
+              uploads.add(relativePath,self._exportFile,bodyPath,s3Key,compact)
+            else:
+              uploads.add(relativePath,self._putFile,bodyPath,s3Key)
+            #endIf
+            fileCounts[relativePath] = 1
+          elif (bundle):
+            directoryName = os.path.basename(os.path.normpath(os.path.join(logsDirectoryPath,relativeDirectory)))
+            bundleName = os.path.join(relativeDirectory,"%s.small-logs.tar.gz" % directoryName)
+            s3Key = "%s/%s/%s" % (self.keyPrefix,self.fqdn,bundleName)
+            if (TR.isLoggable(Level.FINE)):
+              TR.fine(methodName,"Exporting %d small logs from: %s to S3: %s:%s" % (len(bundle),os.path.join(logsDirectoryPath,relativeDirectory),self.bucket,s3Key))
+            #endIf
+            uploads.add(bundleName,self._exportBundle,s3Key,bundle)
+            fileCounts[bundleName] = len(bundle)
+          #endIf
+        #endFor
+        
+        try:
+          uploads.run(raiseOnError=False)
+        finally:
+          if (self.manifest):
+            self.manifest.save()
+          #endIf
+        #endTry
+        exported = [taskName for taskName,result in uploads.results.items() if result != None]
+        unchanged = [taskName for taskName,result in uploads.results.items() if result == None]
+        totalBytes = sum([uploads.results[taskName][0] for taskName in exported])
+        uploadedBytes = sum([uploads.results[taskName][1] for taskName in exported])
+        TR.info(methodName,"Exported %d of %d logs (%d bytes) in %d objects, %d unchanged, from %s to S3: %s:%s/%s in %dms" %
+                (sum([fileCounts[taskName] for taskName in exported]),sum(fileCounts.values()),totalBytes,len(exported),
+                 sum([fileCounts[taskName] for taskName in unchanged]),
+                 logsDirectoryPath,self.bucket,self.keyPrefix,self.fqdn,uploads.elapsed))
+        if (self.compress):
+          TR.info(methodName,"Compressed %d bytes of logs from %s to %d bytes, ratio %.1f:1" %
+                  (totalBytes,logsDirectoryPath,uploadedBytes,float(totalBytes)/max(1,uploadedBytes)))
+        #endIf
+        if (TR.isLoggable(Level.FINE)):
+          uploads.traceTimings(methodName)
+        #endIf
+        
+        for task in uploads.tasks:
+          exc = uploads.exceptions.get(task[0])
+          if (exc):
+            raise exc
           #endIf
         #endFor
       #endIf
     #endIf
   #endDef
   
+  
+  def exportFile(self, filePath, name=None):
+    """
+      Export the given file to the S3 bucket of this LogExporter with a key made of the
+      keyPrefix, the FQDN and the given name, which defaults to the name of the file.
+      The file is uploaded as is, i.e., it is not compressed, since this is meant for
+      archives such as the diagnostics collected when a deployment fails.
+
+      Return the S3 key of the exported file.
+    """
+    methodName = "exportFile"
+
+    if (not name):
+      name = os.path.basename(filePath)
+    #endIf
+    s3Key = "%s/%s/%s" % (self.keyPrefix,self.fqdn,name)
+    size,uploaded = self._putFile(filePath,s3Key,compress=False)
+    TR.info(methodName,"Exported: %s (%d bytes) to S3: %s:%s" % (filePath,size,self.bucket,s3Key))
+    return s3Key
+  #endDef
+
+
+  def shipLogs(self, compact=False):
+    """
+      Export the new content of each of the log files being shipped by the background
+      shipper.  A failure to export a log is traced and does not keep the other logs
+      from being exported.  See startShipper() and exportLogs() for compact.
+    """
+    methodName = "shipLogs"
+
+    for filePath in self.shipperFiles:
+      if (os.path.isfile(filePath)):
+        s3Key = "%s/%s/%s" % (self.keyPrefix,self.fqdn,os.path.basename(filePath))
+        try:
+          result = self._exportFile(filePath,s3Key,compact)
+          if (result and TR.isLoggable(Level.FINER)):
+            TR.finer(methodName,"Shipped %d bytes of log: %s to S3: %s:%s" % (result[0],filePath,self.bucket,s3Key))
+          #endIf
+        except Exception as e:
+          TR.warning(methodName,"Shipping log: %s to S3: %s:%s failed: %s" % (filePath,self.bucket,s3Key,e))
+        #endTry
+      #endIf
+    #endFor
+    self.manifest.save()
+  #endDef
+
+
+  def _pendingBytes(self):
+    """
+      Return the number of bytes of the shipped log files that have not been exported.
+      Only the size of each file is examined, so checking is cheap.
+    """
+    pending = 0
+    for filePath in self.shipperFiles:
+      if (os.path.isfile(filePath)):
+        entry = self.manifest.getEntry(filePath)
+        offset = 0
+        if (entry):
+          offset = entry['offset']
+        #endIf
+        pending += abs(os.path.getsize(filePath) - offset)
+      #endIf
+    #endFor
+    return pending
+  #endDef
+
+
+  def _runShipper(self, interval, sizeThreshold, pollInterval):
+    """
+      The body of the background shipper thread.  Every pollInterval seconds the sizes
+      of the log files are checked.  The logs are shipped when sizeThreshold bytes are
+      pending or when interval seconds have gone by since they were last shipped and
+      there is something to ship.
+    """
+    methodName = "_runShipper"
+
+    lastShipped = time.time()
+    while (not self.shipperStop.wait(pollInterval)):
+      try:
+        pending = self._pendingBytes()
+        if (pending >= sizeThreshold or (pending and time.time() - lastShipped >= interval)):
+          self.shipLogs()
+          lastShipped = time.time()
+        #endIf
+      except Exception as e:
+        TR.warning(methodName,"Log shipping failed: %s" % e)
+      #endTry
+    #endWhile
+  #endDef
+
+
+  def startShipper(self, filePaths, interval=60, sizeThreshold=8*1024*1024, pollInterval=5):
+    """
+      Start a background thread that ships the given log files to S3 while they are
+      being written, so the logs of a deployment can be seen before it completes.
+
+      filePaths - the list of paths of the log files to ship.  A file that does not
+                  exist yet is picked up once it is created.
+      interval - the maximum number of seconds new log content waits to be shipped.
+      sizeThreshold - the number of new bytes that get shipped without waiting for
+                  the interval to expire.
+      pollInterval - the number of seconds between checks of the log file sizes.
+
+      The new content of each log is uploaded as a part object as described in
+      _exportFile(), so this LogExporter must have a manifest.  The shipper must be
+      stopped with stopShipper(), which ships the logs one last time.
+    """
+    methodName = "startShipper"
+
+    if (not self.manifest):
+      raise InvalidConfigurationException("The log shipper requires a LogExporter with an export manifest.")
+    #endIf
+
+    if (self.shipperThread):
+      raise InvalidConfigurationException("The log shipper has already been started.")
+    #endIf
+
+    self.shipperFiles = [os.path.abspath(filePath) for filePath in filePaths if filePath]
+    self.shipperStop.clear()
+    self.shipperThread = threading.Thread(target=self._runShipper,name="LogShipper",
+                                          args=(interval,sizeThreshold,pollInterval))
+    self.shipperThread.daemon = True
+    self.shipperThread.start()
+    TR.info(methodName,"Shipping logs: %s to S3: %s:%s/%s every %d seconds or %d bytes" %
+            (self.shipperFiles,self.bucket,self.keyPrefix,self.fqdn,interval,sizeThreshold))
+  #endDef
+
+
+  def stopShipper(self, compact=False):
+    """
+      Stop the background shipper thread and then ship the logs one last time.  With
+      compact set to True each log ends up in one S3 object, see exportLogs().
+    """
+    methodName = "stopShipper"
+
+    if (self.shipperThread):
+      self.shipperStop.set()
+      self.shipperThread.join()
+      self.shipperThread = None
+      self.shipLogs(compact=compact)
+      TR.info(methodName,"Stopped shipping logs: %s" % self.shipperFiles)
+    #endIf
+  #endDef
+  
 #endClass
\ No newline at end of file
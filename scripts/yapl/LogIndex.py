@@ -0,0 +1,457 @@
+"""
+Created on Oct 18, 2026
+
+A sparse offset index for logs exported to S3 and a reader that uses it to fetch
+the tail of an exported log, or the lines in a time window, with ranged GETs.
+
+The index of an exported log is a JSON object stored next to the log with the key
+of the log followed by .index.json.  It has an entry about every interval bytes of
+the log, at the start of a line.  Each entry is a list [offset, objectOffset, time]:
+  offset       - offset of the line in the log
+  objectOffset - offset in the S3 object where the content of the line begins
+  time         - the timestamp of the line as YYYY-MM-DDTHH:MM:SS, or None if the
+                 line does not begin with a recognized timestamp
+
+For a log that is uploaded uncompressed the objectOffset is the offset.  For a log
+that is uploaded gzip compressed the compressor is fully flushed at each entry, so
+the deflate stream can be decompressed starting at the objectOffset of any entry
+without the content that comes before it.
+
+Each part object of a log, with the content appended to the log after it was exported,
+has an index of its own next to it, with offsets relative to the part.  The time of
+the first entry of each part lets a time window query fetch only the parts that
+overlap the window.
+"""
+
+import re
+import zlib
+import json
+
+from botocore.exceptions import ClientError
+from yapl.Trace import Trace,Level
+
+TR = Trace(__name__)
+
+# Default number of bytes of a log between index entries.
+IndexInterval = 1024 * 1024
+
+# Number of bytes at the beginning of a line that are searched for a timestamp.
+TimestampSearchLength = 80
+
+# Timestamps recognized at the beginning of a log line.  Each pattern has named
+# groups for the year, month, day and time.
+TimestampPatterns = [
+  # yapl.Trace records: [20/09/10 12:00:00.123456 UTC]
+  re.compile(r'^\[(?P<year>\d\d)/(?P<month>\d\d)/(?P<day>\d\d) (?P<time>\d\d:\d\d:\d\d)'),
+  # ISO 8601 timestamps, e.g., openshift-install: time="2020-09-10T12:00:00Z", or syslog style logs
+  re.compile(r'(?P<year>\d{4})-(?P<month>\d\d)-(?P<day>\d\d)[T ](?P<time>\d\d:\d\d:\d\d)')
+]
+
+
+def parseTimestamp(line):
+  """
+    Return the timestamp at the beginning of the given line as a string of the form
+    YYYY-MM-DDTHH:MM:SS, or None if the line does not begin with a recognized timestamp.
+    Timestamps in that form sort in time order.
+  """
+  head = line[:TimestampSearchLength]
+  if (isinstance(head,bytes) and not isinstance(head,str)):
+    head = head.decode('utf-8','replace')
+  #endIf
+  for pattern in TimestampPatterns:
+    match = pattern.search(head)
+    if (match):
+      year = match.group('year')
+      if (len(year) == 2):
+        year = "20" + year
+      #endIf
+      return "%s-%s-%sT%s" % (year,match.group('month'),match.group('day'),match.group('time'))
+    #endIf
+  #endFor
+  return None
+#endDef
+
+
+def normalizeTime(value):
+  """
+    Return the given time, e.g., from a command line argument, in the form used in
+    the index.  A date and time may be separated with a T or a space.
+  """
+  if (not value):
+    return value
+  #endIf
+  return value.strip().replace(" ","T",1)
+#endDef
+
+
+class LogIndexer(object):
+  """
+    Build the index of a log from its content as the content is fed to it in chunks.
+  """
+
+  def __init__(self, interval=IndexInterval):
+    """
+      interval - the minimum number of bytes of the log between index entries.
+    """
+    object.__init__(self)
+
+    self.interval = interval
+    self.entries = [[0,0,None]]
+    self.offset = 0
+    self.nextEntryAt = interval
+  #endDef
+
+
+  def feed(self, data):
+    """
+      Add the given chunk of the log to the index.  Return the list of positions in
+      the chunk at which a new index entry begins.  The objectOffset of each new entry
+      is the offset of the line; setObjectOffset() sets it for a compressed object.
+    """
+    positions = []
+    if (self.offset == 0 and data):
+      self.entries[0][2] = parseTimestamp(data)
+      newline = data.find(b"\n")
+      if (self.entries[0][2] == None and newline >= 0):
+        # A part of a log may begin in the middle of a line, the time of the first
+        # entry is then the time of the next line.
+        self.entries[0][2] = parseTimestamp(data[newline + 1:newline + 1 + TimestampSearchLength])
+      #endIf
+    #endIf
+
+    while (self.offset + len(data) > self.nextEntryAt):
+      newline = data.find(b"\n",max(0,self.nextEntryAt - self.offset - 1))
+      if (newline < 0 or newline + 1 >= len(data)):
+        # The line continues in the next chunk.
+        break
+      #endIf
+      position = newline + 1
+      self.entries.append([self.offset + position,self.offset + position,parseTimestamp(data[position:position + TimestampSearchLength])])
+      positions.append(position)
+      self.nextEntryAt = self.offset + position + self.interval
+    #endWhile
+
+    self.offset += len(data)
+    return positions
+  #endDef
+
+
+  def setObjectOffset(self, entryIndex, objectOffset):
+    """
+      Set the offset in the S3 object of the given index entry.
+    """
+    self.entries[entryIndex][1] = objectOffset
+  #endDef
+
+
+  def toDict(self, compressed, objectSize):
+    """
+      Return the index as a dictionary to be stored as JSON.
+    """
+    return {'size': self.offset,
+            'compressed': compressed,
+            'objectSize': objectSize,
+            'interval': self.interval,
+            'entries': self.entries
+           }
+  #endDef
+
+#endClass
+
+
+def buildIndex(filePath, start=0, end=None, interval=IndexInterval, chunkSize=1024*1024):
+  """
+    Return a LogIndexer with the index of the bytes of the given file from start up to
+    end, or up to the end of the file when end is None.  The offsets of the index are
+    relative to start.  Used for logs and parts of logs that are uploaded uncompressed.
+  """
+  indexer = LogIndexer(interval)
+  with open(filePath,'rb') as logFile:
+    logFile.seek(start)
+    while (end == None or indexer.offset < end - start):
+      size = chunkSize
+      if (end != None):
+        size = min(chunkSize,end - start - indexer.offset)
+      #endIf
+      chunk = logFile.read(size)
+      if (not chunk):
+        break
+      #endIf
+      indexer.feed(chunk)
+    #endWhile
+  #endWith
+  return indexer
+#endDef
+
+
+def indexKey(s3Key):
+  """
+    Return the S3 key of the index of the log with the given key.
+  """
+  return "%s.index.json" % s3Key
+#endDef
+
+
+class RemoteLog(object):
+  """
+    Read parts of a log exported to S3 with ranged GETs guided by the index of the log.
+
+    Usage:
+      log = RemoteLog(s3Helper,bucket,"mystack/boot.example.com/icpd_install.log")
+      lines = log.tail(200)
+      lines = log.window("2020-09-10T12:00:00","2020-09-10T12:15:00")
+  """
+
+  def __init__(self, s3Helper, bucket, key):
+    """
+      s3Helper - an S3Helper instance
+      bucket - the S3 bucket of the exported logs
+      key - the S3 key of the exported log
+    """
+    object.__init__(self)
+
+    self.s3Helper = s3Helper
+    self.bucket = bucket
+    self.key = key
+    self.index = None
+    self.bytesFetched = 0
+    self.loadIndex()
+  #endDef
+
+
+  def _getIndex(self, key):
+    """
+      Return the index of the log object, or part object, with the given key, or None
+      when it has no index.
+    """
+    try:
+      content = self.s3Helper.get_object_range(Bucket=self.bucket,Key=indexKey(key))
+    except ClientError as e:
+      if (e.response['Error']['Code'] not in ('NoSuchKey','404')):
+        raise
+      #endIf
+      return None
+    #endTry
+    self.bytesFetched += len(content)
+    return json.loads(content)
+  #endDef
+
+
+  def loadIndex(self):
+    """
+      Load the index of the log.  When the log has no index, the index is set to a
+      single entry for the beginning of the log so the whole log is fetched.
+    """
+    methodName = "loadIndex"
+
+    self.index = self._getIndex(self.key)
+    if (self.index == None):
+      TR.warning(methodName,"No index for S3: %s:%s, the whole log is fetched." % (self.bucket,self.key))
+      encoding = self.s3Helper.s3Client.head_object(Bucket=self.bucket,Key=self.key).get('ContentEncoding')
+      self.index = {'compressed': encoding == 'gzip', 'entries': [[0,0,None]]}
+    #endIf
+    self.entries = self.index['entries']
+    self.partKeys = self._listParts()
+  #endDef
+
+
+  def _listParts(self):
+    """
+      Return the sorted list of the keys of the part objects of the log.  A log that
+      is being shipped while it is written has the content appended since its last
+      full export in part objects named <key>.partNNNN.
+    """
+    partKeys = []
+    paginator = self.s3Helper.s3Client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=self.bucket,Prefix="%s.part" % self.key):
+      for entry in page.get('Contents',[]):
+        if (entry['Key'][len(self.key) + len(".part"):].isdigit()):
+          partKeys.append(entry['Key'])
+        #endIf
+      #endFor
+    #endFor
+    return sorted(partKeys)
+  #endDef
+
+
+  def _decode(self, data, start, compressed):
+    """
+      Return the lines of the given content of the log fetched from the given offset
+      of an S3 object, gzip compressed when compressed is True.
+    """
+    if (compressed):
+      if (start == 0):
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+      else:
+        # The content after a full flush is a raw deflate stream.
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+      #endIf
+      data = decompressor.decompress(data)
+    #endIf
+    return data.decode('utf-8','replace').splitlines()
+  #endDef
+
+
+  def _fetchParts(self, partKeys):
+    """
+      Return the lines of the given part objects of the log.
+    """
+    lines = []
+    for partKey in partKeys:
+      data = self.s3Helper.get_object_range(Bucket=self.bucket,Key=partKey)
+      self.bytesFetched += len(data)
+      lines.extend(self._decode(data,0,self.index['compressed']))
+    #endFor
+    return lines
+  #endDef
+
+
+  def _fetch(self, first, last=None, key=None, index=None):
+    """
+      Return the lines of the log from index entry first up to, but not including,
+      index entry last.  When last is None the lines up to the end of the log object
+      are returned.  When key and index are given the lines are those of the part
+      object with the given key and index rather than the log object.
+    """
+    if (key == None):
+      key,index = self.key,self.index
+    #endIf
+    entries = index['entries']
+    start = entries[first][1]
+    end = None
+    if (last != None and last < len(entries)):
+      end = entries[last][1] - 1
+    #endIf
+    data = self.s3Helper.get_object_range(Bucket=self.bucket,Key=key,start=start,end=end)
+    self.bytesFetched += len(data)
+    return self._decode(data,start,index['compressed'])
+  #endDef
+
+
+  def _entryRange(self, entries, startTime, endTime):
+    """
+      Return the first and last index entries of the content with the lines from
+      startTime up to endTime, as arguments of _fetch().
+    """
+    first = 0
+    last = None
+    for i,entry in enumerate(entries):
+      entryTime = entry[2]
+      if (entryTime == None):
+        continue
+      #endIf
+      if (startTime and entryTime <= startTime):
+        first = i
+      #endIf
+      if (endTime and entryTime > endTime):
+        last = i
+        break
+      #endIf
+    #endFor
+    return first,last
+  #endDef
+
+
+  def _windowParts(self, startTime, endTime):
+    """
+      Return a list of the key and index of the part objects of the log that may have
+      lines from startTime up to endTime.  The lines of a part are no earlier than the
+      time of its first index entry and no later than the time of the first entry of
+      the next part.  A part without an index, or without a time, is always included.
+      The indexes of the parts after the end of the window are not fetched.
+    """
+    parts = []
+    for partKey in self.partKeys:
+      partIndex = self._getIndex(partKey)
+      partTime = None
+      if (partIndex):
+        partTime = partIndex['entries'][0][2]
+      #endIf
+      if (endTime and partTime != None and partTime[:len(endTime)] > endTime):
+        break
+      #endIf
+      if (startTime and partTime != None and partTime < startTime):
+        # The previous parts end before the window when this part begins before it.
+        parts = []
+      #endIf
+      parts.append((partKey,partIndex,partTime))
+    #endFor
+    return parts
+  #endDef
+
+
+  def tail(self, lineCount):
+    """
+      Return the last lineCount lines of the log.  The part objects of the log are
+      fetched first, most recent first, then the content after the last index entry
+      of the log object, and earlier content only as needed.
+    """
+    lines = []
+    for i in range(len(self.partKeys) - 1,-1,-1):
+      lines = self._fetchParts([self.partKeys[i]]) + lines
+      if (len(lines) >= lineCount):
+        return lines[-lineCount:]
+      #endIf
+    #endFor
+
+    partLines = lines
+    first = len(self.entries) - 1
+    while (True):
+      lines = self._fetch(first) + partLines
+      if (len(lines) >= lineCount or first == 0):
+        return lines[-lineCount:]
+      #endIf
+      # Fetch twice as much of the log on the next attempt.
+      first = max(0,first - (len(self.entries) - first))
+    #endWhile
+  #endDef
+
+
+  def window(self, startTime=None, endTime=None):
+    """
+      Return the lines of the log with a timestamp from startTime up to and including
+      endTime.  The times have the form YYYY-MM-DDTHH:MM:SS and either may be None.
+      Lines without a timestamp, e.g., the lines of a stack dump, go with the line
+      with a timestamp that comes before them.
+    """
+    startTime = normalizeTime(startTime)
+    endTime = normalizeTime(endTime)
+
+    first,last = self._entryRange(self.entries,startTime,endTime)
+    if (last != None or not self.partKeys):
+      lines = self._fetch(first,last)
+    else:
+      # The window extends past the content of the log object into the part objects.
+      parts = self._windowParts(startTime,endTime)
+      lines = []
+      # The content of the log object ends before the window when a part that comes
+      # after it begins before the window.
+      partTime = parts and parts[0][2]
+      if (not parts or (parts[0][0] == self.partKeys[0] and not (startTime and partTime and partTime < startTime))):
+        lines = self._fetch(first,last)
+      #endIf
+      for partKey,partIndex,partTime in parts:
+        if (partIndex):
+          partFirst,partLast = self._entryRange(partIndex['entries'],startTime,endTime)
+          lines.extend(self._fetch(partFirst,partLast,key=partKey,index=partIndex))
+        else:
+          lines.extend(self._fetchParts([partKey]))
+        #endIf
+      #endFor
+    #endIf
+
+    result = []
+    include = False
+    for line in lines:
+      lineTime = parseTimestamp(line)
+      if (lineTime != None):
+        include = ((not startTime or lineTime >= startTime) and (not endTime or lineTime[:len(endTime)] <= endTime))
+      #endIf
+      if (include):
+        result.append(line)
+      #endIf
+    #endFor
+    return result
+  #endDef
+
+#endClass
@@ -0,0 +1,601 @@
+"""
+Created on Oct 19, 2026
+
+A metrics registry of counters, gauges and histograms for the internals of the
+installer and a writer of the metrics in the Prometheus text exposition format,
+e.g., to a file for the node_exporter textfile collector.
+
+Usage:
+  import yapl.Metrics as Metrics
+
+  Metrics.instrumentSubprocess()
+  Metrics.observeSpans()
+  ec2 = Metrics.attach(boto3.client('ec2'))
+  Metrics.startWriter("/ibm/logs/cpd_install.prom",interval=60)
+  ...
+  Metrics.sleep(30,methodName)
+  Metrics.S3DownloadedBytes.inc(len(content))
+  ...
+  Metrics.stopWriter()
+
+The metrics of the installer are defined below.  Other metrics are created with
+counter(), gauge() and histogram().  Each metric has a fixed list of label names
+and each update gives a value for each label, e.g.,
+  AWSCalls.inc(service="ec2",operation="DescribeInstances")
+
+The file is written to a temporary file and renamed, so a reader never sees a
+partially written file.
+"""
+
+import os
+import time
+import threading
+import subprocess
+
+from yapl.Trace import Trace,Level
+import yapl.Trace as TraceModule
+from yapl.Exceptions import InvalidArgumentException
+
+TR = Trace(__name__)
+
+# The upper bounds of the histogram buckets in seconds when no buckets are given.
+# The steps of the installer take from milliseconds to hours.
+DefaultBuckets = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 1800, 3600, 7200)
+
+
+def _formatValue(value):
+  """
+    Return the given sample value in the form of the text exposition format.
+  """
+  if (type(value) == type(0) or type(value) == type(0L)):
+    return str(value)
+  #endIf
+  if (value == float('inf')):
+    return "+Inf"
+  #endIf
+  return repr(float(value))
+#endDef
+
+
+def _escapeLabelValue(value):
+  """
+    Return the given label value with backslash, double-quote and line feed escaped.
+  """
+  return ("%s" % value).replace("\\","\\\\").replace('"','\\"').replace("\n","\\n")
+#endDef
+
+
+class Metric(object):
+  """
+    The base class of the metric types.  A metric has a name, a help text, a list of
+    label names and a value for each combination of label values it has been updated
+    with.
+  """
+  metricType = "untyped"
+
+  def __init__(self, name, helpText, labelNames=()):
+    """
+      name - the metric name, e.g., yapl_aws_calls_total
+      helpText - a description of the metric for the HELP line
+      labelNames - the names of the labels of the metric
+    """
+    object.__init__(self)
+
+    self.name = name
+    self.helpText = helpText
+    self.labelNames = tuple(labelNames)
+    self.values = {}
+    self.lock = threading.Lock()
+  #endDef
+
+
+  def _key(self, labels):
+    """
+      Return the tuple of the values of the given labels in the order of the label names.
+    """
+    if (len(labels) != len(self.labelNames)):
+      raise InvalidArgumentException("Metric: %s has the labels: %s, not: %s" % (self.name,self.labelNames,sorted(labels.keys())))
+    #endIf
+    try:
+      return tuple(["%s" % labels[labelName] for labelName in self.labelNames])
+    except KeyError:
+      raise InvalidArgumentException("Metric: %s has the labels: %s, not: %s" % (self.name,self.labelNames,sorted(labels.keys())))
+    #endTry
+  #endDef
+
+
+  def _labelString(self, key, extra=None):
+    """
+      Return the label set of the given label values, plus the given extra label, in the
+      form {name="value",...}, or the empty string when there are no labels.
+    """
+    pairs = ['%s="%s"' % (labelName,_escapeLabelValue(value)) for labelName,value in zip(self.labelNames,key)]
+    if (extra):
+      pairs.append('%s="%s"' % extra)
+    #endIf
+    if (not pairs):
+      return ""
+    #endIf
+    return "{%s}" % ",".join(pairs)
+  #endDef
+
+
+  def get(self, **labels):
+    """
+      Return the value of the metric for the given labels, or None if it has not been set.
+    """
+    with self.lock:
+      return self.values.get(self._key(labels))
+    #endWith
+  #endDef
+
+
+  def render(self):
+    """
+      Return the list of the lines of the metric in the text exposition format.
+    """
+    lines = ["# HELP %s %s" % (self.name,self.helpText.replace("\\","\\\\").replace("\n","\\n")),
+             "# TYPE %s %s" % (self.name,self.metricType)]
+    with self.lock:
+      samples = sorted(self.values.items())
+    #endWith
+    for key,value in samples:
+      lines.append("%s%s %s" % (self.name,self._labelString(key),_formatValue(value)))
+    #endFor
+    return lines
+  #endDef
+
+#endClass
+
+
+class Counter(Metric):
+  """
+    A value that only goes up, e.g., the number of AWS calls.
+  """
+  metricType = "counter"
+
+  def inc(self, amount=1, **labels):
+    """
+      Add the given amount to the counter with the given labels.
+    """
+    if (amount < 0):
+      raise InvalidArgumentException("Counter: %s can not be decreased by %s." % (self.name,amount))
+    #endIf
+    key = self._key(labels)
+    with self.lock:
+      self.values[key] = self.values.get(key,0) + amount
+    #endWith
+  #endDef
+
+#endClass
+
+
+class Gauge(Metric):
+  """
+    A value that goes up and down or is set, e.g., the duration of the last run of a phase.
+  """
+  metricType = "gauge"
+
+  def set(self, value, **labels):
+    """
+      Set the gauge with the given labels to the given value.
+    """
+    key = self._key(labels)
+    with self.lock:
+      self.values[key] = value
+    #endWith
+  #endDef
+
+
+  def inc(self, amount=1, **labels):
+    """
+      Add the given amount, which may be negative, to the gauge with the given labels.
+    """
+    key = self._key(labels)
+    with self.lock:
+      self.values[key] = self.values.get(key,0) + amount
+    #endWith
+  #endDef
+
+#endClass
+
+
+class Histogram(Metric):
+  """
+    The distribution of observed values, e.g., the latency of subprocesses, as the
+    count of the values in cumulative buckets, the sum and the count of the values.
+  """
+  metricType = "histogram"
+
+  def __init__(self, name, helpText, labelNames=(), buckets=DefaultBuckets):
+    """
+      buckets - the increasing upper bounds of the buckets.  The +Inf bucket is added.
+    """
+    Metric.__init__(self,name,helpText,labelNames)
+    if ("le" in self.labelNames):
+      raise InvalidArgumentException("Histogram: %s can not have a label named le." % name)
+    #endIf
+    self.buckets = tuple(sorted(buckets))
+  #endDef
+
+
+  def observe(self, value, **labels):
+    """
+      Add the given value to the histogram with the given labels.
+    """
+    key = self._key(labels)
+    with self.lock:
+      # Each value is [bucket counts, sum, count].  The bucket counts are not cumulative.
+      entry = self.values.get(key)
+      if (entry == None):
+        entry = [[0] * len(self.buckets),0.0,0]
+        self.values[key] = entry
+      #endIf
+      for i,bound in enumerate(self.buckets):
+        if (value <= bound):
+          entry[0][i] += 1
+          break
+        #endIf
+      #endFor
+      entry[1] += value
+      entry[2] += 1
+    #endWith
+  #endDef
+
+
+  def render(self):
+    lines = ["# HELP %s %s" % (self.name,self.helpText.replace("\\","\\\\").replace("\n","\\n")),
+             "# TYPE %s %s" % (self.name,self.metricType)]
+    with self.lock:
+      samples = sorted([(key,(list(entry[0]),entry[1],entry[2])) for key,entry in self.values.items()])
+    #endWith
+    for key,(bucketCounts,total,count) in samples:
+      cumulative = 0
+      for bound,bucketCount in zip(self.buckets,bucketCounts):
+        cumulative += bucketCount
+        lines.append("%s_bucket%s %d" % (self.name,self._labelString(key,("le",_formatValue(float(bound)))),cumulative))
+      #endFor
+      lines.append("%s_bucket%s %d" % (self.name,self._labelString(key,("le","+Inf")),count))
+      lines.append("%s_sum%s %s" % (self.name,self._labelString(key),_formatValue(total)))
+      lines.append("%s_count%s %d" % (self.name,self._labelString(key),count))
+    #endFor
+    return lines
+  #endDef
+
+#endClass
+
+
+class MetricsRegistry(object):
+  """
+    A collection of metrics, rendered together in the text exposition format.
+  """
+
+  def __init__(self):
+    object.__init__(self)
+
+    self.metrics = {}
+    self.lock = threading.Lock()
+  #endDef
+
+
+  def _register(self, metricClass, name, helpText, labelNames, **kwargs):
+    """
+      Return the metric with the given name, creating it if needed.  A metric that
+      is already registered must be of the same type and have the same labels.
+    """
+    with self.lock:
+      metric = self.metrics.get(name)
+      if (metric == None):
+        metric = metricClass(name,helpText,labelNames,**kwargs)
+        self.metrics[name] = metric
+      elif (type(metric) != metricClass or metric.labelNames != tuple(labelNames)):
+        raise InvalidArgumentException("Metric: %s is already registered as a %s with the labels: %s" % (name,metric.metricType,metric.labelNames))
+      #endIf
+    #endWith
+    return metric
+  #endDef
+
+
+  def counter(self, name, helpText, labelNames=()):
+    return self._register(Counter,name,helpText,labelNames)
+  #endDef
+
+
+  def gauge(self, name, helpText, labelNames=()):
+    return self._register(Gauge,name,helpText,labelNames)
+  #endDef
+
+
+  def histogram(self, name, helpText, labelNames=(), buckets=DefaultBuckets):
+    return self._register(Histogram,name,helpText,labelNames,buckets=buckets)
+  #endDef
+
+
+  def render(self):
+    """
+      Return all of the metrics in the text exposition format, sorted by name.
+    """
+    with self.lock:
+      metrics = sorted(self.metrics.items())
+    #endWith
+    lines = []
+    for name,metric in metrics:
+      lines.extend(metric.render())
+    #endFor
+    return "%s\n" % "\n".join(lines)
+  #endDef
+
+
+  def write(self, path):
+    """
+      Write the metrics to the file with the given path.  The metrics are written to a
+      temporary file in the same directory that is then renamed to the given path.
+    """
+    tempPath = "%s.%d.tmp" % (path,os.getpid())
+    with open(tempPath,'w') as metricsFile:
+      metricsFile.write(self.render())
+    #endWith
+    os.rename(tempPath,path)
+  #endDef
+
+#endClass
+
+
+Registry = MetricsRegistry()
+
+
+def counter(name, helpText, labelNames=()):
+  """
+    Return the counter with the given name in the registry, creating it if needed.
+  """
+  return Registry.counter(name,helpText,labelNames)
+#endDef
+
+
+def gauge(name, helpText, labelNames=()):
+  """
+    Return the gauge with the given name in the registry, creating it if needed.
+  """
+  return Registry.gauge(name,helpText,labelNames)
+#endDef
+
+
+def histogram(name, helpText, labelNames=(), buckets=DefaultBuckets):
+  """
+    Return the histogram with the given name in the registry, creating it if needed.
+  """
+  return Registry.histogram(name,helpText,labelNames,buckets)
+#endDef
+
+
+# The metrics of the installer.
+PhaseDuration = gauge("yapl_phase_duration_seconds","Duration of each phase of the run, from the info level trace spans.",["phase"])
+AssemblyDuration = gauge("yapl_assembly_duration_seconds","Duration of the installation of each assembly.",["assembly"])
+SpanDuration = histogram("yapl_span_duration_seconds","Duration of the steps timed by trace spans.",["name"])
+SubprocessDuration = histogram("yapl_subprocess_duration_seconds","Latency of the subprocesses from start to exit.",["program"])
+SubprocessFailures = counter("yapl_subprocess_failures_total","Subprocesses that exited with a non-zero return code.",["program"])
+AWSCalls = counter("yapl_aws_calls_total","AWS API calls made by the boto3 clients, not counting retries.",["service","operation"])
+S3DownloadedBytes = counter("yapl_s3_downloaded_bytes_total","Bytes downloaded from S3.")
+S3UploadedBytes = counter("yapl_s3_uploaded_bytes_total","Bytes uploaded to S3.")
+SleepSeconds = counter("yapl_sleep_seconds_total","Seconds spent sleeping, e.g., between polls, retries and AWS rate limit waits.",["reason"])
+WriteTime = gauge("yapl_metrics_write_timestamp_seconds","Time the metrics were written.")
+
+
+def sleep(seconds, reason):
+  """
+    Sleep for the given number of seconds and count the time in SleepSeconds with the
+    given reason, e.g., the method name of the poll loop.
+  """
+  time.sleep(seconds)
+  SleepSeconds.inc(seconds,reason=reason)
+#endDef
+
+
+def attach(client):
+  """
+    Register a handler with the given boto3 client that counts each API call in
+    AWSCalls by service and operation.  Return the client as a convenience.
+  """
+  service = client.meta.service_model.service_name
+
+  def _beforeCall(model=None, **kwargs):
+    AWSCalls.inc(service=service,operation=getattr(model,'name',"unknown"))
+    # Returning None lets botocore make the call.
+    return None
+  #endDef
+
+  client.meta.events.register('before-call', _beforeCall)
+  return client
+#endDef
+
+
+def _programName(args):
+  """
+    Return the name of the program that the given subprocess arguments run.  For a
+    shell command, including bash -c <command>, it is the first word of the command.
+  """
+  if (isinstance(args,basestring)):
+    words = args.split()
+  else:
+    words = list(args)
+    if (len(words) > 2 and os.path.basename(words[0]) in ("bash","sh") and words[1] == "-c"):
+      words = words[2].split()
+    #endIf
+  #endIf
+  if (words and words[0] == "sudo" and len(words) > 1):
+    words = words[1:]
+  #endIf
+  if (not words):
+    return "unknown"
+  #endIf
+  return os.path.basename(words[0])
+#endDef
+
+
+def instrumentSubprocess():
+  """
+    Time every subprocess started with subprocess.Popen, which includes call(),
+    check_call() and check_output(), in SubprocessDuration and count the ones that
+    fail in SubprocessFailures.  The Popen class itself is instrumented, so the names
+    that modules imported from subprocess before this is called are covered too.
+    Calling this more than once has no further effect.
+  """
+  popenClass = subprocess.Popen
+  if (getattr(popenClass,'_yaplInstrumented',False)):
+    return
+  #endIf
+  originalInit = popenClass.__init__
+  originalHandleExitStatus = popenClass._handle_exitstatus
+
+  def __init__(self, args, *initArgs, **initKwargs):
+    self._yaplProgram = _programName(args)
+    self._yaplBeginTime = time.time()
+    originalInit(self,args,*initArgs,**initKwargs)
+  #endDef
+
+  def _handle_exitstatus(self, *exitArgs, **exitKwargs):
+    # Called once, when the exit status of the process has been collected.
+    originalHandleExitStatus(self,*exitArgs,**exitKwargs)
+    try:
+      SubprocessDuration.observe(time.time() - self._yaplBeginTime,program=self._yaplProgram)
+      if (self.returncode != 0):
+        SubprocessFailures.inc(program=self._yaplProgram)
+      #endIf
+    except AttributeError:
+      # A Popen created before it was instrumented.
+      pass
+    #endTry
+  #endDef
+
+  popenClass.__init__ = __init__
+  popenClass._handle_exitstatus = _handle_exitstatus
+  popenClass._yaplInstrumented = True
+#endDef
+
+
+def _observeSpan(span, duration):
+  """
+    The trace span listener of observeSpans().
+  """
+  SpanDuration.observe(duration,name=span.name)
+  assembly = span.attributes.get('assembly')
+  if (assembly):
+    AssemblyDuration.set(duration,assembly=assembly)
+  elif (span.level <= Level.INFO):
+    PhaseDuration.set(duration,phase=span.name)
+  #endIf
+#endDef
+
+
+def observeSpans():
+  """
+    Record the duration of every trace span that ends from now on in SpanDuration.
+    A span with an assembly attribute sets AssemblyDuration and any other span at
+    level info sets PhaseDuration.
+  """
+  TraceModule.addSpanListener(_observeSpan)
+#endDef
+
+
+class MetricsWriter(object):
+  """
+    A background thread that writes the metrics of a registry to a file every interval
+    seconds and once more when it is stopped.
+  """
+
+  def __init__(self, path, interval=60, registry=None):
+    """
+      path - the path of the metrics file, which should end with .prom for the
+             node_exporter textfile collector
+      interval - the number of seconds between writes
+      registry - the MetricsRegistry to write, the module registry by default
+    """
+    object.__init__(self)
+
+    self.path = path
+    self.interval = interval
+    self.registry = registry or Registry
+    self.stopEvent = threading.Event()
+    self.thread = None
+  #endDef
+
+
+  def write(self):
+    """
+      Write the metrics now.  A failure to write is traced and does not raise.
+    """
+    methodName = "write"
+    try:
+      WriteTime.set(time.time())
+      self.registry.write(self.path)
+    except Exception as e:
+      TR.warning(methodName,"Unable to write the metrics to: %s: %s" % (self.path,e))
+    #endTry
+  #endDef
+
+
+  def _run(self):
+    while (not self.stopEvent.wait(self.interval)):
+      self.write()
+    #endWhile
+  #endDef
+
+
+  def start(self):
+    """
+      Start the thread that writes the metrics.
+    """
+    methodName = "start"
+    dirName = os.path.dirname(self.path)
+    if (dirName and not os.path.exists(dirName)):
+      os.makedirs(dirName)
+    #endIf
+    self.stopEvent.clear()
+    self.thread = threading.Thread(target=self._run,name="MetricsWriter")
+    self.thread.daemon = True
+    self.thread.start()
+    TR.info(methodName,"Writing metrics to: %s every %s seconds" % (self.path,self.interval))
+  #endDef
+
+
+  def stop(self):
+    """
+      Stop the thread and write the metrics one last time.
+    """
+    if (self.thread):
+      self.stopEvent.set()
+      self.thread.join()
+      self.thread = None
+    #endIf
+    self.write()
+  #endDef
+
+#endClass
+
+
+Writer = None
+
+
+def startWriter(path, interval=60):
+  """
+    Start writing the metrics of the module registry to the given path every interval
+    seconds.  A writer that was already started is stopped first.
+  """
+  global Writer
+  stopWriter()
+  Writer = MetricsWriter(path,interval=interval)
+  Writer.start()
+#endDef
+
+
+def stopWriter():
+  """
+    Stop the writer started by startWriter(), which writes the metrics one last time.
+  """
+  global Writer
+  if (Writer != None):
+    writer = Writer
+    Writer = None
+    writer.stop()
+  #endIf
+#endDef
@@ -0,0 +1,225 @@
+"""
+Created on Oct 18, 2026
+
+A token bucket rate limiter for AWS API calls that is shared by all threads
+of a process.
+
+Each AWS service gets a token bucket.  Every HTTP request a boto3 client sends,
+including the retries done by botocore, takes a token from the bucket for the
+service of the client.  When the bucket is empty the calling thread waits until
+a token is available.  This keeps concurrent threads below the service request
+limits rather than having them collide and back off in the SDK.
+
+Usage:
+  import yapl.RateLimiter as RateLimiter
+
+  RateLimiter.configureRateLimits("ec2=10/20:iam=2/4")   # optional
+  ec2 = RateLimiter.attach(boto3.client('ec2'))
+  ...
+  RateLimiter.traceReport()
+
+The rate limits string has the form <service>=<rate>[/<burst>][:<service>=<rate>[/<burst>]]*
+where rate is the sustained number of requests per second and burst is the
+capacity of the bucket.  The service name is the boto3 service name, e.g., ec2, iam, s3.
+The service name * sets the rate for services with no explicit rate.
+"""
+
+import threading
+import time
+
+from yapl.Trace import Trace,Level
+import yapl.Metrics as Metrics
+from yapl.Exceptions import InvalidArgumentException
+
+TR = Trace(__name__)
+
+
+class TokenBucket(object):
+  """
+    A thread safe token bucket.  Tokens are added at a fixed rate up to the capacity
+    of the bucket.
+  """
+
+  def __init__(self, rate, capacity):
+    """
+      rate - tokens added per second
+      capacity - maximum number of tokens in the bucket (the burst size)
+    """
+    object.__init__(self)
+
+    if (rate <= 0 or capacity < 1):
+      raise InvalidArgumentException("A token bucket rate must be positive and its capacity at least 1. rate: %s, capacity: %s" % (rate,capacity))
+    #endIf
+
+    self.rate = float(rate)
+    self.capacity = float(capacity)
+    self.tokens = self.capacity
+    self.lastRefill = time.time()
+    self.lock = threading.Lock()
+  #endDef
+
+
+  def acquire(self):
+    """
+      Take a token from the bucket, waiting for one if the bucket is empty.
+      Return the number of seconds spent waiting.
+
+      A thread that finds the bucket empty reserves the next token by taking the
+      token count negative and then sleeps outside of the lock until its token
+      would have been added.  Waiting threads are served in the order they arrived.
+    """
+    with self.lock:
+      now = time.time()
+      self.tokens = min(self.capacity, self.tokens + (now - self.lastRefill) * self.rate)
+      self.lastRefill = now
+      self.tokens -= 1
+      if (self.tokens >= 0):
+        wait = 0.0
+      else:
+        wait = -self.tokens / self.rate
+      #endIf
+    #endWith
+
+    if (wait > 0):
+      Metrics.sleep(wait,"aws rate limit")
+    #endIf
+
+    return wait
+  #endDef
+
+#endClass
+
+
+# Sustained requests per second and burst size per service.  The defaults are
+# below the documented EC2 and IAM request rate limits for an account, which are
+# shared with the openshift-install and cluster operators.
+DefaultRates = {'ec2': (20, 40),
+                'iam': (5, 10),
+                's3': (100, 200),
+                '*': (20, 40)
+               }
+
+Rates = dict(DefaultRates)
+
+Buckets = {}
+
+# Statistics per service: [requests, total wait seconds, maximum wait seconds, requests that waited]
+Statistics = {}
+
+RegistryLock = threading.Lock()
+
+
+def parseRateLimits(rateLimits):
+  """
+    Return a dictionary keyed by service name with a (rate,burst) tuple for each
+    service in the given rate limits string.  When no burst is given it defaults
+    to twice the rate.
+  """
+  result = {}
+  if (rateLimits[0] == '"' and rateLimits[-1] == '"'):
+    rateLimits = rateLimits[1:-1]
+  #endIf
+  for rateLimit in rateLimits.split(":"):
+    parts = rateLimit.split("=")
+    if (len(parts) != 2 or not parts[0]):
+      raise InvalidArgumentException("Invalid rate limit: %s  A rate limit looks like <service>=<rate>[/<burst>]." % rateLimit)
+    #endIf
+    service = parts[0].strip()
+    try:
+      values = [float(value) for value in parts[1].split("/")]
+    except ValueError:
+      raise InvalidArgumentException("Invalid rate limit: %s  The rate and burst must be numbers." % rateLimit)
+    #endTry
+    if (len(values) == 1):
+      values.append(values[0] * 2)
+    #endIf
+    result[service] = (values[0],max(1,values[1]))
+  #endFor
+  return result
+#endDef
+
+
+def configureRateLimits(rateLimits):
+  """
+    Set the rates for the services in the given rate limits string.  Services that
+    are not in the string keep their default rate.  Buckets already in use are replaced.
+  """
+  rates = parseRateLimits(rateLimits)
+  with RegistryLock:
+    Rates.update(rates)
+    Buckets.clear()
+  #endWith
+#endDef
+
+
+def getBucket(service):
+  """
+    Return the token bucket for the given service, creating it if needed.
+  """
+  bucket = Buckets.get(service)
+  if (bucket == None):
+    with RegistryLock:
+      bucket = Buckets.get(service)
+      if (bucket == None):
+        rate,burst = Rates.get(service,Rates['*'])
+        bucket = TokenBucket(rate,burst)
+        Buckets[service] = bucket
+        Statistics.setdefault(service,[0,0.0,0.0,0])
+      #endIf
+    #endWith
+  #endIf
+  return bucket
+#endDef
+
+
+def acquire(service):
+  """
+    Take a token for a request to the given service and record the wait.
+    Return the number of seconds spent waiting.
+  """
+  wait = getBucket(service).acquire()
+  with RegistryLock:
+    stats = Statistics[service]
+    stats[0] += 1
+    if (wait > 0):
+      stats[1] += wait
+      stats[2] = max(stats[2],wait)
+      stats[3] += 1
+    #endIf
+  #endWith
+  return wait
+#endDef
+
+
+def attach(client):
+  """
+    Register the rate limiter with the given boto3 client so each HTTP request the
+    client sends, including retries, first takes a token for the service of the client.
+    Return the client as a convenience.
+  """
+  service = client.meta.service_model.service_name
+
+  def _beforeSend(**kwargs):
+    acquire(service)
+    # Returning None lets botocore send the request.
+    return None
+  #endDef
+
+  client.meta.events.register('before-send', _beforeSend)
+  return client
+#endDef
+
+
+def traceReport(methodName="traceReport"):
+  """
+    Emit an info trace record for each service with the number of requests, the
+    number of requests that were queued and the total and maximum queueing delay.
+  """
+  with RegistryLock:
+    report = sorted([(service,list(stats)) for service,stats in Statistics.items()])
+  #endWith
+  for service,(requests,totalWait,maxWait,waited) in report:
+    TR.info(methodName,"AWS %s requests: %d, queued: %d, total queueing delay: %.3fs, maximum delay: %.3fs, rate: %s/s burst: %s" %
+            (service,requests,waited,totalWait,maxWait,Rates.get(service,Rates['*'])[0],Rates.get(service,Rates['*'])[1]))
+  #endFor
+#endDef
@@ -1,21 +1,103 @@
 
 import os
+import time
+import hashlib
+import threading
+from multiprocessing.pool import ThreadPool
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
 
+import yapl.Utilities as Utilities
 from yapl.Trace import Trace,Level
+from yapl.TaskRunner import TaskRunner
+import yapl.RateLimiter as RateLimiter
+import yapl.Metrics as Metrics
 from yapl.Exceptions import MissingArgumentException
 from yapl.Exceptions import InvalidArgumentException
 from yapl.Exceptions import AccessDeniedException
+from yapl.Exceptions import FileTransferException
 
 TR = Trace(__name__)
 
+# S3 multipart upload limits: every part but the last must be at least 5 MiB
+# and an upload can have at most 10000 parts.
+MultipartMinPartSize = 5 * 1024 * 1024
+MultipartMaxParts = 10000
+
 S3ClientMethodRequiredArgs = {
     'download_file': ["Bucket", "Key", "Filename"]
   }
   
 
 
+class TransferProgress(object):
+  """
+    A boto3 managed transfer callback that keeps track of the bytes transferred and
+    emits a trace record with the progress and throughput of the transfer at most
+    every interval seconds.  The callback is invoked from the transfer threads.
+  """
+
+  def __init__(self, description, callback=None, interval=10):
+    """
+      description - a description of the transfer for the trace records.
+      callback - (optional) another callback to invoke with each byte count.
+      interval - the minimum number of seconds between progress trace records.
+    """
+    object.__init__(self)
+
+    self.description = description
+    self.callback = callback
+    self.interval = interval
+    self.bytesTransferred = 0
+    self.beginTime = time.time()
+    self.lastReport = self.beginTime
+    self.lock = threading.Lock()
+  #endDef
+
+
+  def __call__(self, bytesAmount):
+    methodName = "TransferProgress"
+
+    report = False
+    with self.lock:
+      self.bytesTransferred += bytesAmount
+      now = time.time()
+      if (now - self.lastReport >= self.interval):
+        self.lastReport = now
+        report = True
+      #endIf
+      bytesTransferred = self.bytesTransferred
+    #endWith
+
+    if (report and TR.isLoggable(Level.FINE)):
+      TR.fine(methodName,"%s: %d bytes transferred, %.1f MiB/s" % (self.description,bytesTransferred,self.throughput()))
+    #endIf
+
+    if (self.callback):
+      self.callback(bytesAmount)
+    #endIf
+  #endDef
+
+
+  def elapsed(self):
+    """
+      Return the number of seconds since the transfer started.
+    """
+    return time.time() - self.beginTime
+  #endDef
+
+
+  def throughput(self):
+    """
+      Return the average throughput of the transfer in MiB per second.
+    """
+    return (self.bytesTransferred / 1048576.0) / max(0.001,self.elapsed())
+  #endDef
+
+#endClass
+
+
 class S3Helper(object):
   """
     Various methods that ease the use of the boto3 Python library for working with S3.
@@ -29,12 +111,14 @@ class S3Helper(object):
     object.__init__(self)
     
     self.s3Resource = boto3.resource('s3')
+    Metrics.attach(RateLimiter.attach(self.s3Resource.meta.client))
     self.region=region
     if (self.region):
       self.s3Client = boto3.client('s3', region_name=self.region)
     else:
       self.s3Client = boto3.client('s3')
     #endIf
+    Metrics.attach(RateLimiter.attach(self.s3Client))
     
   #endDef
 
@@ -79,9 +163,7 @@ class S3Helper(object):
     except ClientError as e:
       # If a client error is thrown, then check that it was a 404 error.
       error_code = e.response['Error']['Code']
-      if (TR.isLoggable(Level.FINEST)):
-        TR.finest(methodName,"Error code: %s" % error_code)
-      #endIf
+      TR.finest(methodName,"Error code: %s",error_code)
       error_code = int(error_code)
       if (error_code == 404):
         result = False
@@ -122,9 +204,7 @@ class S3Helper(object):
         raise MissingArgumentException("The AWS region name for the bucket must be provided either to the S3Helper instance or in the createBucket() arguments.")
       #endIf
         
-      if (TR.isLoggable(Level.FINE)):
-        TR.fine(methodName,"Bucket: %s created in region: %s" % (bucketName,response.get('Location')))
-      #endIf 
+      TR.fine(methodName,"Bucket: %s created in region: %s",bucketName,response.get('Location'))
       bucket = self.s3Resource.Bucket(bucketName) 
     #endIf
     
@@ -132,11 +212,396 @@ class S3Helper(object):
   #endDef
   
   
+  def parseS3URI(self, s3URI):
+    """
+      Return a tuple (bucket,key) for the given S3 URI of the form s3://<bucket>/<key>.
+      The s3:// scheme prefix is optional.
+    """
+    if (not s3URI):
+      raise MissingArgumentException("An S3 URI must be provided.")
+    #endIf
+
+    path = s3URI
+    if (path.startswith("s3://")):
+      path = path[len("s3://"):]
+    #endIf
+
+    parts = path.split('/',1)
+    if (len(parts) != 2 or not parts[0] or not parts[1]):
+      raise InvalidArgumentException("The S3 URI: %s must be of the form s3://<bucket>/<key>." % s3URI)
+    #endIf
+
+    return (parts[0],parts[1])
+  #endDef
+
+
   def put_object(self,**kwargs):
     """
       Very thin wrapper around S3 client put_object()
     """
+    body = kwargs.get('Body')
+    size = 0
+    if (isinstance(body,basestring)):
+      size = len(body)
+    elif (hasattr(body,'fileno')):
+      size = os.fstat(body.fileno()).st_size - body.tell()
+    #endIf
     self.s3Client.put_object(**kwargs)
+    Metrics.S3UploadedBytes.inc(size)
+  #endDef
+
+
+  def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Config=None):
+    """
+      Thin wrapper around S3 client upload_fileobj()
+
+      Fileobj only needs a read() method, so it may be a stream that does not support
+      seek() such as a compressing reader.  The managed transfer reads it in chunks
+      and uses a multipart upload when the content is larger than the multipart
+      threshold of the given boto3.s3.transfer.TransferConfig.
+    """
+    progress = TransferProgress("Upload to S3: %s:%s" % (Bucket,Key))
+    self.s3Client.upload_fileobj(Fileobj,Bucket,Key,ExtraArgs=ExtraArgs,Callback=progress,Config=Config)
+    Metrics.S3UploadedBytes.inc(progress.bytesTransferred)
+  #endDef
+
+
+  def _uploadFilePart(self, Bucket, Key, UploadId, PartNumber, Filename, offset, length, retries):
+    """
+      Upload one part of a multipart upload from the given range of the given file.
+      See _uploadPart().
+    """
+    with open(Filename,'rb') as partFile:
+      partFile.seek(offset)
+      body = partFile.read(length)
+    #endWith
+    return self._uploadPart(Bucket,Key,UploadId,PartNumber,body,retries)
+  #endDef
+
+
+  def _uploadPart(self, Bucket, Key, UploadId, PartNumber, body, retries):
+    """
+      Upload the given content as one part of a multipart upload.
+      A failed part upload is retried up to retries times with an exponential backoff.
+      Return the part dictionary for complete_multipart_upload().
+    """
+    methodName = "_uploadPart"
+
+    attempt = 0
+    while (True):
+      try:
+        response = self.s3Client.upload_part(Bucket=Bucket,Key=Key,UploadId=UploadId,PartNumber=PartNumber,Body=body)
+        Metrics.S3UploadedBytes.inc(len(body))
+        return {'ETag': response['ETag'], 'PartNumber': PartNumber}
+      except Exception as e:
+        if (attempt >= retries):
+          raise
+        #endIf
+        attempt += 1
+        delay = 2 ** attempt
+        TR.warning(methodName,"Upload of part %d of S3: %s:%s failed: %s  Retry %d of %d in %d seconds." % (PartNumber,Bucket,Key,e,attempt,retries,delay))
+        Metrics.sleep(delay,methodName)
+      #endTry
+    #endWhile
+  #endDef
+
+
+  def multipart_upload(self, Bucket, Key, Filename, partSize=32*1024*1024, maxConcurrency=4,
+                       start=0, end=None, ExtraArgs=None, retries=3):
+    """
+      Upload the given file to the given bucket and key with an S3 multipart upload.
+
+      Bucket   - S3 bucket name
+      Key      - S3 object key
+      Filename - path of the file to upload
+      partSize - the size in bytes of each part.  The part size is raised to the S3
+                 minimum of 5 MiB, and as needed to keep the upload within 10000 parts.
+      maxConcurrency - the maximum number of parts uploaded at the same time.
+      start, end - (optional) the range of bytes of the file to upload.  By default
+                 the whole file is uploaded.
+      ExtraArgs - (optional) a dictionary of additional create_multipart_upload()
+                 arguments, e.g., ContentType.
+      retries  - the number of times the upload of a part is retried after a failure.
+
+      Each part is read from the file by the thread that uploads it, so at most
+      maxConcurrency parts are held in memory.  If a part can not be uploaded the
+      multipart upload is aborted, so S3 does not keep (and charge for) the parts
+      that were uploaded, and the exception of the first failed part is raised.
+
+      Return the number of bytes uploaded.
+    """
+    methodName = "multipart_upload"
+
+    if (end == None):
+      end = os.path.getsize(Filename)
+    #endIf
+    size = end - start
+
+    partSize = max(partSize,MultipartMinPartSize,(size + MultipartMaxParts - 1) // MultipartMaxParts)
+    partCount = max(1,(size + partSize - 1) // partSize)
+
+    beginTime = Utilities.currentTimeMillis()
+    response = self.s3Client.create_multipart_upload(Bucket=Bucket,Key=Key,**(ExtraArgs or {}))
+    uploadId = response['UploadId']
+    TR.fine(methodName,"Started multipart upload of %d bytes of %s to S3: %s:%s in %d parts of %d bytes, upload ID: %s",
+            size,Filename,Bucket,Key,partCount,partSize,uploadId)
+
+    try:
+      uploads = TaskRunner(name="Multipart upload of %s" % Filename,maxWorkers=maxConcurrency)
+      for part in range(partCount):
+        offset = start + part * partSize
+        uploads.add("part%05d" % (part + 1),self._uploadFilePart,Bucket,Key,uploadId,part + 1,
+                    Filename,offset,min(partSize,end - offset),retries)
+      #endFor
+      results = uploads.run()
+      parts = [results[task[0]] for task in uploads.tasks]
+      self.s3Client.complete_multipart_upload(Bucket=Bucket,Key=Key,UploadId=uploadId,MultipartUpload={'Parts': parts})
+    except Exception as e:
+      self._abortMultipartUpload(Bucket,Key,uploadId,Filename,e)
+      raise
+    #endTry
+
+    elapsed = Utilities.currentTimeMillis() - beginTime
+    if (TR.isLoggable(Level.FINE)):
+      TR.fine(methodName,"Uploaded %d bytes of %s to S3: %s:%s in %d parts in %dms (%.1f MiB/s)" %
+              (size,Filename,Bucket,Key,partCount,elapsed,(size / 1048576.0) / max(0.001,elapsed / 1000.0)))
+    #endIf
+    return size
+  #endDef
+
+
+  def _abortMultipartUpload(self, Bucket, Key, uploadId, source, exc):
+    """
+      Abort the given multipart upload of the given source that failed with the given
+      exception.  A failure to abort is traced and does not raise.
+    """
+    methodName = "_abortMultipartUpload"
+
+    TR.error(methodName,"Multipart upload of %s to S3: %s:%s failed, aborting upload ID: %s" % (source,Bucket,Key,uploadId),exc)
+    try:
+      self.s3Client.abort_multipart_upload(Bucket=Bucket,Key=Key,UploadId=uploadId)
+    except Exception as abortError:
+      TR.warning(methodName,"Abort of multipart upload ID: %s failed: %s" % (uploadId,abortError))
+    #endTry
+  #endDef
+
+
+  def multipart_upload_fileobj(self, Fileobj, Bucket, Key, partSize=32*1024*1024, maxConcurrency=4,
+                               sizeHint=None, ExtraArgs=None, retries=3):
+    """
+      Upload the content read from the given file-like object to the given bucket and
+      key with an S3 multipart upload.
+
+      Fileobj  - a file-like object with a read() method, e.g., a compressing reader, so
+                 the size of the content does not need to be known in advance.
+      partSize - the size in bytes of each part.  The part size is raised to the S3
+                 minimum of 5 MiB.
+      maxConcurrency - the maximum number of parts uploaded at the same time.
+      sizeHint - (optional) an upper bound of the size of the content, e.g., the size of
+                 a file before it is compressed.  The part size is raised as needed to
+                 keep an upload of that size within 10000 parts.
+      ExtraArgs - (optional) a dictionary of additional create_multipart_upload()
+                 arguments, e.g., ContentEncoding.
+      retries  - the number of times the upload of a part is retried after a failure.
+
+      The parts are read in order by the calling thread and uploaded by at most
+      maxConcurrency threads, so at most maxConcurrency + 1 parts are held in memory.
+      A failed part is retried from memory, without reading Fileobj again.  If a part
+      can not be uploaded no more parts are read, the multipart upload is aborted and
+      the exception of the first failed part is raised.
+
+      Return the number of bytes uploaded.
+    """
+    methodName = "multipart_upload_fileobj"
+
+    partSize = max(partSize,MultipartMinPartSize)
+    if (sizeHint):
+      partSize = max(partSize,(sizeHint + MultipartMaxParts - 1) // MultipartMaxParts)
+    #endIf
+
+    beginTime = Utilities.currentTimeMillis()
+    response = self.s3Client.create_multipart_upload(Bucket=Bucket,Key=Key,**(ExtraArgs or {}))
+    uploadId = response['UploadId']
+    TR.fine(methodName,"Started multipart upload of a stream to S3: %s:%s in parts of %d bytes, upload ID: %s",
+            Bucket,Key,partSize,uploadId)
+
+    condition = threading.Condition()
+    parts = {}
+    failures = []
+    running = [0]
+
+    def _run(partNumber, body):
+      try:
+        part = self._uploadPart(Bucket,Key,uploadId,partNumber,body,retries)
+        with condition:
+          parts[partNumber] = part
+        #endWith
+      except Exception as e:
+        with condition:
+          failures.append(e)
+        #endWith
+      #endTry
+      with condition:
+        running[0] -= 1
+        condition.notify()
+      #endWith
+    #endDef
+
+    size = 0
+    partCount = 0
+    try:
+      pool = ThreadPool(maxConcurrency)
+      try:
+        while (True):
+          with condition:
+            while (running[0] >= maxConcurrency and not failures):
+              condition.wait()
+            #endWhile
+            if (failures):
+              break
+            #endIf
+          #endWith
+          chunks = []
+          length = 0
+          while (length < partSize):
+            chunk = Fileobj.read(partSize - length)
+            if (not chunk):
+              break
+            #endIf
+            chunks.append(chunk)
+            length += len(chunk)
+          #endWhile
+          # An empty stream is uploaded as one empty part.
+          if (not length and partCount):
+            break
+          #endIf
+          partCount += 1
+          size += length
+          with condition:
+            running[0] += 1
+          #endWith
+          pool.apply_async(_run,(partCount,b"".join(chunks)))
+          if (length < partSize):
+            break
+          #endIf
+        #endWhile
+      finally:
+        pool.close()
+        pool.join()
+      #endTry
+      if (failures):
+        raise failures[0]
+      #endIf
+      self.s3Client.complete_multipart_upload(Bucket=Bucket,Key=Key,UploadId=uploadId,
+                                              MultipartUpload={'Parts': [parts[n] for n in range(1,partCount + 1)]})
+    except Exception as e:
+      self._abortMultipartUpload(Bucket,Key,uploadId,"a stream",e)
+      raise
+    #endTry
+
+    elapsed = Utilities.currentTimeMillis() - beginTime
+    if (TR.isLoggable(Level.FINE)):
+      TR.fine(methodName,"Uploaded %d bytes of a stream to S3: %s:%s in %d parts in %dms (%.1f MiB/s)" %
+              (size,Bucket,Key,partCount,elapsed,(size / 1048576.0) / max(0.001,elapsed / 1000.0)))
+    #endIf
+    return size
+  #endDef
+
+
+  def get_object_range(self, Bucket, Key, start=None, end=None):
+    """
+      Return the content of the given object, or of the range of bytes from start up
+      to and including end, with one GET request.  When end is None the range goes to
+      the end of the object.  When start is None the whole object is returned.
+
+      The bytes are returned as they are stored, i.e., an object with a Content-Encoding
+      of gzip is not decompressed.
+    """
+    methodName = "get_object_range"
+
+    kwargs = {'Bucket': Bucket, 'Key': Key}
+    if (start != None):
+      if (end == None):
+        kwargs['Range'] = "bytes=%d-" % start
+      else:
+        kwargs['Range'] = "bytes=%d-%d" % (start,end)
+      #endIf
+    #endIf
+    response = self.s3Client.get_object(**kwargs)
+    content = response['Body'].read()
+    Metrics.S3DownloadedBytes.inc(len(content))
+    TR.finer(methodName,"Fetched %d bytes of S3: %s:%s range: %s",len(content),Bucket,Key,kwargs.get('Range'))
+    return content
+  #endDef
+
+
+  def delete_objects(self, Bucket, Keys):
+    """
+      Delete the objects with the given list of keys from the given bucket.
+      The keys are deleted in batches of 1000, the most the S3 client delete_objects()
+      accepts in one request.  Keys of objects that do not exist are ignored.
+    """
+    methodName = "delete_objects"
+
+    for i in range(0,len(Keys),1000):
+      batch = [{'Key': key} for key in Keys[i:i+1000]]
+      response = self.s3Client.delete_objects(Bucket=Bucket,Delete={'Objects': batch, 'Quiet': True})
+      errors = response.get('Errors')
+      if (errors):
+        TR.warning(methodName,"Failed to delete %d objects from bucket: %s, first error: %s" % (len(errors),Bucket,errors[0]))
+      #endIf
+    #endFor
+  #endDef
+
+
+  def _getTransferConfig(self, config):
+    """
+      Return a boto3.s3.transfer.TransferConfig for the given config, which may be a
+      TransferConfig, a dictionary of TransferConfig keyword arguments, e.g., from a
+      YAML command document, or None.
+    """
+    if (config == None or isinstance(config,TransferConfig)):
+      return config
+    #endIf
+
+    if (type(config) != type({})):
+      raise InvalidArgumentException("A transfer Config must be a TransferConfig or a dictionary of TransferConfig arguments, not: %s" % config)
+    #endIf
+
+    try:
+      return TransferConfig(**config)
+    except TypeError as e:
+      raise InvalidArgumentException("Invalid transfer Config: %s  %s" % (config,e))
+    #endTry
+  #endDef
+
+
+  def _verifyChecksum(self, filePath, checksum):
+    """
+      Raise a FileTransferException if the hex digest of the given file does not match
+      the given checksum.  The checksum has the form <algorithm>:<hexdigest> where the
+      algorithm is a hashlib algorithm name, e.g., sha256:9f86d08...
+    """
+    methodName = "_verifyChecksum"
+
+    parts = checksum.split(':',1)
+    if (len(parts) != 2):
+      raise InvalidArgumentException("A checksum must have the form <algorithm>:<hexdigest>, not: %s" % checksum)
+    #endIf
+    algorithm,expected = parts[0].strip().lower(),parts[1].strip().lower()
+
+    try:
+      hasher = hashlib.new(algorithm)
+    except ValueError:
+      raise InvalidArgumentException("Unsupported checksum algorithm: %s" % algorithm)
+    #endTry
+
+    actual = Utilities.hashFile(filePath,hasher)
+    if (actual != expected):
+      raise FileTransferException("The %s checksum of: %s is %s, expected %s." % (algorithm,filePath,actual,expected))
+    #endIf
+
+    TR.fine(methodName,"Verified %s checksum of: %s",algorithm,filePath)
   #endDef
 
 
@@ -149,62 +614,229 @@ class S3Helper(object):
         Key      - S3 object key
         Filename - full path to the target file
       
-      WARNING: (PVS 04 FEB 2019) 
-        S3 client download_file() keyword arguments not supported (at this time)
-        kwargs: ExtraArgs, Callback, Config.  See S3 client doc for download_file().
+      S3 download_file optional arguments:
+        ExtraArgs - a dictionary of extra arguments for the get_object() call of the
+                    transfer, e.g., VersionId or RequestPayer.
+        Callback  - a callable invoked with the number of bytes of each chunk that is
+                    transferred.
+        Config    - a boto3.s3.transfer.TransferConfig, or a dictionary of TransferConfig
+                    arguments, to tune the transfer, e.g., multipart_chunksize and
+                    max_concurrency.  A dictionary is what a YAML command document provides.
         
       Additional kwargs
-        mode    - file system mode bits for the copied object
+        mode     - file system mode bits for the copied object.  In a YAML command
+                   document an octal string such as "0755" may be used.
+        checksum - the expected checksum of the downloaded file in the form
+                   <algorithm>:<hexdigest>, e.g., sha256:9f86d08...  If the checksum
+                   of the downloaded file does not match, the file is removed and a
+                   FileTransferException is raised.
+        
+      The progress of the download is traced at level FINE and the size, elapsed time
+      and throughput of the download are traced at level INFO.
         
       NOTES: 
        1. The S3 client download_file() method only allows documented keyword arguments.
           It throws an exception if it finds extraneous keyword arguments.
+          Only the arguments listed above are passed along to it.
        2. The Filename argument needs to include the file name.
           (The path can be absolute or relative to the current working directory.)
-       3. The directory structure in the Filename argument must exist.
+       3. The directory structure in the Filename argument is created if it does not exist.
     """
+    methodName = "download_file"
 
-    requiredArgs = self._getRequiredArgs('download_file',**kwargs)
+    Bucket,Key,Filename = self._getRequiredArgs('download_file',**kwargs)
     
-    Filename = kwargs.get('Filename')
     dirName = os.path.dirname(Filename)
-    if (not os.path.exists(dirName)):
+    if (dirName and not os.path.exists(dirName)):
       os.makedirs(dirName)
     #endIf
     
-    # TBD: If needed by some use-case, add support for kwargs here
+    progress = TransferProgress("Download of S3: %s:%s" % (Bucket,Key),callback=kwargs.get('Callback'))
+    self.s3Client.download_file(Bucket,Key,Filename,
+                                ExtraArgs=kwargs.get('ExtraArgs'),
+                                Callback=progress,
+                                Config=self._getTransferConfig(kwargs.get('Config')))
+    Metrics.S3DownloadedBytes.inc(progress.bytesTransferred)
+    TR.info(methodName,"Downloaded S3: %s:%s to %s, %d bytes in %.3fs, %.1f MiB/s" %
+            (Bucket,Key,Filename,progress.bytesTransferred,progress.elapsed(),progress.throughput()))
     
-    self.s3Client.download_file(*requiredArgs)
+    checksum = kwargs.get('checksum')
+    if (checksum):
+      try:
+        self._verifyChecksum(Filename,checksum)
+      except FileTransferException:
+        os.remove(Filename)
+        raise
+      #endTry
+    #endIf
     
     mode = kwargs.get('mode')
     if (mode):
+      if (type(mode) != type(0)):
+        mode = int(str(mode),8)
+      #endIf
       os.chmod(Filename,mode)
     #endIf
     
   #endDef
   
   
-  def invokeCommands(self, cmdDocs, start, **kwargs):
+  def _invokeCommand(self, doc):
+    """
+      Invoke the command of the given s3 command document and record its status and
+      its duration in milliseconds in the document.  The status is PROCESSED when the
+      command succeeds and FAILED when it raises an exception.
+    """
+    beginTime = Utilities.currentTimeMillis()
+    try:
+      getattr(self,doc['command'])(**doc)
+      doc['status'] = 'PROCESSED'
+    except:
+      doc['status'] = 'FAILED'
+      raise
+    finally:
+      doc['duration'] = Utilities.currentTimeMillis() - beginTime
+    #endTry
+  #endDef
+
+
+  def _getDependencies(self, docs):
+    """
+      Return a list with the set of indexes, in the given list of docs, of the docs
+      that each doc depends on.
+
+      A doc may have a name attribute and a dependsOn attribute with the name, or a
+      list of the names, of docs earlier or later in the list that must be processed
+      before it is.
+    """
+    names = {}
+    for i,doc in enumerate(docs):
+      name = doc.get('name')
+      if (name):
+        if (name in names):
+          raise InvalidArgumentException("More than one s3 command document is named: %s" % name)
+        #endIf
+        names[name] = i
+      #endIf
+    #endFor
+
+    dependencies = []
+    for doc in docs:
+      dependsOn = doc.get('dependsOn') or []
+      if (type(dependsOn) != type([])):
+        dependsOn = [dependsOn]
+      #endIf
+      indexes = set()
+      for name in dependsOn:
+        if (name not in names):
+          raise InvalidArgumentException("The s3 command document: %s depends on: %s, which is not the name of an s3 command document." % (doc,name))
+        #endIf
+        indexes.add(names[name])
+      #endFor
+      dependencies.append(indexes)
+    #endFor
+    return dependencies
+  #endDef
+
+
+  def _invokeConcurrently(self, docs, maxConcurrency):
+    """
+      Invoke the commands of the given docs with at most maxConcurrency of them running
+      at the same time.  A doc is started once all of the docs it depends on have been
+      processed.  After a command fails no more commands are started, the running
+      commands are allowed to complete and the exception of the first command that
+      failed is raised.  The docs that were not started get a status of SKIPPED.
     """
-      Process command docs to invoke each command in sequence that is of kind s3.  
+    methodName = "_invokeConcurrently"
+
+    dependencies = self._getDependencies(docs)
+    condition = threading.Condition()
+    completed = set()
+    failures = []
+    pending = list(range(len(docs)))
+    running = [0]
+
+    def _run(i):
+      try:
+        self._invokeCommand(docs[i])
+      except Exception as e:
+        TR.error(methodName,"The s3 command document: %s failed: %s" % (docs[i],e),e)
+        with condition:
+          failures.append(e)
+        #endWith
+      #endTry
+      with condition:
+        completed.add(i)
+        running[0] -= 1
+        condition.notify()
+      #endWith
+    #endDef
+
+    pool = ThreadPool(maxConcurrency)
+    try:
+      with condition:
+        while (pending and not failures):
+          ready = [i for i in pending if dependencies[i] <= completed]
+          if (not ready and not running[0]):
+            raise InvalidArgumentException("The dependsOn attributes of the s3 command documents: %s form a cycle." % [docs[i] for i in pending])
+          #endIf
+          for i in ready[:maxConcurrency - running[0]]:
+            pending.remove(i)
+            running[0] += 1
+            pool.apply_async(_run,(i,))
+          #endFor
+          condition.wait()
+        #endWhile
+      #endWith
+    finally:
+      pool.close()
+      pool.join()
+      for i in pending:
+        docs[i]['status'] = 'SKIPPED'
+      #endFor
+    #endTry
+
+    if (failures):
+      raise failures[0]
+    #endIf
+  #endDef
+
+
+  def invokeCommands(self, cmdDocs, start, maxConcurrency=1, **kwargs):
+    """
+      Process command docs to invoke each command that is of kind s3.  
 
       Processing of cmdDocs stops as soon as a doc kind that is not s3 is encountered.
 
-      All cmdDocs that are processed are marked with a status attribute with the value PROCESSED.
+      All cmdDocs that are processed are marked with a status attribute with the value 
+      PROCESSED and a duration attribute with the elapsed time of the command in
+      milliseconds.  A doc with a command that fails is marked with a status of FAILED.
              
       cmdDocs - a list of 1 or more YAML documents loaded from yaml.load_all()
       by the caller.
       
       start - index where to start processing in the cmdDocs list.
+
+      maxConcurrency - the maximum number of commands that run at the same time.
+      With the default of 1 the commands are invoked in sequence.  Otherwise the
+      commands run concurrently, except that a doc with a dependsOn attribute with the
+      name, or list of names, of other docs (given by their name attribute) is not
+      started until those docs have been processed.  Once a command fails no more
+      commands are started and the docs that are not started are marked with a
+      status of SKIPPED.  In both cases the exception of the first command that
+      failed is raised.
       
       NOTE: The method for each command is responsible for pulling out the arguments for the 
       underlying S3 method.  The S3 client methods only accept the arguments in the signature.
       Extraneous keyword arguments cause an exception to be raised.
     """
+    methodName = "invokeCommands"
+
     if (not cmdDocs):
       raise MissingArgumentException("A non-empty list of command documents (cmdDocs) must be provided.")
     #endIf
 
+    docs = []
     for i in range(start,len(cmdDocs)):
       doc = cmdDocs[i]
       
@@ -213,14 +845,24 @@ class S3Helper(object):
       
       command = doc.get('command')
       if (not command):
-        raise InvalidArgumentException("A helm command document: %s, must have a command attribute." % doc)
+        raise InvalidArgumentException("An s3 command document: %s, must have a command attribute." % doc)
       #endIf
-      
-      getattr(self,command)(**doc)
-      
-      doc['status'] = 'PROCESSED'
+      docs.append(doc)
     #endFor
-    
+
+    beginTime = Utilities.currentTimeMillis()
+    if (not maxConcurrency or maxConcurrency <= 1):
+      for doc in docs:
+        self._invokeCommand(doc)
+      #endFor
+    else:
+      self._invokeConcurrently(docs,maxConcurrency)
+    #endIf
+
+    if (TR.isLoggable(Level.FINE)):
+      TR.fine(methodName,"Processed %d s3 command documents in %dms with a maximum concurrency of %d." %
+              (len(docs),Utilities.currentTimeMillis() - beginTime,maxConcurrency or 1))
+    #endIf
   #endDef
   
   
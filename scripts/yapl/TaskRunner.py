@@ -0,0 +1,165 @@
+"""
+Created on Oct 18, 2026
+
+Support for running a collection of independent tasks concurrently on a
+bounded pool of threads and collecting their results and elapsed times.
+
+"""
+
+import threading
+from multiprocessing.pool import ThreadPool
+
+import yapl.Utilities as Utilities
+from yapl.Trace import Trace,Level
+from yapl.Exceptions import MissingArgumentException
+from yapl.Exceptions import InvalidArgumentException
+
+TR = Trace(__name__)
+
+
+class TaskRunner(object):
+  """
+    Run a set of named tasks concurrently and keep track of the result, the exception
+    (if any) and the elapsed time of each task.
+
+    Usage:
+      runner = TaskRunner(name="startup",maxWorkers=6)
+      runner.add("stackParameters", self.getStackParameters, stackId)
+      runner.add("sshKeys", self.createSSHKeys)
+      results = runner.run()
+      runner.traceTimings()
+
+    The tasks must be independent of one another.  The boto3 clients are thread safe,
+    boto3 resources and sessions are not, so tasks that make AWS calls need to use
+    clients that were created up front on the calling thread.
+  """
+
+  def __init__(self, name="tasks", maxWorkers=8):
+    """
+      name - a name for the collection of tasks used in trace messages.
+      maxWorkers - the maximum number of tasks that run at the same time.
+    """
+    object.__init__(self)
+
+    if (not maxWorkers or maxWorkers < 1):
+      raise InvalidArgumentException("The maximum number of workers (maxWorkers) must be at least 1.")
+    #endIf
+
+    self.name = name
+    self.maxWorkers = maxWorkers
+    self.tasks = []
+    self.results = {}
+    self.exceptions = {}
+    self.timings = {}
+    self.elapsed = 0
+    self.lock = threading.Lock()
+  #endDef
+
+
+  def add(self, taskName, function, *args, **kwargs):
+    """
+      Add a task to be run.  The given function is invoked with the given args and kwargs.
+      Task names must be unique within a TaskRunner.
+    """
+    if (not taskName):
+      raise MissingArgumentException("A task name must be provided.")
+    #endIf
+
+    if (taskName in [task[0] for task in self.tasks]):
+      raise InvalidArgumentException("A task named: %s has already been added to: %s" % (taskName,self.name))
+    #endIf
+
+    self.tasks.append((taskName,function,args,kwargs))
+  #endDef
+
+
+  def _runTask(self, taskName, function, args, kwargs):
+    """
+      Invoke the function for the given task and record its result or exception
+      along with its elapsed time in milliseconds.  The task is timed by a span on
+      the worker thread that runs it.
+    """
+    methodName = "_runTask"
+
+    beginTime = Utilities.currentTimeMillis()
+    span = TR.span(methodName,"%s: %s" % (self.name,taskName),level=Level.FINEST).start()
+    exc = None
+    try:
+      result = function(*args,**kwargs)
+      with self.lock:
+        self.results[taskName] = result
+      #endWith
+    except Exception as e:
+      exc = e
+      TR.error(methodName,"Task: %s of %s failed: %s" % (taskName,self.name,e),e)
+      with self.lock:
+        self.exceptions[taskName] = e
+      #endWith
+    finally:
+      span.end(exc)
+      with self.lock:
+        self.timings[taskName] = Utilities.currentTimeMillis() - beginTime
+      #endWith
+    #endTry
+  #endDef
+
+
+  def run(self, raiseOnError=True):
+    """
+      Run all the tasks that have been added and wait for all of them to complete.
+
+      Return a dictionary keyed by task name with the value returned by each task.
+
+      If raiseOnError is True and one or more tasks raised an exception, then the
+      exception of the first failed task, in the order the tasks were added, is raised
+      once all tasks have completed.  Otherwise the exceptions are available in the
+      exceptions dictionary keyed by task name.
+    """
+    methodName = "run"
+
+    beginTime = Utilities.currentTimeMillis()
+    if (self.tasks):
+      poolSize = min(self.maxWorkers,len(self.tasks))
+      if (TR.isLoggable(Level.FINE)):
+        TR.fine(methodName,"Running %d tasks of %s with %d workers." % (len(self.tasks),self.name,poolSize))
+      #endIf
+
+      with TR.span(methodName,self.name,tasks=len(self.tasks),workers=poolSize):
+        pool = ThreadPool(poolSize)
+        try:
+          for taskName,function,args,kwargs in self.tasks:
+            pool.apply_async(self._runTask,(taskName,function,args,kwargs))
+          #endFor
+        finally:
+          pool.close()
+          pool.join()
+        #endTry
+      #endWith
+    #endIf
+    self.elapsed = Utilities.currentTimeMillis() - beginTime
+
+    if (raiseOnError):
+      for task in self.tasks:
+        exc = self.exceptions.get(task[0])
+        if (exc):
+          raise exc
+        #endIf
+      #endFor
+    #endIf
+
+    return self.results
+  #endDef
+
+
+  def traceTimings(self, methodName="traceTimings"):
+    """
+      Emit an info trace record with the elapsed time of each task, slowest first,
+      and the elapsed time of the whole collection of tasks.
+    """
+    timings = sorted(self.timings.items(), key=lambda item: item[1], reverse=True)
+    breakdown = ", ".join(["%s=%dms%s" % (taskName,ms," (FAILED)" if taskName in self.exceptions else "")
+                           for taskName,ms in timings])
+    TR.info(methodName,"%s completed in %dms: %s" % (self.name,self.elapsed,breakdown))
+  #endDef
+
+#endClass
@@ -146,6 +146,83 @@
 #           Python/Jython style of stack trace.  There is a method that is used to
 #           create the stack representation from TTB as well as a method to create
 #           the stack BTT.
+#
+#      18 OCT 2026
+#           Reduced the fixed cost of every trace record in _log(), which matters
+#           when trace is enabled with *=all.  The source line number comes from
+#           sys._getframe() rather than from raising and catching an exception.
+#           The time stamp up to the seconds is formatted once a second and cached.
+#           The thread ID tag is formatted once per thread and cached.  The trace
+#           record is formatted with a single format string.  The output is the
+#           same as before.  See benchmarks/trace_benchmark.py for the measurements.
+#
+#           Added an asynchronous trace sink.  When it is enabled, _log() queues
+#           the trace record and an AsyncTraceWriter thread writes the queued
+#           records in batches, so threads emitting trace no longer serialize on
+#           the trace file lock and a flush for each record.  Added trace options
+#           to the trace string, e.g., @sink=async, to configure the sink.
+#
+#           The trace methods take an optional format and arguments, e.g.,
+#              TR.fine(methodName,"Response: %s",response)
+#           The message is only formatted when the record is emitted, so trace
+#           that is not enabled doesn't pay to format it.  For error() and severe()
+#           the arguments come after the exc argument.  The trace methods compare 
+#           the trace level with module level integer thresholds and isLoggable() 
+#           has a fast path for the Level constants.
+#
+#           Added a JSON Lines format for the trace log file, selected with the
+#           trace option @format=json.  Each trace record is written to the trace
+#           log file as a JSON object with the fields timestamp, thread, level,
+#           entity, line, method and message, plus exception for error() and
+#           severe() with an exception and context with the fields set with
+#           setTraceContext().  The text format remains the default and trace 
+#           that goes to stdout is always text.
+#
+#           Added rotation of the trace log file by size and/or by interval with
+#           the trace options @rotate.size, @rotate.interval and @rotate.keep.
+#           The file is swapped while the writer holds the trace file lock.  The
+#           rotated segment is compressed with gzip on a background thread and,
+#           with @rotate.keep, the oldest segments beyond the number to keep are
+#           deleted.  By default all segments are kept so they are exported with
+#           the logs.
+#
+#           Added a ring buffer for the trace records that are more verbose than
+#           a persisted level, selected with the trace option @persist=<level>.
+#           Those records are kept in memory, per thread or for all threads, up
+#           to a number of records and bytes.  When an error or severe record is
+#           emitted, the buffered records are written ahead of it.  So *=all with
+#           @persist=info keeps the detail of *=all for the path to an error for
+#           about the I/O cost of *=info.
+#
+#           The exception stack dumps are built as a list of lines that is joined
+#           once rather than by adding each line to a growing string.  The depth of
+#           the exception stack and of the frame stack can be set with the trace
+#           options @stackDepth and @frameDepth.  With @stackDedupWindow, a stack 
+#           that repeats within the window is written as a reference to its first 
+#           dump with a repeat count.
+#
+#           Added spans for timing the steps of a program.  A Span is used as a
+#           context manager or a decorator, e.g.,
+#              with TR.span(methodName,"Installing OCP",level=Level.INFO):
+#           and records the thread, begin time, duration and attributes of the step.
+#           When it ends, the elapsed time is traced at the span's level.  
+#           writeSpanTimeline() writes the spans as a Chrome trace event JSON file
+#           that chrome://tracing and https://ui.perfetto.dev show as a timeline
+#           with a track for each thread.
+#
+#           Added rate limiting of repetitive trace by call site, i.e., by entity, 
+#           method and line, configured with the trace options @ratelimit and
+#           @ratelimit.<entity_pattern>.  A record with the same message as the
+#           last record written from its call site within the interval is not
+#           written.  The next record that is written from the call site, when the 
+#           message changes or the interval has passed, says how many records were
+#           suppressed.  Warning, error and severe records are never suppressed.
+#           The records still suppressed are counted in a last record from each
+#           call site when the trace log file is flushed or closed.
+#
+#           Added span listeners, called with each span and its duration when the
+#           span ends, e.g., to record the durations of steps as metrics.
+#
 #  NOTES:
 #     In the trace methods, integer constants as defined in the Level class are used to 
 #     avoid the overhead of using the dictionary with the named trace levels in it.
@@ -279,6 +356,15 @@
 #      TR.finest(methodName,"trace message that likely involves string construction")
 #    #endIf
 #
+# When the cost is only in formatting the message, pass the format and its arguments
+# to the trace method instead.  The message is only formatted if the trace is emitted:
+#
+#    TR.finest(methodName,"Response: %s",response)
+#
+# For error() and severe() the arguments follow the (optional) exception argument:
+#
+#    TR.error(methodName,"Command: %s failed with return code: %s",e,cmd,retcode)
+#
 # It is often the case that you want trace to go to a log file.  To always append
 # trace to a log file use:
 #         TR.appendTraceLog(logPath)
@@ -353,6 +439,75 @@
 # without the "state" part.  (The state part is the "=enabled" or "=disabled" which
 # fell out of favor along about version 7 of WAS.)
 #
+# A trace string may also hold trace options that configure how trace is emitted
+# rather than which trace is emitted.  A trace option is @<name>=<value>, e.g.,
+#      *=all:@sink=async
+# The trace options are:
+#      @sink=sync|async           - sync (the default) writes each trace record to the
+#                                   trace log file when it is emitted.  async queues the
+#                                   record for an AsyncTraceWriter thread that writes
+#                                   the queued records in batches.
+#      @sink.flushInterval=<secs> - the most seconds a record stays queued (default 1.0)
+#      @sink.flushSize=<bytes>    - the size of the queued records that causes them to
+#                                   be written before the flush interval (default 65536)
+#      @format=text|json          - the format of the records in the trace log file.
+#                                   text (the default) is the format described above.
+#                                   json writes one JSON object per line (JSON Lines):
+#           {"timestamp":"2020-09-10T12:00:00.123456+00:00","thread":"7f0ed6540b80",
+#            "level":"INFO","entity":"cpd_install","line":1320,"method":"main",
+#            "message":"...","exception":{"type":"...","message":"...","stack":"..."},
+#            "context":{...}}
+#                                   exception is only present for error() and severe()
+#                                   with an exception, context only when fields have been
+#                                   set with setTraceContext().
+#      @rotate.size=<bytes>       - rotate the trace log file when it reaches the given
+#                                   size.  The size may end with K, M or G, e.g., 64M.
+#      @rotate.interval=<secs>    - rotate the trace log file when it has been open for
+#                                   the given time.  The time may end with s, m or h, 
+#                                   e.g., 1h.
+#      @rotate.keep=<count>       - the number of rotated segments to keep.  (default 0,
+#                                   all segments are kept)  A segment is deleted without
+#                                   regard to whether it has been exported.
+#      @persist=<level>           - write only the trace records at the given trace level 
+#                                   or lower, e.g., info.  The more verbose records that
+#                                   are enabled by the trace levels are kept in a ring 
+#                                   buffer and written ahead of the next error or severe
+#                                   record.  Without @persist all enabled records are written.
+#      @ring.scope=thread|global  - thread (the default) keeps a ring buffer for each
+#                                   thread and an error writes the records of its thread.
+#                                   global keeps one ring buffer for all threads.
+#      @ring.size=<count>         - the most records in a ring buffer (default 1000)
+#      @ring.bytes=<bytes>        - the most bytes of messages in a ring buffer (default 1M)
+#                                   The oldest records are dropped to stay within the limits.
+#      @stackDepth=<count>        - the most frames in the exception stack of an exception
+#                                   stack dump (default 10)
+#      @frameDepth=<count>        - the most recent frames in the frame stack of an exception
+#                                   stack dump (default all)
+#      @stackDedupWindow=<secs>   - an exception stack dump with the same stack as one dumped
+#                                   less than the given time before is replaced by a line 
+#                                   with the fingerprint of the stack, the time of the first
+#                                   dump and a repeat count.  The time may end with s, m or h.
+#                                   The full dumps then have a "Stack fingerprint" line. 
+#                                   (default 0, every stack is dumped in full)
+#      @ratelimit=<secs>          - a trace record with the same message as the last one
+#                                   written from the same call site (entity, method and 
+#                                   line) less than the given time before is suppressed.
+#                                   The time may end with s, m or h.  The next record 
+#                                   written from the call site ends with
+#                                   "(suppressed <n> similar records)", as does a last
+#                                   record written by flushTraceLog() and closeTraceLog().
+#                                   Warning, error and severe records are not rate
+#                                   limited.  (default 0, no limit)
+#      @ratelimit.<pattern>=<secs> - the rate limit of the trace of the entities that 
+#                                   match the given entity pattern, e.g.,
+#                                   @ratelimit.cpd_install=5m or @ratelimit.yapl.*=0
+#                                   The most specific pattern that matches is used.
+# A rotated trace log file is renamed to <path>.<yyyymmdd-HHMMSS>, compressed to 
+# <path>.<yyyymmdd-HHMMSS>.gz on a background thread and a new file is opened at <path>.
+# With the async sink, error and severe records are written before the trace method
+# returns, as are all queued records before them.  The queued records are also written
+# when the trace log file is opened or closed, by flushTraceLog() and at exit.
+#
 ##################################################################################################
 #
 # List of module level methods:
@@ -360,7 +515,11 @@
 #                              given path; truncates the existing file
 #    appendTraceLog(logPath) - opens for append, the trace log file with the 
 #                              given path
-#    closeTraceLog()         - closes the trace log file
+#    closeTraceLog()         - writes the counts of the rate limited records and
+#                              closes the trace log file
+#    flushTraceLog()         - writes the counts of the rate limited records and
+#                              waits until the trace records queued by the
+#                              asynchronous sink are written
 #
 #    parseTraceString(traceString) - parse the given trace string into a list 
 #                                    of TraceSpecification instances
@@ -374,6 +533,27 @@
 #
 #   getTraceSpec()            - Get the value of Trace.traceSpec.
 #
+#   parseTraceOptions(traceString) - parse the trace options in the given trace string
+#                                    into a dictionary of option name and value.
+#
+#   configureTraceOptions(options) - apply the given dictionary of trace options.
+#                                    configureTrace() applies the trace options in its
+#                                    trace string.
+#
+#   setTraceContext(**fields)  - set fields for the context of the JSON trace records;
+#                                a field set to None is removed
+#
+#   rotateTraceLog()           - rotate the trace log file now
+#
+#   writeSpanTimeline(path)    - write the spans recorded so far to the given file
+#                                as a Chrome trace event JSON timeline
+#
+#   addSpanListener(listener)  - call listener(span,duration) when each span ends
+#
+#   startAsyncWriter(flushInterval,flushSize) - start the asynchronous trace sink
+#   stopAsyncWriter()                         - write the queued trace records and
+#                                               stop the asynchronous trace sink
+#
 #   configureTrace(traceString) - Use this method to configure trace levels in all 
 #                                 registered Trace instances based on the given traceString.
 #                                 Assuming the usage pattern of instantiating a Trace instance
@@ -397,14 +577,17 @@
 #   TraceSpecificationException
 #   Level
 #   TraceSpecification
+#   RateLimitSpecification
 #   Trace
+#   AsyncTraceWriter
+#   TraceRingBuffer
+#   Span
 #
 ##################################################################################################
 #
 # Imports
 #
-# Import Python module for dealing with dates and time and time zone names
-import datetime
+# Import Python module for dealing with time stamps and time zone names
 import time
 import thread
 
@@ -412,6 +595,31 @@ import thread
 # using a log file.
 from threading import Lock
 
+# Condition and Thread are needed for the asynchronous trace sink.
+from threading import Condition, Thread
+
+# currentThread is needed for the thread name of a span.
+from threading import currentThread
+
+# local and deque are needed for the ring buffer of the trace records that are not persisted.
+from threading import local
+from collections import deque
+
+# atexit is used to write the records queued by the asynchronous trace sink at exit.
+import atexit
+
+# The JSON trace format uses ujson when it is available because it is much faster
+# than the json module.  Without ujson, strings are encoded with the (C accelerated)
+# string encoder of the json module rather than through json.dumps().
+try:
+  import ujson as _json
+  _jsonEncodeString = _json.dumps
+except ImportError:
+  import json as _json
+  import json.encoder
+  _jsonEncodeString = json.encoder.encode_basestring_ascii
+#endTry
+
 # The re module is needed for dealing with trace specifications
 # that might use a wild-card character.
 import re
@@ -425,6 +633,10 @@ import os
 # traceback is used for an exception stack dump
 import traceback
 
+# gzip and shutil are used to compress rotated segments of the trace log file.
+import gzip
+import shutil
+
 TimeZoneName = time.strftime('%Z')
 
 ##################################################################################################
@@ -499,6 +711,26 @@ class Level:
   ALL = 7
 #endClass
 
+# The trace methods compare the trace level of a Trace instance with these integer
+# thresholds.  Module level names are cheaper to look up than Level class attributes,
+# which matters because disabled trace should cost about one comparison.
+_NoneLevel = Level.NONE
+_SevereLevel = Level.SEVERE
+_WarnLevel = Level.WARN
+_InfoLevel = Level.INFO
+_ConfigLevel = Level.CONFIG
+_FineLevel = Level.FINE
+_FinerLevel = Level.FINER
+_FinestLevel = Level.FINEST
+_IntType = type(0)
+_StrType = type("")
+_UnicodeType = type(u"")
+
+# Multipliers of the unit suffixes of the trace options that are a number of bytes
+# and of those that are a number of seconds.
+SizeUnits = {'k': 1024, 'm': 1024*1024, 'g': 1024*1024*1024}
+TimeUnits = {'s': 1, 'm': 60, 'h': 3600}
+
 
 ##################################################################################################
 #
@@ -629,6 +861,37 @@ class TraceSpecification:
 #endClass
 
 
+##################################################################################################
+#
+# RateLimitSpecification class
+#
+class RateLimitSpecification(TraceSpecification):
+  """
+    RateLimitSpecification is an entity pattern and the rate limit, in seconds, of the 
+    trace records of the entities that match it.  See the trace option @ratelimit.
+  """
+
+  def __init__(self,pattern,interval):
+    if (not pattern):
+      raise TraceSpecificationException("A rate limit specification must have an entity pattern.")
+    #endIf
+    self.pattern = pattern
+    self.interval = interval
+    self.patternRegex = self._patternToRegEx(pattern)
+    self.compiledRegex = re.compile(self.patternRegex)
+  #endDef
+
+
+  def __str__(self):
+    return '<RateLimitSpecification pattern="%s" interval="%s"/>' % (self.pattern,self.interval)
+  #endDef
+
+
+  def __repr__(self):
+    return '<RateLimitSpecification patternRegex="%s" interval="%s"/>' % (self.patternRegex,self.interval)
+  #endDef
+#endClass
+
 ##################################################################################################
 #
 # Trace class
@@ -695,6 +958,23 @@ class Trace:
   traceFile = None
 
   traceFileLock = Lock()
+
+  # The path of the trace log file, the number of bytes in it and the time it was 
+  # opened.  Used for the rotation of the trace log file.
+  traceFilePath = None
+  traceFileSize = 0
+  traceFileOpened = 0
+
+  # Rotation of the trace log file.  See configureTraceOptions().
+  # rotateSize is a number of bytes and rotateInterval is a number of seconds, 
+  # either is 0 when the trace log file is not rotated for that reason.
+  rotateSize = 0
+  rotateInterval = 0
+  rotateKeep = 0
+  # The time stamp of the last rotated segment and the number of segments rotated
+  # before it with the same time stamp.
+  segmentStamp = None
+  segmentCount = 0
   
   traceNames = ['none', 'off', 'error', 'severe', 'warn', 'warning', 
                 'info', 'config', 'fine', 'finer', 'finest', 'debug', 'all']
@@ -725,27 +1005,121 @@ class Trace:
   FullPath = "FullPath"
   SourceFileStyle = NameOnly
   SourceFileStyles = [NameOnly, FullPath]
+
+  # The most frames in the exception stack and in the frame stack of an exception stack 
+  # dump.  None is all of the frames.  See the trace options @stackDepth and @frameDepth.
+  StackDepth = 10
+  FrameStackDepth = None
+
+  # An exception stack dump that is the same as one dumped less than stackDedupWindow 
+  # seconds before is collapsed to a line with the fingerprint of the stack, the time
+  # of the first dump and a repeat count.  0 turns this off.  stackFingerprints holds 
+  # the list [time of the first dump, repeat count] keyed by fingerprint.
+  # See the trace option @stackDedupWindow.
+  stackDedupWindow = 0
+  stackFingerprints = {}
+  stackFingerprintsLock = Lock()
+
+  # Event types of the trace that goes to stdout when there is a trace log file.
+  ConsoleEventTypes = ("S", "E", "W", "I")
+
+  # Event types of the trace that the asynchronous sink writes before the trace
+  # method returns.
+  UrgentEventTypes = ("S", "E")
+
+  # Event types of the trace that is never rate limited.
+  RateLimitExemptEventTypes = ("S", "E", "W")
+
+  # asyncWriter is the AsyncTraceWriter of the asynchronous trace sink, or None when
+  # trace records are written by the thread that emits them.
+  asyncWriter = None
+
+  # The trace options from the trace string.  See configureTraceOptions().
+  traceOptions = {}
+  TraceOptionNames = ['sink', 'sink.flushInterval', 'sink.flushSize', 'format',
+                      'rotate.size', 'rotate.interval', 'rotate.keep',
+                      'persist', 'ring.scope', 'ring.size', 'ring.bytes',
+                      'stackDepth', 'frameDepth', 'stackDedupWindow', 'ratelimit']
+  # The prefix of the trace options for the rate limit of the entities that match a pattern.
+  RateLimitOptionPrefix = "ratelimit."
+
+  # The rate limits of trace records by call site, most specific entity pattern first.  
+  # A list of RateLimitSpecification.  See configureTraceOptions() and _configureRateLimit().
+  rateLimitSpecs = []
+
+  # ringBuffer is the TraceRingBuffer of the trace records that are more verbose than 
+  # persistLevel, or None when all emitted trace records are written.
+  ringBuffer = None
+  persistLevel = Level.FINEST
+
+  # The format of the records in the trace log file, Text or JSON.
+  Text = "text"
+  JSON = "json"
+  TraceFormat = Text
+  TraceFormats = [Text, JSON]
+
+  # The level names of the event types in JSON trace records.
+  EventLevelNames = {'S': "SEVERE", 'E': "ERROR", 'W': "WARNING", 'I': "INFO", 'C': "CONFIG",
+                     '1': "FINE", '2': "FINER", '3': "FINEST", '>': "ENTRY", '<': "EXIT"}
+
+  # The event type of each trace level that a span may be traced at.
+  LevelEventTypes = {Level.WARN: 'W', Level.INFO: 'I', Level.CONFIG: 'C', Level.FINE: '1',
+                     Level.FINER: '2', Level.FINEST: '3'}
+
+  # The spans that have ended, each a tuple of the name, the entity name, the thread ID,
+  # the thread name, the begin time, the end time and the attributes of the span.  At most
+  # maxSpans spans are kept, spansDropped counts the ones that were not.  openSpans holds
+  # the spans that have started and not ended keyed by id().  See writeSpanTimeline().
+  spans = []
+  maxSpans = 100000
+  spansDropped = 0
+  openSpans = {}
+  # The functions called with each span and its duration in seconds when the span ends.
+  spanListeners = []
+
+  # The trace level of each event type.  Entry and exit are emitted at level fine.
+  EventLevels = {'S': Level.SEVERE, 'E': Level.ERROR, 'W': Level.WARNING, 'I': Level.INFO, 
+                 'C': Level.CONFIG, '1': Level.FINE, '2': Level.FINER, '3': Level.FINEST, 
+                 '>': Level.FINE, '<': Level.FINE}
+
+  # The context fields of JSON trace records already serialized as the "context" member
+  # of a JSON object, or the empty string when there are no context fields.
+  # See setTraceContext().
+  traceContext = {}
+  traceContextJSON = ""
+
+  # Method names as JSON strings keyed by method name.
+  methodNamesJSON = {}
+
+  # The time stamp up to the seconds, e.g., "[20/09/10 12:00:00.", only changes once
+  # a second so it is cached with the second (time.time() truncated) it was formatted 
+  # for.  The tuple is replaced as a whole so a thread never sees a second with the 
+  # prefix of another second.  The tuple also holds the ISO 8601 time stamp up to the
+  # seconds and the UTC offset, e.g., "2020-09-10T12:00:00." and "+00:00", for the JSON 
+  # trace format.
+  timeStampCache = (None, None, None, None)
+
+  # The thread ID tag in the trace string is the zero filled hex thread ID.
+  # threadTags caches the tag for each thread ID.
+  threadTags = {}
     
   def openTraceLog(self,logPath):
-    if (Trace.traceFile != None):
-      Trace.traceFile.close()
-    #endIf
-    Trace.traceFile = open(logPath,"w")
+    openTraceLog(logPath)
   #endDef
 
 
   def appendTraceLog(self,logPath):
-    if (Trace.traceFile != None):
-      Trace.traceFile.close()
-    #endIf
-    Trace.traceFile = open(logPath,"a")
+    appendTraceLog(logPath)
   #endDef
 
-  
+
   def closeTraceLog(self):
-    if (Trace.traceFile != None):
-      Trace.traceFile.close()
-    #endIf
+    closeTraceLog()
+  #endDef
+
+
+  def flushTraceLog(self):
+    flushTraceLog()
   #endDef
 
 
@@ -794,6 +1168,41 @@ class Trace:
   #endDef
   
   
+  def _writeSuppressedCounts(self):
+    """
+      Write a record with the count of the suppressed records from each call site
+      that has suppressed records since its last record was written.  The record
+      repeats the last message written from the call site.
+    """
+    for site,entry in list(self.rateLimitSites.items()):
+      if (entry[2]):
+        methodName,lineNumber = site
+        # An expired entry makes _log() write the message with the suppressed count.
+        entry[1] = 0
+        self._log(methodName,entry[3],entry[0],lineNumber=lineNumber)
+      #endIf
+    #endFor
+  #endDef
+
+
+  def _configureRateLimit(self):
+    """
+      Set the rate limit of this instance of the Trace class from the first rate limit
+      specification with an entity pattern that matches the entity name, or to 0 if 
+      there is none.
+    """
+    rateLimit = 0
+    for spec in Trace.rateLimitSpecs:
+      if (spec.compiledRegex.match(self.entityName)):
+        rateLimit = spec.interval
+        break
+      #endIf
+    #endFor
+    self.rateLimitSites = {}
+    self.rateLimit = rateLimit
+  #endDef
+
+
   def configureThisTrace(self):
     """
       Set the trace level for this instance of the trace class based on the Trace class traceSpec.
@@ -832,6 +1241,16 @@ class Trace:
     # Register this trace instance
     Trace.tracedEntities[entity] = self
     self.entityName = entity
+    # The entity name as a JSON string for the JSON trace format
+    self.entityJSON = _jsonString(entity)
+    # The rate limit in seconds of the trace records of a call site, 0 for no limit.
+    # rateLimitSites holds a list [message, time, suppressed count, event type] of the 
+    # last record written from each call site keyed by (method name, line number).
+    self.rateLimit = 0
+    self.rateLimitSites = {}
+    if (Trace.rateLimitSpecs):
+      self._configureRateLimit()
+    #endIf
 
     # If the traceSpec has been set, check the traceSpec and configure this trace instance
     # trace level based on the traceSpec if there is a match on this Trace instance entity name.
@@ -869,7 +1288,7 @@ class Trace:
   # Trace.error() and Trace.severe() are the only two Trace methods that provide
   # a stack trace.
   # 
-  def _exceptionStackTTB(self,methodName,exc,depth=10):
+  def _exceptionStackTTB(self,methodName,exc,depth=None):
     """
       Return a string useable for output to stdout or a log file that provides a representation
       of the "exception stack" and the "frame stack" from "top to bottm" (TTB).
@@ -883,72 +1302,57 @@ class Trace:
       There is another method named _exceptionStackBTT() that can be used to create a string that
       represents the execution stack from bottom to top, which is the style that Jython/Python
       uses by default.
+
+      depth is the most frames in the exception stack, Trace.StackDepth when it is None.
     """
-    stack = ""
+    if (depth == None):
+      depth = Trace.StackDepth
+    #endIf
+    tb = sys.exc_info()[2]
+    
     # Reconstruct the call stack from where the trace of the exception was initiated by invoking 
     # Trace.error() or Trace.severe().
-    stackList = traceback.extract_stack()
     try:
-      for stackData in stackList:
-        sourcefile,line,function,text = stackData
-        if (sourcefile.endswith("Trace.py") and (function == "error" or function == "severe")): break
-        sepIndex = sourcefile.rfind(os.sep)
-        if (sepIndex >=0 and Trace.SourceFileStyle == Trace.NameOnly):
-          sourcefile = sourcefile[sepIndex+1:]
-        #endIf
-        if (text == None):
-          if (not stack):
-            # Leave out the newline for the bottom line on the stack
-            stack = "\t%s(%s) [%s]" % (sourcefile,line,function)
-          else:
-            stack = "\t%s(%s) [%s]\n%s" % (sourcefile,line,function,stack)
-          #endIf
-        else:
-          if (not stack):
-            # Leave out the newline for the bottom line on the stack
-            stack = "\t%s(%s) [%s] - %s" % (sourcefile,line,function,text)
-          else:
-            stack = "\t%s(%s) [%s] - %s\n%s" % (sourcefile,line,function,text,stack)
-          #endIf
-        #endIf
-      #endFor
-      stack = "\tFrame stack (most recent call first):\n%s" % stack
+      frameStackList = self._frameStackList(Trace.FrameStackDepth)
+      frameLines = self._stackLines(frameStackList)
+      frameLines.append("\tFrame stack (most recent call first):")
+      frameLines.reverse()
     except:
       # This shouldn't happen, but in case it does...
       exc_type,exc_value = sys.exc_info()[:2]
-      stack = "\tException getting frame stack. Type: %s, Value: %s\n%s" % (exc_type,exc_value,stack)
+      frameStackList = []
+      frameLines = ["\tException getting frame stack. Type: %s, Value: %s" % (exc_type,exc_value)]
     #endTry
 
     try:
-      tb = sys.exc_info()[2]
-      stackList = traceback.extract_tb(tb,depth)
-      for stackData in stackList:
-        sourcefile,line,function,text = stackData
-        sepIndex = sourcefile.rfind(os.sep)
-        if (sepIndex >=0 and Trace.SourceFileStyle == Trace.NameOnly):
-          sourcefile = sourcefile[sepIndex+1:]
-        #endIf
-        if (text == None):
-          stack = "\t%s(%s) [%s]\n%s" % (sourcefile,line,function,stack)
-        else:
-          stack = "\t%s(%s) [%s] - %s\n%s" % (sourcefile,line,function,text,stack)
-        #endIf
-      #endFor
-      stack = "\tException stack (most recent call first):\n%s" % stack
+      exceptionStackList = traceback.extract_tb(tb,depth)
+      exceptionLines = self._stackLines(exceptionStackList)
+      exceptionLines.append("\tException stack (most recent call first):")
+      exceptionLines.reverse()
     except:
       # This shouldn't happen, but in case it does...
       exc_type,exc_value = sys.exc_info()[:2]
-      stack = "\tException getting exception stack. Type: %s, Value: %s\n%s" % (exc_type,exc_value,stack)
+      exceptionStackList = []
+      exceptionLines = ["\tException getting exception stack. Type: %s, Value: %s" % (exc_type,exc_value)]
     #endTry
-    
+
     # At the very top - put the exception string
-    stack = "\t%s\n%s" % (exc,stack)
-    
-    return stack	
+    lines = ["\t%s" % exc]
+    if (Trace.stackDedupWindow):
+      fingerprint = self._stackFingerprint(exc,exceptionStackList,frameStackList)
+      repeat = _stackRepeat(fingerprint)
+      if (repeat):
+        return "%s\n%s" % (lines[0],repeat)
+      #endIf
+      lines.append("\tStack fingerprint: %s" % fingerprint)
+    #endIf
+    lines.extend(exceptionLines)
+    lines.extend(frameLines)
+    return "\n".join(lines)
   #endDef
 
   
-  def _exceptionStackBTT(self,methodName,exc,depth=10):
+  def _exceptionStackBTT(self,methodName,exc,depth=None):
     """
       Return a string useable for output to stdout or a log file that provides a representation
       of the "exception stack" and the "frame stack" from "bottom to top" (BTT).
@@ -961,58 +1365,108 @@ class Trace:
       
       There is another method named _exceptionStackTTB() that can be used to create a string that
       represents the execution stack from top to bottom, which is the style that Java uses.
+
+      depth is the most frames in the exception stack, Trace.StackDepth when it is None.
     """
-    stack = ""
+    if (depth == None):
+      depth = Trace.StackDepth
+    #endIf
+    tb = sys.exc_info()[2]
+
     # Reconstruct the call stack from where the trace of the exception was initiated by invoking 
     # Trace.error() or Trace.severe().
-    stackList = traceback.extract_stack()
+    lines = ["\tFrame stack (most recent call last):"]
     try:
-      stack = "\tFrame stack (most recent call last):\n"
-      for stackData in stackList:
-        sourcefile,line,function,text = stackData
-        if (sourcefile.endswith("Trace.py") and (function == "error" or function == "severe")): break
-        sepIndex = sourcefile.rfind(os.sep)
-        if (sepIndex >=0 and Trace.SourceFileStyle == Trace.NameOnly):
-          sourcefile = sourcefile[sepIndex+1:]
-        #endIf
-        if (text == None):
-          stack = "%s\t%s(%s) [%s]\n" % (stack,sourcefile,line,function)
-        else:
-          stack = "%s\t%s(%s) [%s] - %s\n" % (stack,sourcefile,line,function,text)
-        #endIf
-      #endFor
+      frameStackList = self._frameStackList(Trace.FrameStackDepth)
+      lines.extend(self._stackLines(frameStackList))
     except:
       # This shouldn't happen, but in case it does...
       exc_type,exc_value = sys.exc_info()[:2]
-      stack = "%s\n\tException getting frame stack. Type: %s, Value: %s" % (stack,exc_type,exc_value)
+      frameStackList = []
+      lines.append("\tException getting frame stack. Type: %s, Value: %s" % (exc_type,exc_value))
     #endTry
     
+    lines.append("\tException stack (most recent call last):")
     try:
-      stack = "%s\tException stack (most recent call last):\n" % stack
-      tb = sys.exc_info()[2]
-      stackList = traceback.extract_tb(tb,depth)
-      for stackData in stackList:
-        sourcefile,line,function,text = stackData
-        sepIndex = sourcefile.rfind(os.sep)
-        if (sepIndex >=0 and Trace.SourceFileStyle == Trace.NameOnly):
-          sourcefile = sourcefile[sepIndex+1:]
-        #endIf
-        if (text == None):
-          stack = "%s\t%s(%s) [%s]\n" % (stack,sourcefile,line,function)
-        else:        
-          stack = "%s\t%s(%s) [%s] - %s\n" % (stack,sourcefile,line,function,text)
-        #endIf
-      #endFor
+      exceptionStackList = traceback.extract_tb(tb,depth)
+      lines.extend(self._stackLines(exceptionStackList))
     except:
       # This shouldn't happen, but in case it does...
       exc_type,exc_value = sys.exc_info()[:2]
-      stack = "%s\tException getting exception stack. Type: %s, Value: %s\n" % (stack,exc_type,exc_value)
+      exceptionStackList = []
+      lines.append("\tException getting exception stack. Type: %s, Value: %s" % (exc_type,exc_value))
     #endTry
 
+    if (Trace.stackDedupWindow):
+      fingerprint = self._stackFingerprint(exc,exceptionStackList,frameStackList)
+      repeat = _stackRepeat(fingerprint)
+      if (repeat):
+        return "%s\n\t%s" % (repeat,exc)
+      #endIf
+      lines.append("\tStack fingerprint: %s" % fingerprint)
+    #endIf
+
     # At the very end - put the exception string
-    stack = "%s\t%s" % (stack,exc)
-    
-    return stack  
+    lines.append("\t%s" % exc)
+    return "\n".join(lines)
+  #endDef
+
+
+  def _frameStackList(self,depth=None):
+    """
+      Return the list of (source file, line number, function, text) tuples, as returned
+      by traceback.extract_stack(), of the frames from main to the caller of Trace.error() 
+      or Trace.severe().  When depth is not None only the depth most recent frames are
+      returned.
+    """
+    frame = sys._getframe(1)
+    while (frame != None):
+      code = frame.f_code
+      if (code.co_filename.endswith("Trace.py") and (code.co_name == "error" or code.co_name == "severe")):
+        frame = frame.f_back
+        break
+      #endIf
+      frame = frame.f_back
+    #endWhile
+    if (frame == None):
+      # Not called from error() or severe(), e.g., directly from a test.
+      frame = sys._getframe(1)
+    #endIf
+    return traceback.extract_stack(frame,depth)
+  #endDef
+
+
+  def _stackLines(self,stackList):
+    """
+      Return a list with a line for each (source file, line number, function, text) tuple
+      in the given list, in the same order.  
+    """
+    lines = []
+    nameOnly = Trace.SourceFileStyle == Trace.NameOnly
+    for sourcefile,line,function,text in stackList:
+      if (nameOnly):
+        sourcefile = sourcefile[sourcefile.rfind(os.sep)+1:]
+      #endIf
+      if (text == None):
+        lines.append("\t%s(%s) [%s]" % (sourcefile,line,function))
+      else:
+        lines.append("\t%s(%s) [%s] - %s" % (sourcefile,line,function,text))
+      #endIf
+    #endFor
+    return lines
+  #endDef
+
+
+  def _stackFingerprint(self,exc,exceptionStackList,frameStackList):
+    """
+      Return the fingerprint of an exception stack dump, a hex string of the hash of the
+      exception class and the source file, line number and function of each frame of the
+      exception stack and the frame stack.  The exception message is not part of the 
+      fingerprint so the same failure with a different message has the same fingerprint.
+    """
+    frames = tuple([(sourcefile,line,function) for sourcefile,line,function,text in exceptionStackList] +
+                   [(sourcefile,line,function) for sourcefile,line,function,text in frameStackList])
+    return "%08x" % (hash((exc.__class__.__name__,frames)) & 0xffffffff)
   #endDef
 
   
@@ -1022,6 +1476,8 @@ class Trace:
   # If exc is not None, then the exception message and stack is included in the trace 
   # message.
   #
+  # If args is not empty, then msg is a format and the message is msg % args.
+  #
   # If a log file has been configured, then all trace goes to the log file.  Any trace 
   # with eventType Info or "lower" also goes to stdout.
   #
@@ -1038,7 +1494,7 @@ class Trace:
   # another thread may jump in to do output.  John Martinek discovered this issue
   # when working with some multi-threaded Jython scripts.
   #
-  def _log(self,methodName,eventType,msg,exc=None):
+  def _log(self,methodName,eventType,msg,exc=None,args=None,depth=2,lineNumber=None):
     """
       Emit the trace message to stdout and optionally to a trace file when a trace file 
       has been defined.
@@ -1046,14 +1502,77 @@ class Trace:
       All public Trace methods that emit trace messages go through _log() to actually 
       emit the trace in order to correctly unwind the call stack as well as to emit trace 
       in a thread safe manor.
+
+      depth is the number of frames back to the frame of the source line of the record.
+      lineNumber, when given, is the source line of the record instead.
     """    
     stackDump = None
-    threadId = ("%x" % thread.get_ident()).rjust(12).replace(" ","0")
-    traceString = "%s %s %s %s" % (self._getTimeStamp(),threadId,eventType,self.entityName)
-    traceString = "%s(%s) %s" % (traceString,self._sourceLineNumber(),methodName)
+    now = time.time()
+    second = int(now)
+    timeStampCache = Trace.timeStampCache
+    if (timeStampCache[0] != second):
+      timeStampCache = self._cacheTimeStamp(second)
+    #endIf
+
+    threadId = thread.get_ident()
+    threadTag = Trace.threadTags.get(threadId)
+    if (threadTag == None):
+      threadTag = "%012x" % threadId
+      Trace.threadTags[threadId] = threadTag
+    #endIf
+
+    # The frame of the caller of the trace method is 2 frames back: _log(), the trace method, the caller.
+    if (lineNumber == None):
+      lineNumber = sys._getframe(depth).f_lineno
+    #endIf
+
+    if (self.rateLimit and eventType not in Trace.RateLimitExemptEventTypes):
+      # Threads that trace from the same call site at the same time may race on its
+      # entry, which at worst writes an extra record or miscounts the suppressed ones.
+      # The message is compared with the previous one of the site, so it is formatted now.
+      if (args):
+        msg = _formatMessage(msg,args)
+        args = None
+      #endIf
+      site = (methodName,lineNumber)
+      entry = self.rateLimitSites.get(site)
+      if (entry == None):
+        self.rateLimitSites[site] = [msg,now,0,eventType]
+      elif (entry[0] == msg and now - entry[1] < self.rateLimit):
+        entry[2] += 1
+        return
+      else:
+        suppressed = entry[2]
+        entry[0] = msg
+        entry[1] = now
+        entry[2] = 0
+        entry[3] = eventType
+        if (suppressed):
+          msg = "%s (suppressed %d similar records)" % (msg,suppressed)
+        #endIf
+      #endIf
+    #endIf
+
+    ringBuffer = Trace.ringBuffer
+    if (ringBuffer != None and Trace.EventLevels[eventType] > Trace.persistLevel):
+      # The record is not persisted, keep it in the ring buffer with its arguments.
+      # The message is formatted only if it is written ahead of an error.
+      if (type(msg) is not _StrType and type(msg) is not _UnicodeType):
+        msg = "%s" % msg
+      #endIf
+      ringBuffer.add((self,now,threadTag,eventType,lineNumber,methodName,msg,args))
+      return
+    #endIf
+
+    if (args):
+      msg = _formatMessage(msg,args)
+    #endIf
+
+    microseconds = int((now - second) * 1000000)
     
     if (exc):
-      # Get stack dump now to keep it with msg text
+      # Get stack dump now to keep it with msg text.  It is collapsed to a reference to
+      # the first dump when the same stack has been dumped within Trace.stackDedupWindow.
       if (Trace.StackTraceStyle == Trace.TopToBottom):
         stackDump = self._exceptionStackTTB(methodName,exc)
       elif (Trace.StackTraceStyle == Trace.BottomToTop):
@@ -1063,42 +1582,136 @@ class Trace:
       #endIf
     #endIf
     
+    fileRecord,consoleRecord = self._formatRecords(timeStampCache,microseconds,threadTag,eventType,
+                                                   lineNumber,methodName,msg,exc,stackDump)
+
+    if (ringBuffer != None and eventType in Trace.UrgentEventTypes):
+      # Write the buffered records ahead of the error in the same write.
+      fileRecords,consoleRecords = _formatBufferedRecords(ringBuffer.take())
+      if (fileRecord != None and fileRecords):
+        fileRecords.append(fileRecord)
+        fileRecord = "\n".join(fileRecords)
+      #endIf
+      if (consoleRecord != None and consoleRecords):
+        consoleRecords.append(consoleRecord)
+        consoleRecord = "\n".join(consoleRecords)
+      #endIf
+    #endIf
+
+    asyncWriter = Trace.asyncWriter
+    if (asyncWriter and asyncWriter.put(fileRecord,consoleRecord,eventType in Trace.UrgentEventTypes)):
+      return
+    #endIf
+
     # If a logFile was provided then send all trace to trace log
-    if (Trace.traceFile):
+    if (fileRecord != None):
       # file IO is not thread safe
       # The Jython 2.1 that comes with WAS doesn't support the "with" statement.
       try:
         Trace.traceFileLock.acquire()
-        if (stackDump):
-          Trace.traceFile.write("%s : %s\n%s\n" % (traceString, msg, stackDump))
-        else:
-          Trace.traceFile.write("%s : %s\n" % (traceString, msg))
+        # The trace file may have been closed since it was checked above.
+        if (Trace.traceFile):
+          _writeTraceFile(fileRecord + "\n")
         #endIf
-        Trace.traceFile.flush()
       finally:
         Trace.traceFileLock.release()
       #endTry
     #endIf
-    
-    if (not Trace.traceFile or eventType in ["S", "E", "W", "I"]):
+
+    if (consoleRecord != None):
       # Send severe, error, warning and info trace to stdout
+      print consoleRecord
+    #endIf
+  #endDef
+
+
+  def _formatRecords(self,timeStampCache,microseconds,threadTag,eventType,lineNumber,methodName,msg,exc,stackDump):
+    """
+      Return the tuple (fileRecord, consoleRecord) of the trace record for the trace log 
+      file and for stdout.  Either is None when the record doesn't go there.
+    """
+    toFile = Trace.traceFile != None
+    toConsole = not toFile or eventType in Trace.ConsoleEventTypes
+    jsonFormat = toFile and Trace.TraceFormat == Trace.JSON
+
+    # record is the text format trace record
+    record = None
+    if (toConsole or not jsonFormat):
+      record = "%s%06d %s] %s %s %s(%d) %s : %s" % (timeStampCache[1],microseconds,TimeZoneName,
+                                                    threadTag,eventType,self.entityName,lineNumber,
+                                                    methodName,msg)
       if (stackDump):
-        print "%s : %s\n%s" % (traceString, msg, stackDump)
-      else:
-        print "%s : %s" % (traceString, msg)
+        record = "%s\n%s" % (record,stackDump)
       #endIf
     #endIf
+
+    fileRecord = None
+    if (jsonFormat):
+      fileRecord = self._jsonRecord(timeStampCache,microseconds,threadTag,eventType,lineNumber,methodName,msg,exc,stackDump)
+    elif (toFile):
+      fileRecord = record
+    #endIf
+    consoleRecord = None
+    if (toConsole):
+      consoleRecord = record
+    #endIf
+    return (fileRecord,consoleRecord)
+  #endDef
+
+
+  def _jsonRecord(self,timeStampCache,microseconds,threadTag,eventType,lineNumber,methodName,msg,exc,stackDump):
+    """
+      Return the JSON format trace record.  The members are written in a fixed order
+      with the timestamp first.  Only the members that may hold arbitrary text are 
+      serialized with the JSON library.
+    """
+    methodJSON = Trace.methodNamesJSON.get(methodName)
+    if (methodJSON == None):
+      methodJSON = _jsonString(methodName)
+      Trace.methodNamesJSON[methodName] = methodJSON
+    #endIf
+    try:
+      messageJSON = _jsonEncodeString(msg)
+    except:
+      # msg is not a string or not UTF-8
+      messageJSON = _jsonString(msg)
+    #endTry
+    exception = ""
+    if (exc):
+      exception = ',"exception":{"type":%s,"message":%s,"stack":%s}' % (_jsonString(exc.__class__.__name__),
+                                                                         _jsonString(exc),_jsonString(stackDump))
+    #endIf
+    return '{"timestamp":"%s%06d%s","thread":"%s","level":"%s","entity":%s,"line":%d,"method":%s,"message":%s%s%s}' % \
+           (timeStampCache[2],microseconds,timeStampCache[3],threadTag,Trace.EventLevelNames.get(eventType,eventType),
+            self.entityJSON,lineNumber,methodJSON,messageJSON,exception,Trace.traceContextJSON)
   #endDef
   
   
+  def span(self,methodName=None,name=None,level=Level.FINE,**attributes):
+    """
+      Return a Span for a step of the given method with the given name and attributes.
+      The elapsed time of the step is traced at the given level when the span ends.
+      The span is used as a context manager:
+        with TR.span(methodName,"Installing OCP",level=Level.INFO) as span:
+          ...
+          span.set(workers=3)
+      or as a decorator, in which case the method name and name default to the name 
+      of the decorated function:
+        @TR.span()
+        def installOperator(self,icpdInstallLogFile):
+    """
+    return Span(self,methodName,name,level,attributes)
+  #endDef
+
+
   def isLoggable(self,level):
+    # Fast path for the integer constants defined by the Level class
+    if (type(level) is _IntType and level >= _NoneLevel and level <= _FinestLevel):
+      return level <= self.traceLevel
+    #endIf
     if (type(level) == type(0)):
-      if (self._isTraceLevel(level)):
-        result = level <= self.traceLevel
-      else:
-        # level is a number but not in the range of a trace level.
-        raise TraceLevelException("Invalid trace level: %s  Valid trace levels range from 0 (none) to 7 (finest)" % level)
-      #endIf
+      # level is a number but not in the range of a trace level.
+      raise TraceLevelException("Invalid trace level: %s  Valid trace levels range from 0 (none) to 7 (finest)" % level)
     elif (type(level) == type("") or type(level) == type(u"")):
       level = self._coerceLevel(level)
       result = level <= self.traceLevel
@@ -1111,24 +1724,28 @@ class Trace:
 
 
   def entering(self,methodName):
-    if (self.traceLevel >= Level.FINE):
+    if (self.traceLevel >= _FineLevel):
       self._log(methodName,">","Entry")
     #endIf
   #endDef
 
   
   def exiting(self,methodName):
-    if (self.traceLevel >= Level.FINE):
+    if (self.traceLevel >= _FineLevel):
       self._log(methodName,"<","Exit")
     #endIf
   #endDef
 
 
+  # The trace methods take the message or a format followed by its arguments.
+  # The message is formatted, msg % args, by _log() only if the trace is emitted.
+
   # severe() emits as long as trace is on
   # The event type is "S" for severe.
-  def severe(self,methodName,msg,exc=None):
-    if (self.traceLevel > Level.NONE):
-      self._log(methodName,"S",msg,exc)
+  # The format arguments follow the exc argument, which may be None.
+  def severe(self,methodName,msg,exc=None,*args):
+    if (self.traceLevel > _NoneLevel):
+      self._log(methodName,"S",msg,exc,args)
     #endIf
   #endDef
 
@@ -1136,67 +1753,67 @@ class Trace:
   # Synonym for severe() for backward compatibility with 
   # original Trace class.
   # The event type for error is "E".
-  def error(self,methodName,msg,exc=None):
-    if (self.traceLevel > Level.NONE):
-      self._log(methodName,"E",msg,exc)
+  def error(self,methodName,msg,exc=None,*args):
+    if (self.traceLevel > _NoneLevel):
+      self._log(methodName,"E",msg,exc,args)
     #endIf
   #endDef
 
   
-  def warn(self,methodName,msg):
-    if (self.traceLevel > Level.SEVERE):
-      self._log(methodName,"W",msg)
+  def warn(self,methodName,msg,*args):
+    if (self.traceLevel > _SevereLevel):
+      self._log(methodName,"W",msg,None,args)
     #endIf
   #endDef
 
 
   # Synonym for warn() to conform to Java Logger
-  def warning(self,methodName,msg):
-    if (self.traceLevel > Level.SEVERE):
-      self._log(methodName,"W",msg)
+  def warning(self,methodName,msg,*args):
+    if (self.traceLevel > _SevereLevel):
+      self._log(methodName,"W",msg,None,args)
     #endIf
   #endDef
 
     
-  def info(self,methodName,msg):    
-    if (self.traceLevel > Level.WARN):
-      self._log(methodName,"I",msg)
+  def info(self,methodName,msg,*args):    
+    if (self.traceLevel > _WarnLevel):
+      self._log(methodName,"I",msg,None,args)
     #endIf
   #endDef
 
 
-  def config(self,methodName,msg):
-    if (self.traceLevel > Level.INFO):
-      self._log(methodName,"C",msg)
+  def config(self,methodName,msg,*args):
+    if (self.traceLevel > _InfoLevel):
+      self._log(methodName,"C",msg,None,args)
     #endIf
   #endDef
 
   
-  def fine(self,methodName,msg):
-    if (self.traceLevel > Level.CONFIG):
-      self._log(methodName,"1",msg)
+  def fine(self,methodName,msg,*args):
+    if (self.traceLevel > _ConfigLevel):
+      self._log(methodName,"1",msg,None,args)
     #endIf
   #endDef
 
   
-  def finer(self,methodName,msg):
-    if (self.traceLevel > Level.FINE):
-      self._log(methodName,"2",msg)
+  def finer(self,methodName,msg,*args):
+    if (self.traceLevel > _FineLevel):
+      self._log(methodName,"2",msg,None,args)
     #endIf
   #endDef
 
   
-  def finest(self,methodName,msg):
-    if (self.traceLevel > Level.FINER):
-      self._log(methodName,"3",msg)
+  def finest(self,methodName,msg,*args):
+    if (self.traceLevel > _FinerLevel):
+      self._log(methodName,"3",msg,None,args)
     #endIf
   #endDef
 
 
   # debug() is a synonym for finest() to conform to Java Logger.
-  def debug(self,methodName,msg):
-    if (self.traceLevel > Level.FINER):
-      self._log(methodName,"3",msg)
+  def debug(self,methodName,msg,*args):
+    if (self.traceLevel > _FinerLevel):
+      self._log(methodName,"3",msg,None,args)
     #endIf
   #endDef
   
@@ -1232,9 +1849,25 @@ class Trace:
   #endDef
   
     
+  def _cacheTimeStamp(self,second):
+    """
+      Format the time stamp prefix for the given second (a time.time() value truncated 
+      to an integer), cache it in Trace.timeStampCache and return the cache entry.
+    """
+    timeStampCache = _formatTimeStamp(second)
+    Trace.timeStampCache = timeStampCache
+    return timeStampCache
+  #endDef
+
+
   def _getTimeStamp(self):
-    now = datetime.datetime.now()
-    return "[%s %s]" % (now.strftime("%y/%m/%d %H:%M:%S.%f"),TimeZoneName)
+    now = time.time()
+    second = int(now)
+    timeStampCache = Trace.timeStampCache
+    if (timeStampCache[0] != second):
+      timeStampCache = self._cacheTimeStamp(second)
+    #endIf
+    return "%s%06d %s]" % (timeStampCache[1],int((now - second) * 1000000),TimeZoneName)
   #endDef
   
   # The stack frame has a method that returns the line number
@@ -1244,16 +1877,14 @@ class Trace:
   # calls _sourceLineNumber() so to get back to the source frame
   # you have to walk 4 frames back.
   #
+  # NOTE: _log() no longer uses _sourceFrame().  It gets the source frame 
+  # directly with sys._getframe(2).
+  #
   def _sourceFrame(self):
     """
       Return the frame object for the caller's stack frame.
     """
-    try:
-        raise Exception('catch me')  # forced exception to get stack traceback
-    except:
-        exc_traceback = sys.exc_info()[2]
-        return exc_traceback.tb_frame.f_back.f_back.f_back.f_back
-    #endTry
+    return sys._getframe(4)
   #endDef
   
   def _sourceLineNumber(self):
@@ -1274,58 +1905,935 @@ class Trace:
 #endClass
 
 ##################################################################################################
-# Module Methods
-
-def openTraceLog(logPath):
-  if (Trace.traceFile != None):
-    Trace.traceFile.close()
-  #endIf
-  Trace.traceFile = open(logPath,"w")
-#endDef
-
-def appendTraceLog(logPath):
-  if (Trace.traceFile != None):
-    Trace.traceFile.close()
-  #endIf
-  Trace.traceFile = open(logPath,"a")
-#endDef
-
+#
+# AsyncTraceWriter class
+#
+# The asynchronous trace sink.  Trace._log() puts each formatted trace record in the
+# queue of the AsyncTraceWriter and a writer thread takes all of the queued records
+# at once and writes them to the trace log file with one write and one flush.  The
+# records that go to stdout are written with one write as well.
+#
+# The writer thread writes the queued records about every flushInterval seconds, or
+# sooner when the queued records reach flushSize bytes.  An urgent record (error or
+# severe) is not queued.  The thread that emits it takes the queued records and writes
+# them followed by the urgent record before the trace method returns, so the record 
+# is not lost if the process dies on the path that emitted it.  flush() writes the
+# queued records on the calling thread the same way.  The writeLock is held from 
+# taking records off the queue until they are written, so records are always written
+# in the order they were queued.
+#
+# A thread that puts a record when the queued records reach maxPending bytes waits 
+# until the writer thread has taken them, so the queue stays bounded when trace is
+# emitted faster than it can be written.
+#
+# NOTE: The condition is built on a Lock rather than the default RLock, which is 
+# much slower in Python 2.  The records are put while holding it.  Timed waits on
+# a condition poll in Python 2, which is why no thread that emits trace ever waits 
+# for the writer thread with a timeout.
+#
+class AsyncTraceWriter:
+  """
+    AsyncTraceWriter writes queued trace records in batches on a background thread.
+  """
 
-def closeTraceLog():
-  if (Trace.traceFile != None):
-    Trace.traceFile.close()
-  #endIf
-#endDef
+  def __init__(self,flushInterval=1.0,flushSize=65536,maxPending=8*1024*1024):
+    """
+      flushInterval - the most seconds between writes of the queued records
+      flushSize     - the size in bytes of the queued records that causes them to be written
+      maxPending    - the size in bytes of the queued records at which threads that put
+                      records wait for the writer thread
+    """
+    self.flushInterval = flushInterval
+    self.flushSize = flushSize
+    self.maxPending = maxPending
+
+    # Each queued record is a tuple (fileRecord, consoleRecord).  Either may be None.
+    self.records = []
+    self.pendingBytes = 0
+    self.flushRequested = False
+    self.stopped = False
+    self.condition = Condition(Lock())
+    self.writeLock = Lock()
+
+    self.thread = Thread(target=self._run,name="AsyncTraceWriter")
+    self.thread.setDaemon(True)
+    self.thread.start()
+  #endDef
 
 
-def parseTraceString(traceString):
-  """
-    Return a list of TraceSpecification instances that represent a parsing of the given trace string.
-    The returned list holds a TraceSpecifification instance for each trace specification in the given 
-    trace string.
-  """
-  result = []
-  # If the given traceString is enclosed in double-quotes,
-  # then strip the double-quotes.
-  if (traceString[0] == '"' and traceString[-1] == '"'):
-    traceString = traceString[1:-1]
-  #endIf
-  traceStrings = traceString.split(":")
-  for trace in traceStrings:
-    traceParts = trace.split("=")
-    if (len(traceParts) != 2):
-      raise TraceSpecificationException("Encountered an invalid trace string: %s  A trace string looks like <module_pattern>=<level>." % trace)
+  def put(self,fileRecord,consoleRecord,urgent=False):
+    """
+      Queue the given trace record for the trace log file and the given trace record
+      for stdout.  Either may be None.  Return False if the writer has been stopped in 
+      which case the caller needs to write the records.  When urgent is true, the 
+      queued records and the given records are written before put() returns.
+    """
+    if (urgent):
+      self.writeLock.acquire()
+      try:
+        records = self._takeRecords()
+        if (records == None):
+          return False
+        #endIf
+        records.append((fileRecord,consoleRecord))
+        self._write(records)
+      finally:
+        self.writeLock.release()
+      #endTry
+      return True
     #endIf
-    
-    modulePattern = traceParts[0]
-    level = traceParts[1]
-    result.append(TraceSpecification(modulePattern,level))
-  #endFor
-  return result
-#endDef
 
+    self.condition.acquire()
+    try:
+      while (self.pendingBytes >= self.maxPending and not self.stopped):
+        self.condition.wait()
+      #endWhile
+      if (self.stopped):
+        return False
+      #endIf
+      self.records.append((fileRecord,consoleRecord))
+      self.pendingBytes += len(fileRecord or consoleRecord)
+      if (self.pendingBytes >= self.flushSize and not self.flushRequested):
+        self.flushRequested = True
+        self.condition.notifyAll()
+      #endIf
+    finally:
+      self.condition.release()
+    #endTry
+    return True
+  #endDef
 
-def setTraceSpec(traceString):
+
+  def _takeRecords(self):
+    """
+      Return the list of queued records and empty the queue, or None if the writer
+      has been stopped and there are no queued records.
+    """
+    self.condition.acquire()
+    try:
+      records = self.records
+      if (self.stopped and not records):
+        return None
+      #endIf
+      self.records = []
+      self.pendingBytes = 0
+      self.flushRequested = False
+      # Wake up threads waiting on a full queue.
+      self.condition.notifyAll()
+    finally:
+      self.condition.release()
+    #endTry
+    return records
+  #endDef
+
+
+  def flush(self):
+    """
+      Write the records queued so far.
+    """
+    self.writeLock.acquire()
+    try:
+      records = self._takeRecords()
+      if (records):
+        self._write(records)
+      #endIf
+    finally:
+      self.writeLock.release()
+    #endTry
+  #endDef
+
+
+  def stop(self):
+    """
+      Write the queued records and stop the writer thread.  Records put after the
+      writer has been stopped are written by the thread that emits them.
+    """
+    self.condition.acquire()
+    try:
+      self.stopped = True
+      self.condition.notifyAll()
+    finally:
+      self.condition.release()
+    #endTry
+    self.thread.join()
+    self.flush()
+  #endDef
+
+
+  def _run(self):
+    """
+      The writer thread loop: wait for a reason to write, then write the queued records.
+    """
+    while (True):
+      self.condition.acquire()
+      try:
+        if (not self.flushRequested and not self.stopped):
+          self.condition.wait(self.flushInterval)
+        #endIf
+        stopped = self.stopped
+      finally:
+        self.condition.release()
+      #endTry
+
+      if (stopped):
+        break
+      #endIf
+      self.flush()
+    #endWhile
+  #endDef
+
+
+  def _write(self,records):
+    """
+      Write the given records to the trace log file and stdout.  A failure to write is
+      reported on stderr and the writer carries on.
+    """
+    fileRecords = [fileRecord for fileRecord,consoleRecord in records if fileRecord != None]
+    consoleRecords = [consoleRecord for fileRecord,consoleRecord in records if consoleRecord != None]
+    try:
+      if (fileRecords):
+        try:
+          Trace.traceFileLock.acquire()
+          if (Trace.traceFile):
+            _writeTraceFile("%s\n" % "\n".join(fileRecords))
+          #endIf
+        finally:
+          Trace.traceFileLock.release()
+        #endTry
+      #endIf
+      if (consoleRecords):
+        sys.stdout.write("%s\n" % "\n".join(consoleRecords))
+        sys.stdout.flush()
+      #endIf
+    except:
+      exc_type,exc_value = sys.exc_info()[:2]
+      sys.stderr.write("AsyncTraceWriter failed to write %d trace records. Type: %s, Value: %s\n" % (len(records),exc_type,exc_value))
+    #endTry
+  #endDef
+#endClass
+
+##################################################################################################
+#
+# TraceRingBuffer class
+#
+# The ring buffer of the trace records that are more verbose than the persisted level.
+# Trace._log() adds the unformatted record, a tuple of the Trace instance, the time, 
+# the thread tag, the event type, the line number, the method name and the message.
+# When the ring buffer holds maxRecords records or maxBytes bytes of messages, the 
+# oldest records are dropped.  take() returns the buffered records and empties the 
+# ring buffer.
+#
+# With the thread scope each thread has its own ring buffer in a threading.local, 
+# which is only touched by that thread so it needs no lock, and goes away with the 
+# thread.  With the global scope all threads share one ring buffer under a lock.
+#
+class TraceRingBuffer:
+  """
+    TraceRingBuffer keeps the most recent trace records that are not persisted.
+  """
+  Thread = "thread"
+  Global = "global"
+  Scopes = [Thread, Global]
+
+  def __init__(self,scope=Thread,maxRecords=1000,maxBytes=1024*1024):
+    """
+      scope      - TraceRingBuffer.Thread for a ring buffer for each thread or 
+                   TraceRingBuffer.Global for one ring buffer for all threads
+      maxRecords - the most records in a ring buffer
+      maxBytes   - the most bytes of message formats in a ring buffer
+    """
+    if (scope not in TraceRingBuffer.Scopes):
+      raise TraceConfigurationException("'%s', is not a valid ring buffer scope. Expected one of %s" % (scope,TraceRingBuffer.Scopes))
+    #endIf
+    self.scope = scope
+    self.maxRecords = maxRecords
+    self.maxBytes = maxBytes
+    self.threadRings = local()
+    self.lock = Lock()
+    self.globalRing = [deque(),0]
+  #endDef
+
+
+  def _ring(self):
+    """
+      Return the ring buffer of the calling thread, a list of the deque of records 
+      and the number of bytes of their messages.
+    """
+    if (self.scope == TraceRingBuffer.Global):
+      return self.globalRing
+    #endIf
+    ring = getattr(self.threadRings,'ring',None)
+    if (ring == None):
+      ring = [deque(),0]
+      self.threadRings.ring = ring
+    #endIf
+    return ring
+  #endDef
+
+
+  def add(self,record):
+    """
+      Add the given record to the ring buffer and drop the oldest records beyond the limits.
+    """
+    ring = self._ring()
+    isGlobal = self.scope == TraceRingBuffer.Global
+    if (isGlobal):
+      self.lock.acquire()
+    #endIf
+    try:
+      records = ring[0]
+      records.append(record)
+      # The bytes of a record are those of its message format, its arguments are not counted.
+      ring[1] += len(record[6])
+      while (len(records) > self.maxRecords or (ring[1] > self.maxBytes and len(records) > 1)):
+        ring[1] -= len(records.popleft()[6])
+      #endWhile
+    finally:
+      if (isGlobal):
+        self.lock.release()
+      #endIf
+    #endTry
+  #endDef
+
+
+  def take(self):
+    """
+      Return the list of the buffered records, oldest first, and empty the ring buffer.
+    """
+    ring = self._ring()
+    self.lock.acquire()
+    try:
+      records = list(ring[0])
+      ring[0].clear()
+      ring[1] = 0
+    finally:
+      self.lock.release()
+    #endTry
+    return records
+  #endDef
+#endClass
+
+##################################################################################################
+#
+# Span class
+#
+# A Span times one step of a program.  start() records the begin time and the thread
+# and end() records the span in Trace.spans and traces the elapsed time of the step.
+# Spans nest: a span that starts and ends within another span on the same thread is
+# shown inside it on the timeline written by writeSpanTimeline().  A span started on 
+# a worker thread is shown on the track of that thread.
+#
+class Span:
+  """
+    Span records the duration and attributes of a step of a program.
+  """
+
+  def __init__(self,trace,methodName=None,name=None,level=Level.FINE,attributes=None):
+    """
+      trace      - the Trace instance of the module the step belongs to
+      methodName - the method name of the trace record of the elapsed time
+      name       - the name of the step, the method name when it is None
+      level      - the trace level of the trace record of the elapsed time
+      attributes - a dictionary of attributes of the step
+    """
+    if (level not in Trace.LevelEventTypes):
+      raise TraceLevelException("Invalid span trace level: %s  Spans are traced at level warn or a more verbose level." % level)
+    #endIf
+    self.trace = trace
+    self.methodName = methodName
+    self.name = name or methodName
+    self.level = level
+    self.attributes = attributes or {}
+    self.beginTime = None
+    self.threadId = None
+    self.threadName = None
+  #endDef
+
+
+  def set(self,**attributes):
+    """
+      Set the given attributes of the span, e.g., span.set(status="Ready").
+    """
+    self.attributes.update(attributes)
+  #endDef
+
+
+  def start(self):
+    """
+      Start the span and return it.
+    """
+    self.threadId = thread.get_ident()
+    self.threadName = currentThread().getName()
+    self.beginTime = time.time()
+    Trace.openSpans[id(self)] = self
+    return self
+  #endDef
+
+
+  def end(self,exc=None):
+    """
+      End the span.  When the step failed with the given exception, the span has the
+      attribute error.
+    """
+    self._end(exc,3)
+  #endDef
+
+
+  def _end(self,exc,depth):
+    """
+      End the span and trace the elapsed time with the source line of the frame that 
+      is depth frames back from _log().
+    """
+    endTime = time.time()
+    Trace.openSpans.pop(id(self),None)
+    failed = ""
+    if (exc != None):
+      self.attributes['error'] = "%s: %s" % (exc.__class__.__name__,exc)
+      failed = " (failed: %s)" % exc.__class__.__name__
+    #endIf
+    if (len(Trace.spans) < Trace.maxSpans):
+      Trace.spans.append((self.name,self.trace.entityName,self.threadId,self.threadName,
+                          self.beginTime,endTime,self.attributes))
+    else:
+      Trace.spansDropped += 1
+    #endIf
+    for listener in Trace.spanListeners:
+      try:
+        listener(self,endTime - self.beginTime)
+      except Exception:
+        exc_type,exc_value = sys.exc_info()[:2]
+        sys.stderr.write("Span listener failed for span: %s. Type: %s, Value: %s\n" % (self.name,exc_type,exc_value))
+      #endTry
+    #endFor
+
+    if (self.trace.traceLevel >= self.level):
+      elapsedTime = int(endTime - self.beginTime)
+      etm, ets = divmod(elapsedTime,60)
+      eth, etm = divmod(etm,60)
+      self.trace._log(self.methodName,Trace.LevelEventTypes[self.level],
+                      "Elapsed time (hh:mm:ss): %d:%02d:%02d for %s%s",None,(eth,etm,ets,self.name,failed),depth)
+    #endIf
+  #endDef
+
+
+  def __enter__(self):
+    return self.start()
+  #endDef
+
+
+  def __exit__(self,exc_type,exc_value,tb):
+    self._end(exc_value,3)
+    # An exception raised in the with statement is not suppressed.
+    return False
+  #endDef
+
+
+  def __call__(self,function):
+    """
+      Return the given function wrapped so that each call is timed by a new span 
+      with the name, level and attributes of this span.
+    """
+    methodName = self.methodName or function.__name__
+    name = self.name or function.__name__
+    def spanned(*args,**kwargs):
+      span = Span(self.trace,methodName,name,self.level,dict(self.attributes)).start()
+      try:
+        result = function(*args,**kwargs)
+      except:
+        exc_type,exc_value,tb = sys.exc_info()
+        span._end(exc_value,3)
+        raise exc_type,exc_value,tb
+      #endTry
+      span._end(None,3)
+      return result
+    #endDef
+    spanned.__name__ = function.__name__
+    spanned.__doc__ = function.__doc__
+    return spanned
+  #endDef
+#endClass
+
+##################################################################################################
+# Module Methods
+
+def writeSpanTimeline(path):
+  """
+    Write the spans recorded so far to the file with the given path in the Chrome trace 
+    event JSON format.  Each span is a complete ("X") event on the track of its thread
+    and each thread has a thread_name metadata ("M") event.  Spans that have not ended,
+    e.g., the span of the step that writes the timeline, end at the current time and 
+    have the attribute open.  Open the file with chrome://tracing or ui.perfetto.dev.
+  """
+  now = time.time()
+  spans = list(Trace.spans)
+  for span in Trace.openSpans.values():
+    attributes = dict(span.attributes)
+    attributes['open'] = True
+    spans.append((span.name,span.trace.entityName,span.threadId,span.threadName,span.beginTime,now,attributes))
+  #endFor
+
+  pid = os.getpid()
+  threadNames = {}
+  events = []
+  for name,entity,threadId,threadName,beginTime,endTime,attributes in spans:
+    threadNames[threadId] = threadName
+    args = {}
+    for key,value in attributes.items():
+      if (value != None and type(value) not in (type(""),type(u""),type(0),type(0L),type(0.0),type(True))):
+        value = "%s" % (value,)
+      #endIf
+      args[key] = value
+    #endFor
+    events.append({'name': name, 'cat': entity, 'ph': "X", 'pid': pid, 'tid': threadId,
+                   'ts': int(beginTime * 1000000), 'dur': int((endTime - beginTime) * 1000000), 'args': args})
+  #endFor
+  for threadId,threadName in threadNames.items():
+    events.append({'name': "thread_name", 'ph': "M", 'pid': pid, 'tid': threadId, 'args': {'name': threadName}})
+  #endFor
+
+  timelineFile = open(path,"w")
+  try:
+    timelineFile.write(_json.dumps({'traceEvents': events, 'displayTimeUnit': "ms",
+                                    'otherData': {'spansDropped': Trace.spansDropped}}))
+  finally:
+    timelineFile.close()
+  #endTry
+#endDef
+
+
+def addSpanListener(listener):
+  """
+    Call the given function with each span and its duration in seconds when the span
+    ends.  The listener is called on the thread that ends the span.  An exception
+    raised by the listener is reported on stderr.
+  """
+  if (listener not in Trace.spanListeners):
+    Trace.spanListeners.append(listener)
+  #endIf
+#endDef
+
+
+def _formatTimeStamp(second):
+  """
+    Return a tuple of the given second (a time.time() value truncated to an integer),
+    the text time stamp prefix, the ISO 8601 time stamp prefix and the UTC offset.
+    See Trace.timeStampCache.
+  """
+  localTime = time.localtime(second)
+  if (localTime.tm_isdst > 0):
+    utcOffset = -time.altzone
+  else:
+    utcOffset = -time.timezone
+  #endIf
+  if (utcOffset < 0):
+    sign = "-"
+  else:
+    sign = "+"
+  #endIf
+  return (second,
+          "[%s." % time.strftime("%y/%m/%d %H:%M:%S",localTime),
+          "%s." % time.strftime("%Y-%m-%dT%H:%M:%S",localTime),
+          "%s%02d:%02d" % (sign,abs(utcOffset) / 3600,(abs(utcOffset) % 3600) / 60))
+#endDef
+
+
+def _stackRepeat(fingerprint):
+  """
+    Return None when the exception stack with the given fingerprint is to be dumped in
+    full, which is when it has not been dumped within the last Trace.stackDedupWindow
+    seconds.  Otherwise count the repeat and return the line that replaces the dump.
+  """
+  now = time.time()
+  Trace.stackFingerprintsLock.acquire()
+  try:
+    entry = Trace.stackFingerprints.get(fingerprint)
+    if (entry != None and now - entry[0] < Trace.stackDedupWindow):
+      entry[1] += 1
+      return "\tStack fingerprint: %s, same as the stack dumped at %s, repeat %d" % \
+             (fingerprint,time.strftime("%y/%m/%d %H:%M:%S",time.localtime(entry[0])),entry[1])
+    #endIf
+    if (len(Trace.stackFingerprints) >= 1000):
+      # Keep the fingerprints from growing without bound.
+      for expired in [key for key,value in Trace.stackFingerprints.items() if now - value[0] >= Trace.stackDedupWindow]:
+        del Trace.stackFingerprints[expired]
+      #endFor
+    #endIf
+    Trace.stackFingerprints[fingerprint] = [now,0]
+  finally:
+    Trace.stackFingerprintsLock.release()
+  #endTry
+  return None
+#endDef
+
+
+def _formatMessage(msg,args):
+  """
+    Return the given message format with the given arguments substituted.
+  """
+  if (len(args) == 1 and type(args[0]) == type({})):
+    # A single dictionary argument is for a format with mapping keys, e.g., %(name)s
+    args = args[0]
+  #endIf
+  try:
+    return msg % args
+  except (TypeError,ValueError,KeyError):
+    # Trace must not raise because of a bad format, emit the format and the arguments.
+    return "%s %s" % (msg,args)
+  #endTry
+#endDef
+
+
+def _formatBufferedRecords(records):
+  """
+    Return a tuple of the list of the given ring buffer records formatted for the 
+    trace log file and the list of them formatted for stdout.
+  """
+  fileRecords = []
+  consoleRecords = []
+  timeStamps = {}
+  for trace,now,threadTag,eventType,lineNumber,methodName,msg,args in records:
+    if (args):
+      msg = _formatMessage(msg,args)
+    #endIf
+    second = int(now)
+    timeStampCache = timeStamps.get(second)
+    if (timeStampCache == None):
+      timeStampCache = _formatTimeStamp(second)
+      timeStamps[second] = timeStampCache
+    #endIf
+    fileRecord,consoleRecord = trace._formatRecords(timeStampCache,int((now - second) * 1000000),threadTag,
+                                                    eventType,lineNumber,methodName,msg,None,None)
+    if (fileRecord != None):
+      fileRecords.append(fileRecord)
+    #endIf
+    if (consoleRecord != None):
+      consoleRecords.append(consoleRecord)
+    #endIf
+  #endFor
+  return (fileRecords,consoleRecords)
+#endDef
+
+
+def _setTraceFile(traceFile):
+  """
+    Write the records queued by the asynchronous sink to the current trace log file,
+    then close it and make the given file the trace log file.
+  """
+  if (Trace.asyncWriter != None):
+    Trace.asyncWriter.flush()
+  #endIf
+  try:
+    Trace.traceFileLock.acquire()
+    if (Trace.traceFile != None):
+      Trace.traceFile.close()
+    #endIf
+    Trace.traceFile = traceFile
+    Trace.traceFilePath = None
+    if (traceFile != None):
+      Trace.traceFilePath = traceFile.name
+      Trace.traceFileSize = os.fstat(traceFile.fileno()).st_size
+      Trace.traceFileOpened = time.time()
+    #endIf
+  finally:
+    Trace.traceFileLock.release()
+  #endTry
+#endDef
+
+
+def _writeTraceFile(text):
+  """
+    Write the given text to the trace log file and rotate the trace log file if it 
+    has reached the rotation size or has been open for the rotation interval.
+    The caller holds Trace.traceFileLock.
+  """
+  Trace.traceFile.write(text)
+  Trace.traceFile.flush()
+  Trace.traceFileSize += len(text)
+  if ((Trace.rotateSize and Trace.traceFileSize >= Trace.rotateSize) or 
+      (Trace.rotateInterval and time.time() - Trace.traceFileOpened >= Trace.rotateInterval)):
+    _rotateTraceFile()
+  #endIf
+#endDef
+
+
+def _rotateTraceFile():
+  """
+    Rename the trace log file to a segment named with the current time, open a new 
+    trace log file with the same path and start a thread that compresses the segment.
+    The caller holds Trace.traceFileLock.
+  """
+  path = Trace.traceFilePath
+  Trace.traceFile.close()
+  # Segments rotated in the same second get an increasing count suffix so the
+  # segments sort in the order they were rotated.
+  stamp = time.strftime("%Y%m%d-%H%M%S")
+  if (stamp == Trace.segmentStamp):
+    Trace.segmentCount += 1
+  else:
+    Trace.segmentStamp = stamp
+    Trace.segmentCount = 0
+  #endIf
+  while (True):
+    segmentPath = "%s.%s" % (path,stamp)
+    if (Trace.segmentCount):
+      segmentPath = "%s-%d" % (segmentPath,Trace.segmentCount)
+    #endIf
+    if (not os.path.exists(segmentPath) and not os.path.exists("%s.gz" % segmentPath)):
+      break
+    #endIf
+    Trace.segmentCount += 1
+  #endWhile
+  try:
+    os.rename(path,segmentPath)
+  except OSError:
+    exc_type,exc_value = sys.exc_info()[:2]
+    sys.stderr.write("Failed to rotate the trace log file: %s. Type: %s, Value: %s\n" % (path,exc_type,exc_value))
+    segmentPath = None
+  #endTry
+
+  # Keep appending to the trace log file if it could not be renamed.
+  Trace.traceFile = open(path,"a")
+  Trace.traceFileSize = os.fstat(Trace.traceFile.fileno()).st_size
+  Trace.traceFileOpened = time.time()
+
+  if (segmentPath):
+    compressor = Thread(target=_compressTraceSegment,args=(segmentPath,path,Trace.rotateKeep),name="TraceSegmentCompressor")
+    compressor.start()
+  #endIf
+#endDef
+
+
+# The name of a compressed rotated segment of a trace log file after the trace log file name
+TraceSegmentPattern = re.compile(r'\.(\d{8}-\d{6})(-(\d+))?\.gz$')
+
+def _compressTraceSegment(segmentPath,path,keep):
+  """
+    Compress the given rotated segment of the trace log file with the given path, then 
+    delete the oldest segments of the trace log file beyond the given number to keep.
+    A keep of 0 keeps all segments.  Runs on its own thread.  Failures are reported on stderr.
+  """
+  try:
+    tmpPath = "%s.gz.tmp" % segmentPath
+    segmentFile = open(segmentPath,"rb")
+    try:
+      gzipFile = gzip.open(tmpPath,"wb")
+      try:
+        shutil.copyfileobj(segmentFile,gzipFile,1024*1024)
+      finally:
+        gzipFile.close()
+      #endTry
+    finally:
+      segmentFile.close()
+    #endTry
+    os.rename(tmpPath,"%s.gz" % segmentPath)
+    os.remove(segmentPath)
+    if (not keep):
+      return
+    #endIf
+
+    directory = os.path.dirname(path) or "."
+    baseName = os.path.basename(path)
+    # Only compressed segments are counted and deleted, a segment that is still being
+    # compressed by another thread is left alone.  Segments are ordered by their time
+    # and count suffix.
+    segments = []
+    for fileName in os.listdir(directory):
+      match = None
+      if (fileName.startswith(baseName)):
+        match = TraceSegmentPattern.match(fileName[len(baseName):])
+      #endIf
+      if (match):
+        segments.append((match.group(1),int(match.group(3) or 0),os.path.join(directory,fileName)))
+      #endIf
+    #endFor
+    segments.sort()
+    for stamp,count,segmentFilePath in segments[:max(0,len(segments) - keep)]:
+      try:
+        os.remove(segmentFilePath)
+      except OSError:
+        # Another compressor thread may have deleted it.
+        pass
+      #endTry
+    #endFor
+  except:
+    exc_type,exc_value = sys.exc_info()[:2]
+    sys.stderr.write("Failed to compress the trace log segment: %s. Type: %s, Value: %s\n" % (segmentPath,exc_type,exc_value))
+  #endTry
+#endDef
+
+
+def rotateTraceLog():
+  """
+    Rotate the trace log file now.  The records queued by the asynchronous sink are
+    written to the trace log file first.
+  """
+  if (Trace.asyncWriter != None):
+    Trace.asyncWriter.flush()
+  #endIf
+  try:
+    Trace.traceFileLock.acquire()
+    if (Trace.traceFile != None):
+      _rotateTraceFile()
+    #endIf
+  finally:
+    Trace.traceFileLock.release()
+  #endTry
+#endDef
+
+
+def openTraceLog(logPath):
+  _setTraceFile(open(logPath,"w"))
+#endDef
+
+def appendTraceLog(logPath):
+  _setTraceFile(open(logPath,"a"))
+#endDef
+
+
+def _writeSuppressedCounts():
+  """
+    Write the counts of the rate limited records that have not been written yet.
+  """
+  for trace in list(Trace.tracedEntities.values()):
+    if (trace.rateLimit):
+      trace._writeSuppressedCounts()
+    #endIf
+  #endFor
+#endDef
+
+
+def closeTraceLog():
+  _writeSuppressedCounts()
+  _setTraceFile(None)
+#endDef
+
+
+def flushTraceLog():
+  """
+    Write the counts of the rate limited records that have not been written yet, then
+    wait until the trace records queued by the asynchronous sink have been written.
+  """
+  _writeSuppressedCounts()
+  if (Trace.asyncWriter != None):
+    Trace.asyncWriter.flush()
+  #endIf
+#endDef
+
+
+def startAsyncWriter(flushInterval=1.0,flushSize=65536):
+  """
+    Start the asynchronous trace sink.  If it is already started it is restarted with
+    the given flushInterval and flushSize.
+  """
+  stopAsyncWriter()
+  Trace.asyncWriter = AsyncTraceWriter(flushInterval=flushInterval,flushSize=flushSize)
+#endDef
+
+
+def stopAsyncWriter():
+  """
+    Write the trace records queued by the asynchronous sink and stop it.
+    Trace records are then written by the thread that emits them.
+  """
+  asyncWriter = Trace.asyncWriter
+  if (asyncWriter != None):
+    Trace.asyncWriter = None
+    asyncWriter.stop()
+  #endIf
+#endDef
+
+# Queued trace records are written when the interpreter exits.
+atexit.register(stopAsyncWriter)
+
+
+def _jsonString(value):
+  """
+    Return the given value as a JSON string.  A value that is not a string is converted
+    with str() and a byte string that is not UTF-8 is decoded with replacement characters.
+  """
+  if (type(value) != type("") and type(value) != type(u"")):
+    try:
+      value = str(value)
+    except UnicodeError:
+      value = unicode(value)
+    #endTry
+  #endIf
+  try:
+    return _jsonEncodeString(value)
+  except (UnicodeError,ValueError):
+    return _jsonEncodeString(value.decode('utf-8','replace'))
+  #endTry
+#endDef
+
+
+def _jsonValue(value):
+  """
+    Return the given value serialized as JSON, or as a JSON string if it can't be serialized.
+  """
+  try:
+    return _json.dumps(value)
+  except (TypeError,ValueError,OverflowError):
+    return _jsonString(value)
+  #endTry
+#endDef
+
+
+def setTraceContext(**fields):
+  """
+    Set the given fields in the context of the JSON trace records, e.g.,
+      setTraceContext(stackName="mystack",fqdn="boot.example.com")
+    A field with the value None is removed from the context.
+  """
+  context = dict(Trace.traceContext)
+  for name,value in fields.items():
+    if (value == None):
+      context.pop(name,None)
+    else:
+      context[name] = value
+    #endIf
+  #endFor
+  contextJSON = ""
+  if (context):
+    members = ["%s:%s" % (_jsonString(name),_jsonValue(value)) for name,value in sorted(context.items())]
+    contextJSON = ',"context":{%s}' % ",".join(members)
+  #endIf
+  Trace.traceContext = context
+  Trace.traceContextJSON = contextJSON
+#endDef
+
+
+def parseTraceString(traceString):
+  """
+    Return a list of TraceSpecification instances that represent a parsing of the given trace string.
+    The returned list holds a TraceSpecifification instance for each trace specification in the given 
+    trace string.
+  """
+  result = []
+  # If the given traceString is enclosed in double-quotes,
+  # then strip the double-quotes.
+  if (traceString[0] == '"' and traceString[-1] == '"'):
+    traceString = traceString[1:-1]
+  #endIf
+  traceStrings = traceString.split(":")
+  for trace in traceStrings:
+    if (trace.startswith("@")):
+      # trace options are handled by parseTraceOptions()
+      continue
+    #endIf
+    traceParts = trace.split("=")
+    if (len(traceParts) != 2):
+      raise TraceSpecificationException("Encountered an invalid trace string: %s  A trace string looks like <module_pattern>=<level>." % trace)
+    #endIf
+    
+    modulePattern = traceParts[0]
+    level = traceParts[1]
+    result.append(TraceSpecification(modulePattern,level))
+  #endFor
+  return result
+#endDef
+
+
+def setTraceSpec(traceString):
   """
     Given a trace specification string, set the module traceSpec used by all instances of Trace.
   """
@@ -1335,10 +2843,143 @@ def setTraceSpec(traceString):
   #endIf
   
   Trace.traceSpec = parseTraceString(traceString)
+  Trace.traceOptions = parseTraceOptions(traceString)
   Trace.traceString = traceString
 #endDef
 
 
+def parseTraceOptions(traceString):
+  """
+    Return a dictionary with the value of each trace option, @<name>=<value>, in the
+    given trace string keyed by the option name.
+  """
+  result = {}
+  if (traceString[0] == '"' and traceString[-1] == '"'):
+    traceString = traceString[1:-1]
+  #endIf
+  for trace in traceString.split(":"):
+    if (not trace.startswith("@")):
+      continue
+    #endIf
+    optionParts = trace[1:].split("=")
+    if (len(optionParts) != 2 or not optionParts[0]):
+      raise TraceSpecificationException("Encountered an invalid trace option: %s  A trace option looks like @<name>=<value>." % trace)
+    #endIf
+    name = optionParts[0]
+    if (name not in Trace.TraceOptionNames and not name.startswith(Trace.RateLimitOptionPrefix)):
+      raise TraceSpecificationException("Unknown trace option: %s  Valid trace options: %s" % (name,Trace.TraceOptionNames))
+    #endIf
+    result[name] = optionParts[1]
+  #endFor
+  return result
+#endDef
+
+
+def configureTraceOptions(options):
+  """
+    Apply the given dictionary of trace options.  See parseTraceOptions().
+  """
+  traceFormat = options.get('format',Trace.Text).lower()
+  if (traceFormat not in Trace.TraceFormats):
+    raise TraceSpecificationException("Unknown trace format: %s  Valid trace formats: %s" % (traceFormat,Trace.TraceFormats))
+  #endIf
+  Trace.TraceFormat = traceFormat
+
+  try:
+    Trace.rotateSize = _parseQuantity(options.get('rotate.size','0'),SizeUnits)
+    Trace.rotateInterval = _parseQuantity(options.get('rotate.interval','0'),TimeUnits)
+    Trace.rotateKeep = int(options.get('rotate.keep',0))
+  except ValueError:
+    raise TraceSpecificationException("Invalid trace option value in: %s  @rotate.size is a number of bytes, @rotate.interval a number of seconds and @rotate.keep a count." % options)
+  #endTry
+
+  try:
+    Trace.StackDepth = int(options.get('stackDepth',10))
+    Trace.FrameStackDepth = None
+    if (options.get('frameDepth')):
+      Trace.FrameStackDepth = int(options['frameDepth'])
+    #endIf
+    Trace.stackDedupWindow = _parseQuantity(options.get('stackDedupWindow','0'),TimeUnits)
+  except ValueError:
+    raise TraceSpecificationException("Invalid trace option value in: %s  @stackDepth and @frameDepth are a number of frames and @stackDedupWindow is a number of seconds." % options)
+  #endTry
+
+  rateLimitSpecs = []
+  try:
+    for name,value in options.items():
+      if (name.startswith(Trace.RateLimitOptionPrefix)):
+        rateLimitSpecs.append(RateLimitSpecification(name[len(Trace.RateLimitOptionPrefix):],_parseQuantity(value,TimeUnits)))
+      #endIf
+    #endFor
+    if (options.get('ratelimit')):
+      rateLimitSpecs.append(RateLimitSpecification("*",_parseQuantity(options['ratelimit'],TimeUnits)))
+    #endIf
+  except ValueError:
+    raise TraceSpecificationException("Invalid trace option value in: %s  @ratelimit and @ratelimit.<pattern> are a number of seconds." % options)
+  #endTry
+  # The most specific pattern is the longest one.  The * of the default rate limit is last.
+  rateLimitSpecs.sort(key=lambda spec: len(spec.pattern),reverse=True)
+  Trace.rateLimitSpecs = rateLimitSpecs
+  for trace in Trace.tracedEntities.values():
+    trace._configureRateLimit()
+  #endFor
+
+  persist = options.get('persist')
+  if (persist):
+    persistLevel = Trace.traceLevels.get(persist.lower())
+    if (persistLevel == None or persistLevel < Level.ERROR):
+      raise TraceSpecificationException("Invalid persisted trace level: %s  Valid levels: error or a more verbose trace level." % persist)
+    #endIf
+    scope = options.get('ring.scope',TraceRingBuffer.Thread).lower()
+    if (scope not in TraceRingBuffer.Scopes):
+      raise TraceSpecificationException("Unknown ring buffer scope: %s  Valid scopes: %s" % (scope,TraceRingBuffer.Scopes))
+    #endIf
+    try:
+      maxRecords = int(options.get('ring.size',1000))
+      maxBytes = _parseQuantity(options.get('ring.bytes','1M'),SizeUnits)
+    except ValueError:
+      raise TraceSpecificationException("Invalid trace option value in: %s  @ring.size is a count and @ring.bytes is a number of bytes." % options)
+    #endTry
+    # The level is set first so no record is buffered by the new ring buffer at the old level.
+    Trace.persistLevel = persistLevel
+    Trace.ringBuffer = TraceRingBuffer(scope=scope,maxRecords=maxRecords,maxBytes=maxBytes)
+  else:
+    Trace.ringBuffer = None
+    Trace.persistLevel = Level.FINEST
+  #endIf
+
+  sink = options.get('sink','sync').lower()
+  if (sink == 'async'):
+    try:
+      flushInterval = float(options.get('sink.flushInterval',1.0))
+      flushSize = int(options.get('sink.flushSize',65536))
+    except ValueError:
+      raise TraceSpecificationException("Invalid trace option value in: %s  @sink.flushInterval is a number of seconds and @sink.flushSize is a number of bytes." % options)
+    #endTry
+    startAsyncWriter(flushInterval=flushInterval,flushSize=flushSize)
+  elif (sink == 'sync'):
+    stopAsyncWriter()
+  else:
+    raise TraceSpecificationException("Unknown trace sink: %s  Valid trace sinks: sync, async" % sink)
+  #endIf
+#endDef
+
+
+def _parseQuantity(value,units):
+  """
+    Return the integer value of the given string that is a number optionally followed
+    by one of the unit suffixes in the given dictionary of suffix and multiplier.
+  """
+  value = value.strip().lower()
+  multiplier = 1
+  if (value and value[-1] in units):
+    multiplier = units[value[-1]]
+    value = value[:-1]
+  #endIf
+  return int(float(value) * multiplier)
+#endDef
+
+
 def getTraceSpec():
   """
     Return the module traceSpec used by all instances of Trace.
@@ -1356,6 +2997,7 @@ def configureTrace(traceString):
   """
   
   setTraceSpec(traceString)
+  configureTraceOptions(Trace.traceOptions)
   registeredModules = Trace.tracedEntities.keys()
   for module in registeredModules:
     for spec in Trace.traceSpec: